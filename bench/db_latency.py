@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Latency of JupyterHub database writes with the deployment's database settings
+
+Creates a JupyterHub database using JupyterHub's ORM, configured as in the
+JupyterHub configuration files (bricshub.db), with a number of users, then
+times the database work of the requests which dominate at scale, the way the
+Hub does it (one session, a commit per request):
+
+* activity: a single-user server reporting activity (POST
+  /hub/api/users/<name>/activity), updating last_activity of the user and
+  server
+* token: looking up the API token of a user's server, as for each API request
+  from a single-user server
+* spawn: a server being started (creating its server record and API token,
+  then saving the spawner state after the job is submitted and when the server
+  is ready)
+* stop: a server being stopped (removing its server record and API token and
+  clearing the spawner state)
+
+Compare backends by re-running with different settings, e.g. --sqlite-journal-mode
+DELETE --sqlite-synchronous FULL for SQLite's defaults, or --db-url for a
+PostgreSQL server (see "Benchmarking spawn storms" in the top-level README.md).
+
+Requires JupyterHub (and psycopg2 for PostgreSQL), e.g. run inside the
+JupyterHub container image.
+"""
+
+import argparse
+import math
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from jupyterhub import orm
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR / "brics_jupyterhub"))
+
+from bricshub.db import enable_sqlite_pragmas, pool_kwargs, sqlite_pragmas  # noqa: E402
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=1000, help="number of users (default: %(default)s)")
+    parser.add_argument(
+        "--rounds", type=int, default=3, help="times each operation is run for every user (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--db-url",
+        help="database URL (dbUrl key), e.g. postgresql://postgres@127.0.0.1/jupyterhub (default: new SQLite file)",
+    )
+    parser.add_argument("--db-pool-size", type=int, default=5, help="connection pool size (dbPoolSize key)")
+    parser.add_argument("--sqlite-journal-mode", default="WAL", help="SQLite journal mode (dbSqliteJournalMode key)")
+    parser.add_argument("--sqlite-synchronous", default="NORMAL", help="SQLite synchronous (dbSqliteSynchronous key)")
+    return parser.parse_args()
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Nearest-rank percentile of `values`"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class DatabaseBench:
+    def __init__(self, db, users: int):
+        self.db = db
+        self.names = [f"bench{i:05d}" for i in range(users)]
+        self.tokens: dict[str, str] = {}
+        self.job_ids = iter(range(1, sys.maxsize))
+
+    def create_users(self) -> None:
+        self.db.add(orm.OAuthClient(identifier="jupyterhub"))
+        for name in self.names:
+            user = orm.User(name=name)
+            self.db.add(user)
+            self.db.add(orm.Spawner(user=user, name=""))
+        self.db.commit()
+
+    def spawner(self, name: str) -> orm.Spawner:
+        return orm.User.find(self.db, name).orm_spawners[""]
+
+    def spawn(self, name: str) -> None:
+        spawner = self.spawner(name)
+        spawner.server = orm.Server(base_url=f"/user/{name}/")
+        spawner.started = now()
+        self.db.commit()
+        self.tokens[name] = spawner.user.new_api_token(note=f"Server at /user/{name}/")
+        spawner.state = {"job_id": str(next(self.job_ids)), "job_status": "PENDING"}
+        self.db.commit()
+        spawner.server.ip, spawner.server.port = "10.0.0.1", 50000
+        spawner.state = {**spawner.state, "job_status": "RUNNING node001"}
+        self.db.commit()
+
+    def activity(self, name: str) -> None:
+        user = orm.User.find(self.db, name)
+        user.last_activity = user.orm_spawners[""].last_activity = now()
+        self.db.commit()
+
+    def token(self, name: str) -> None:
+        if orm.APIToken.find(self.db, self.tokens[name]) is None:
+            raise RuntimeError(f"Token for {name} not found")
+
+    def stop(self, name: str) -> None:
+        spawner = self.spawner(name)
+        self.db.delete(orm.APIToken.find(self.db, self.tokens.pop(name)))
+        self.db.delete(spawner.server)
+        spawner.server = None
+        spawner.state = {}
+        self.db.commit()
+
+    def run(self, rounds: int) -> dict[str, list[float]]:
+        latencies = {}
+        for operation in ("spawn", "activity", "token", "stop"):
+            latencies[operation] = []
+            for _ in range(rounds if operation in ("activity", "token") else 1):
+                for name in self.names:
+                    started_at = time.perf_counter()
+                    getattr(self, operation)(name)
+                    latencies[operation].append(time.perf_counter() - started_at)
+        return latencies
+
+
+def main() -> int:
+    args = parse_args()
+    with tempfile.TemporaryDirectory(prefix="db-latency-") as tmp_dir:
+        db_url = args.db_url or f"sqlite:///{tmp_dir}/jupyterhub.sqlite"
+        if db_url.startswith("sqlite"):
+            enable_sqlite_pragmas(sqlite_pragmas(args.sqlite_journal_mode, args.sqlite_synchronous))
+            kwargs = {}
+            backend = f"SQLite (journal mode {args.sqlite_journal_mode}, synchronous {args.sqlite_synchronous})"
+        else:
+            kwargs = pool_kwargs(pool_size=args.db_pool_size)
+            backend = f"{db_url} (pool size {args.db_pool_size})"
+        db = orm.new_session_factory(db_url, reset=True, **kwargs)()
+
+        bench = DatabaseBench(db, args.users)
+        bench.create_users()
+        latencies = bench.run(args.rounds)
+        db.close()
+        orm.Base.metadata.drop_all(db.get_bind())
+
+    print(f"Database latency: {args.users} users, {backend}")
+    print(f"  {'latency (ms)':<14}{'n':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}{'ops/s':>9}")
+    for operation, values in latencies.items():
+        stats = [1000 * percentile(values, p) for p in (50, 95, 99, 100)]
+        rate = len(values) / sum(values)
+        print(f"  {operation:<14}{len(values):>7}" + "".join(f"{v:>9.3f}" for v in stats) + f"{rate:>9.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
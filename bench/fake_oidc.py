@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OIDC server used by BricsAuthenticator
+
+Serves an OIDC discovery document and JWKS for a locally generated RSA signing
+key, and issues tokens signed with it, so that JWT verification and the OIDC
+metadata cache (bricshub.oidc) can be exercised without a real OIDC server:
+
+* GET /.well-known/openid-configuration: discovery document
+* GET /jwks: JWKS containing the current and previous signing keys
+* GET /token?sub=<name>&projects=<json>&lifetime=<seconds>: a signed token
+* POST /rotate: generate a new signing key (tokens are then signed with a key
+  ID not in JWKS copies fetched before the rotation)
+* POST /fail, POST /recover: start or stop failing discovery and JWKS requests
+* GET /stats: number of discovery and JWKS requests served
+
+Use --delay to emulate a slow OIDC server and --fail (or POST /fail) to make
+discovery and JWKS requests fail, e.g. to check that cached metadata is served
+while the server is slow or unavailable. Point BricsAuthenticator at the server
+using `c.BricsAuthenticator.oidc_server = "http://127.0.0.1:<port>"`.
+
+Requires PyJWT and cryptography (installed with bricsauthenticator).
+"""
+
+import argparse
+import json
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+
+class SigningKeys:
+    """Current and previous RSA signing keys, identified by key ID"""
+
+    def __init__(self):
+        self.keys = []
+        self.rotate()
+
+    def rotate(self) -> None:
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.keys = [(uuid.uuid4().hex, key), *self.keys[:1]]
+
+    @property
+    def current(self):
+        return self.keys[0]
+
+    def jwks(self) -> dict:
+        keys = []
+        for kid, key in self.keys:
+            jwk = jwt.algorithms.RSAAlgorithm.to_jwk(key.public_key(), as_dict=True)
+            keys.append({**jwk, "kid": kid, "use": "sig", "alg": "RS256"})
+        return {"keys": keys}
+
+
+def make_handler(args: argparse.Namespace, keys: SigningKeys, stats: dict):
+    issuer = f"http://{args.host}:{args.port}"
+
+    class Handler(BaseHTTPRequestHandler):
+        def send_json(self, status: int, body: dict) -> None:
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def serve_metadata(self, name: str, body: dict) -> None:
+            stats[name] += 1
+            time.sleep(args.delay)
+            if args.fail:
+                self.send_json(503, {"error": "unavailable"})
+            else:
+                self.send_json(200, body)
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            if url.path == "/.well-known/openid-configuration":
+                self.serve_metadata(
+                    "discovery",
+                    {
+                        "issuer": issuer,
+                        "jwks_uri": f"{issuer}/jwks",
+                        "id_token_signing_alg_values_supported": ["RS256"],
+                    },
+                )
+            elif url.path == "/jwks":
+                self.serve_metadata("jwks", keys.jwks())
+            elif url.path == "/token":
+                now = int(time.time())
+                claims = {
+                    "iss": issuer,
+                    "aud": query.get("aud", args.audience),
+                    "sub": query.get("sub", "test"),
+                    "short_name": query.get("sub", "test"),
+                    "iat": now,
+                    "exp": now + int(query.get("lifetime", 3600)),
+                    "projects": json.loads(query.get("projects", "{}")),
+                }
+                kid, key = keys.current
+                token = jwt.encode(claims, key, algorithm="RS256", headers={"kid": kid})
+                self.send_json(200, {"token": token})
+            elif url.path == "/stats":
+                self.send_json(200, stats)
+            else:
+                self.send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            path = urlsplit(self.path).path
+            if path == "/rotate":
+                keys.rotate()
+                self.send_json(200, {"kid": keys.current[0]})
+            elif path in ("/fail", "/recover"):
+                args.fail = path == "/fail"
+                self.send_json(200, {"fail": args.fail})
+            else:
+                self.send_json(404, {"error": "not found"})
+
+        def log_message(self, format, *log_args):
+            if args.verbose:
+                super().log_message(format, *log_args)
+
+    return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--audience", default="jupyterhub", help="default aud claim of issued tokens")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to wait before answering metadata requests")
+    parser.add_argument("--fail", action="store_true", help="answer metadata requests with 503")
+    parser.add_argument("--verbose", action="store_true", help="log each request")
+    args = parser.parse_args()
+
+    stats = {"discovery": 0, "jwks": 0}
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args, SigningKeys(), stats))
+    print(f"Fake OIDC server listening on http://{args.host}:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Slurm REST API (slurmrestd)
+
+Serves the parts of the v0.0.40 REST API used by BricsHubSlurmSpawner when
+`slurm_rest_url` is set, managing the same fake jobs as fakeslurm.py (jobs
+wait in the queue, then run the batch script on the local machine):
+
+* POST /slurm/v0.0.40/job/submit: submit the script with the job description's
+  name and environment
+* GET /slurm/v0.0.40/jobs: states of all pending and running jobs
+* GET /slurm/v0.0.40/job/<job_id>: state of a pending or running job (Slurm
+  error 2017, invalid job ID, otherwise)
+* DELETE /slurm/v0.0.40/job/<job_id>: cancel a job
+
+Requests must be authenticated as in slurmrestd with auth/jwt: the
+X-SLURM-USER-TOKEN header must contain a HS256 JWT signed with the key in
+--jwt-key-file whose "sun" claim matches the X-SLURM-USER-NAME header.
+Connections are persistent (HTTP/1.1), as for slurmrestd.
+
+Each request is logged to $BENCH_STATE_DIR/calls.log as the corresponding
+Slurm command (sbatch, squeue or scancel), taking BENCH_SLURM_RPC_DELAY
+seconds as for fakeslurm.py, and each new connection as slurmrestd-connect.
+spawn_storm.py starts this server when run with --slurm-rest.
+
+Requires PyJWT (installed with bricsauthenticator).
+"""
+
+import argparse
+import json
+import re
+import signal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jwt
+
+import fakeslurm
+
+# Slurm error number for an invalid job ID
+ESLURM_INVALID_JOB_ID = 2017
+
+
+def job_info(job: dict) -> dict:
+    return {
+        "job_id": int(job["id"]),
+        "name": job["name"],
+        "job_state": [job["state"]],
+        "batch_host": job["node"] if job["state"] == "RUNNING" else "",
+        "partition": "workq",
+    }
+
+
+def make_handler(args: argparse.Namespace, key: bytes):
+    prefix = f"/slurm/{args.api_version}/"
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            fakeslurm.log_call("slurmrestd-connect")
+
+        def send_json(self, status: int, body: dict) -> None:
+            data = json.dumps({"errors": [], "warnings": [], **body}).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def send_error_json(self, status: int, error_number: int, description: str) -> None:
+            self.send_json(status, {"errors": [{"error_number": error_number, "description": description}]})
+
+        def authenticated(self) -> bool:
+            user = self.headers.get("X-SLURM-USER-NAME", "")
+            try:
+                claims = jwt.decode(self.headers.get("X-SLURM-USER-TOKEN", ""), key, algorithms=["HS256"])
+            except jwt.InvalidTokenError as e:
+                self.send_error_json(401, 1007, f"Invalid token: {e}")
+                return False
+            if claims.get("sun") != user:
+                self.send_error_json(401, 1007, f"Token is not valid for user {user}")
+                return False
+            return True
+
+        def read_body(self) -> dict:
+            return json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+
+        def route(self, method: str) -> None:
+            path = self.path.split("?")[0]
+            if not path.startswith(prefix):
+                self.send_error_json(404, 9002, f"Unknown path {path}")
+                return
+            path = path[len(prefix) :]
+            if not self.authenticated():
+                return
+            job_match = re.fullmatch(r"job/(\d+)", path)
+            if method == "POST" and path == "job/submit":
+                body = self.read_body()
+                fakeslurm.slurm_rpc("sbatch")
+                job = body.get("job", {})
+                env = dict(item.split("=", 1) for item in job.get("environment", []))
+                if not env:
+                    self.send_error_json(500, 2105, "Job environment required")
+                    return
+                job_id = fakeslurm.submit_job(
+                    body["script"], fakeslurm.job_base_env(env), name=job.get("name", "sbatch"), get_user_env=False
+                )
+                self.send_json(200, {"job_id": int(job_id), "step_id": "batch"})
+            elif method == "GET" and path == "jobs":
+                fakeslurm.slurm_rpc("squeue")
+                self.send_json(200, {"jobs": [job_info(job) for job in fakeslurm.active_jobs()]})
+            elif method == "GET" and job_match:
+                fakeslurm.slurm_rpc("squeue")
+                job = next((job for job in fakeslurm.active_jobs() if job["id"] == job_match.group(1)), None)
+                if job is None:
+                    self.send_error_json(500, ESLURM_INVALID_JOB_ID, "Invalid job id specified")
+                else:
+                    self.send_json(200, {"jobs": [job_info(job)]})
+            elif method == "DELETE" and job_match:
+                fakeslurm.slurm_rpc("scancel")
+                if fakeslurm.cancel_job(job_match.group(1)):
+                    self.send_json(200, {})
+                else:
+                    self.send_error_json(500, ESLURM_INVALID_JOB_ID, "Invalid job id specified")
+            else:
+                self.send_error_json(404, 9002, f"Unknown endpoint {method} {path}")
+
+        def do_GET(self):
+            self.route("GET")
+
+        def do_POST(self):
+            self.route("POST")
+
+        def do_DELETE(self):
+            self.route("DELETE")
+
+        def log_message(self, format, *log_args):
+            if args.verbose:
+                super().log_message(format, *log_args)
+
+    return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6820)
+    parser.add_argument("--jwt-key-file", required=True, help="file containing the key tokens are signed with")
+    parser.add_argument("--api-version", default="v0.0.40")
+    parser.add_argument("--verbose", action="store_true", help="log each request")
+    args = parser.parse_args()
+
+    with open(args.jwt_key_file, "rb") as f:
+        key = f.read()
+    # Reap exited job processes, which would otherwise appear to be running
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args, key))
+    print(f"Fake slurmrestd listening on http://{args.host}:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the commands JupyterHub runs to manage Slurm jobs
+
+This is a multi-call script: the command emulated is selected by the name it is
+invoked as (symlinks are created by spawn_storm.py), so that the unmodified
+JupyterHub configuration can be run against it on a single machine:
+
+* ssh: run the remote command locally in `bash -c`, after a delay emulating
+  a full connection or a session over an existing multiplexed connection
+  (using a marker file at `ControlPath`), or fail to connect to hosts listed
+  in $BENCH_SSH_DOWN_HOSTS
+* sudo: run the command (with any `VAR=value` assignments) as the current user
+* sbatch, slurmspawner_sbatch: submit the batch script on stdin as a job
+* squeue, slurmspawner_squeue: report states of pending and running jobs (or,
+  with --start, expected start times of pending jobs, at the end of the queue
+  delay, in partition "workq")
+* scancel, slurmspawner_scancel: cancel a job
+* scontrol: show partitions, nodes (GPUs allocated to running jobs, one per
+  job) and reservations (none) of a cluster of $BENCH_CLUSTER_NODES nodes with
+  4 GPUs each, in --oneliner format
+* srun: run the command
+* slurmspawner_user_env: output the current environment as the user's login
+  environment, after a delay emulating a login shell ($BENCH_LOGIN_SHELL_DELAY),
+  unless the fingerprint on stdin is current
+* batchspawner-singleuser: minimal single-user server which reports its port
+  to the Hub (like batchspawner-singleuser) and answers all HTTP requests
+
+The job functions are also used by fake_slurmrestd.py, a stand-in for the
+Slurm REST API.
+
+Jobs are stored as JSON files in $BENCH_STATE_DIR/jobs. Each job is run by a
+detached process which waits for the queue delay, marks the job as running and
+then runs the batch script (after a delay emulating a login shell if the script
+requests --get-user-env). Delays are configured using BENCH_* environment
+variables (see spawn_storm.py). Each invocation is logged to
+$BENCH_STATE_DIR/calls.log as a line containing a timestamp and command name.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import random
+import re
+import signal
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+STATE_DIR = Path(os.environ.get("BENCH_STATE_DIR", "."))
+JOBS_DIR = STATE_DIR / "jobs"
+
+# ssh options which take an argument (from ssh(1) synopsis)
+SSH_OPTS_WITH_ARG = set("BbcDEeFIiJLlmOoPpQRSWw")
+
+
+def env_float(name: str, default: float = 0.0) -> float:
+    return float(os.environ.get(name, default))
+
+
+def log_call(name: str, detail: str = "") -> None:
+    with open(STATE_DIR / "calls.log", "a") as f:
+        f.write(f"{time.time():.6f} {name} {detail}\n")
+
+
+@contextmanager
+def locked(path: Path):
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def slurm_rpc(name: str) -> None:
+    """
+    Emulate a Slurm controller RPC, taking BENCH_SLURM_RPC_DELAY seconds
+
+    If BENCH_SLURM_RPC_SERIAL is set, RPCs are handled one at a time (as a
+    busy slurmctld would), so concurrent commands queue behind each other.
+    """
+    log_call(name)
+    delay = env_float("BENCH_SLURM_RPC_DELAY")
+    if os.environ.get("BENCH_SLURM_RPC_SERIAL"):
+        with locked(STATE_DIR / "slurmctld.lock"):
+            time.sleep(delay)
+    else:
+        time.sleep(delay)
+
+
+# Job records
+
+
+def job_path(job_id: str) -> Path:
+    return JOBS_DIR / f"{job_id}.json"
+
+
+def read_job(job_id: str) -> dict | None:
+    try:
+        return json.loads(job_path(job_id).read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def write_job(job: dict) -> None:
+    tmp = job_path(job["id"]).with_suffix(f".tmp{os.getpid()}")
+    tmp.write_text(json.dumps(job))
+    tmp.replace(job_path(job["id"]))
+
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def active_jobs() -> list[dict]:
+    """Return records of pending and running jobs, ordered by job ID"""
+    jobs = []
+    for path in JOBS_DIR.glob("*.json"):
+        job = read_job(path.stem)
+        if job and job["state"] in ("PENDING", "RUNNING") and pid_alive(job["pid"]):
+            jobs.append(job)
+    return sorted(jobs, key=lambda job: int(job["id"]))
+
+
+def next_job_id() -> str:
+    counter = STATE_DIR / "job_id"
+    with locked(STATE_DIR / "job_id.lock"):
+        job_id = int(counter.read_text()) + 1 if counter.exists() else 1
+        counter.write_text(str(job_id))
+    return str(job_id)
+
+
+# Commands
+
+
+def ssh(argv: list[str]) -> int:
+    options = {}
+    args = iter(argv)
+    host = None
+    for arg in args:
+        if arg.startswith("-") and len(arg) > 1:
+            flag = arg[1]
+            if flag in SSH_OPTS_WITH_ARG:
+                value = arg[2:] or next(args, "")
+                if flag == "o":
+                    key, _, option_value = value.partition("=")
+                    options[key.lower()] = option_value
+            continue
+        host = arg
+        break
+    command = " ".join(args)
+    if host is None or not command:
+        print("fake ssh: a remote command is required", file=sys.stderr)
+        return 255
+
+    if host.rpartition("@")[2] in os.environ.get("BENCH_SSH_DOWN_HOSTS", "").split():
+        log_call("ssh-refused", host)
+        time.sleep(env_float("BENCH_SSH_CONNECT_DELAY"))
+        print(f"ssh: connect to host {host.rpartition('@')[2]} port 22: Connection refused", file=sys.stderr)
+        return 255
+
+    marker = None
+    if options.get("controlpath") and options.get("controlmaster", "no") != "no":
+        connection_hash = hashlib.sha1(host.encode()).hexdigest()
+        marker = Path(options["controlpath"].replace("%C", connection_hash))
+    persist = float(options.get("controlpersist", "0") or 0)
+
+    if marker is not None and marker.exists() and time.time() - marker.stat().st_mtime < persist:
+        log_call("ssh-mux", host)
+        time.sleep(env_float("BENCH_SSH_MUX_DELAY"))
+    else:
+        log_call("ssh-connect", host)
+        time.sleep(env_float("BENCH_SSH_CONNECT_DELAY"))
+    if marker is not None:
+        marker.parent.mkdir(parents=True, exist_ok=True)
+        marker.touch()
+
+    # The remote command runs in the login shell of the remote user, so does
+    # not inherit the local environment (other than the benchmark settings)
+    env = {name: value for name, value in os.environ.items() if name.startswith("BENCH_")}
+    env.update(PATH=os.environ["PATH"], HOME=os.environ.get("HOME", "/"), LANG="C.UTF-8")
+    return subprocess.run(["bash", "-c", command], env=env).returncode
+
+
+def sudo(argv: list[str]) -> int:
+    log_call("sudo")
+    args = list(argv)
+    while args and args[0].startswith("-"):
+        flag = args.pop(0)
+        if flag in ("-u", "-g"):
+            args.pop(0)
+    assignments = {}
+    while args and re.match(r"^[A-Za-z_][A-Za-z0-9_]*=", args[0]):
+        name, _, value = args.pop(0).partition("=")
+        assignments[name] = value
+    os.execvpe(args[0], args, {**os.environ, **assignments})
+
+
+def job_base_env(exported: dict[str, str]) -> dict[str, str]:
+    """Return the environment of a job exporting only `exported` (plus the benchmark settings)"""
+    return {
+        **exported,
+        **{name: value for name, value in os.environ.items() if name.startswith("BENCH_")},
+        "PATH": os.environ["PATH"],
+        "LANG": "C.UTF-8",
+    }
+
+
+def submit_job(script: str, env: dict[str, str], name: str, get_user_env: bool) -> str:
+    """Create a pending job running `script` with environment `env`, returning its ID"""
+    job_id = next_job_id()
+    job_dir = STATE_DIR / "job_data" / job_id
+    job_dir.mkdir(parents=True)
+    (job_dir / "script.sh").write_text(script)
+
+    # Variables set by Slurm in the job
+    env = dict(
+        env,
+        HOME=str(job_dir),
+        SLURM_JOB_ID=job_id,
+        SLURM_JOB_NAME=name,
+        SLURMD_NODENAME=os.environ.get("BENCH_NODE_HOST", "127.0.0.1"),
+    )
+
+    job = {
+        "id": job_id,
+        "name": name,
+        "state": "PENDING",
+        "node": "n/a",
+        "submitted_at": time.time(),
+        "get_user_env": get_user_env,
+        "pid": 0,
+    }
+    write_job(job)
+    with open(job_dir / "output.log", "wb") as out:
+        proc = subprocess.Popen(
+            [sys.executable, os.path.realpath(__file__), "_run_job", job_id],
+            env=env,
+            cwd=job_dir,
+            stdin=subprocess.DEVNULL,
+            stdout=out,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+    job["pid"] = proc.pid
+    write_job(job)
+    return job_id
+
+
+def sbatch(argv: list[str]) -> int:
+    script = sys.stdin.read()
+    slurm_rpc("sbatch")
+    directives = dict(re.findall(r"^#SBATCH\s+--([\w-]+)=?(\S*)", script, re.MULTILINE))
+    export = directives.get("export", "ALL")
+
+    # Environment of the job: exported variables (as for --export)
+    if export == "ALL":
+        env = dict(os.environ)
+    else:
+        env = job_base_env({name: os.environ[name] for name in export.split(",") if name in os.environ})
+    job_id = submit_job(
+        script, env, name=directives.get("job-name", "sbatch"), get_user_env="get-user-env" in directives
+    )
+    print(job_id)
+    return 0
+
+
+def run_job(job_id: str) -> int:
+    """Wait in the queue, then run the batch script in place of this process"""
+    delay = env_float("BENCH_QUEUE_DELAY") + random.uniform(0, env_float("BENCH_QUEUE_JITTER"))
+    time.sleep(delay)
+    job = read_job(job_id)
+    if job is None or job["state"] != "PENDING":
+        return 0
+    job.update(state="RUNNING", node=os.environ["SLURMD_NODENAME"], started_at=time.time())
+    write_job(job)
+    os.environ["SLURM_JOB_START_TIME"] = str(int(job["started_at"]))
+    if job.get("get_user_env"):
+        # Slurm runs a login shell for the user before starting the script
+        time.sleep(env_float("BENCH_LOGIN_SHELL_DELAY"))
+    os.execvp("bash", ["bash", "script.sh"])
+
+
+def squeue(argv: list[str]) -> int:
+    slurm_rpc("squeue")
+    header = True
+    fmt = "%.18i %.9P %.8j %.8u %.2t %.10M %.6D %R"
+    names = job_ids = None
+    start = False
+    args = iter(argv)
+    for arg in args:
+        key, _, value = arg.partition("=")
+        if key in ("-h", "--noheader"):
+            header = False
+        elif key in ("-o", "--format"):
+            fmt = value or next(args)
+        elif key in ("-n", "--name"):
+            names = set((value or next(args)).split(","))
+        elif key in ("-j", "--jobs"):
+            job_ids = set((value or next(args)).split(","))
+        elif key == "--start":
+            start = True
+
+    fields = {
+        "i": "id",
+        "j": "name",
+        "T": "state",
+        "B": "node",
+        "t": "state",
+        "R": "node",
+        "P": "partition",
+        "S": "start_time",
+        "r": "reason",
+    }
+
+    def format_job(job: dict) -> str:
+        return re.sub(
+            r"%\.?\d*([a-zA-Z])",
+            lambda m: str(job.get(fields.get(m.group(1), ""), "")),
+            fmt,
+        )
+
+    if header:
+        print(format_job({key: key.upper() for key in fields.values()}))
+    for job in active_jobs():
+        if names is not None and job["name"] not in names:
+            continue
+        if job_ids is not None and job["id"] not in job_ids:
+            continue
+        if start:
+            if job["state"] != "PENDING":
+                continue
+            expected = job["submitted_at"] + env_float("BENCH_QUEUE_DELAY")
+            if os.environ.get("SLURM_TIME_FORMAT") == "%s":
+                start_time = str(int(expected))
+            else:
+                start_time = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(expected))
+            job.update(
+                start_time=start_time,
+                reason="(Resources)",
+            )
+        print(format_job({"partition": "workq", **job}))
+    return 0
+
+
+def slurmspawner_squeue(argv: list[str]) -> int:
+    return squeue(["--noheader", "--format=%T %B", f"--jobs={os.environ['SLURMSPAWNER_JOB_ID']}"])
+
+
+def cancel_job(job_id: str) -> bool:
+    """Cancel job `job_id` if pending or running, returning False if there is no such job"""
+    job = read_job(job_id)
+    if job is None:
+        return False
+    if job["state"] in ("PENDING", "RUNNING"):
+        job["state"] = "CANCELLED"
+        write_job(job)
+        try:
+            os.killpg(job["pid"], signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    return True
+
+
+def scancel(argv: list[str]) -> int:
+    slurm_rpc("scancel")
+    for job_id in [arg for arg in argv if not arg.startswith("-")]:
+        if not cancel_job(job_id):
+            print(f"scancel: error: Invalid job id {job_id}", file=sys.stderr)
+            return 1
+    return 0
+
+
+def slurmspawner_scancel(argv: list[str]) -> int:
+    return scancel([os.environ["SLURMSPAWNER_JOB_ID"]])
+
+
+def scontrol(argv: list[str]) -> int:
+    slurm_rpc("scontrol")
+    entity = next((arg for arg in argv[argv.index("show") + 1 :] if not arg.startswith("-")), "")
+    nodes = int(os.environ.get("BENCH_CLUSTER_NODES", "16"))
+    if entity.startswith("partition"):
+        print(f"PartitionName=workq Default=YES MaxTime=1-00:00:00 Nodes=node[1-{nodes}] State=UP TotalNodes={nodes}")
+    elif entity.startswith("node"):
+        allocated = sum(job["state"] == "RUNNING" for job in active_jobs())
+        for i in range(1, nodes + 1):
+            gpus = max(0, min(4, allocated - 4 * (i - 1)))
+            state = "IDLE" if gpus == 0 else "MIXED" if gpus < 4 else "ALLOCATED"
+            print(
+                f"NodeName=node{i} Arch=aarch64 State={state} Partitions=workq "
+                f"CfgTRES=cpu=288,mem=800G,gres/gpu=4 AllocTRES={f'cpu={gpus * 72},gres/gpu={gpus}' if gpus else ''}"
+            )
+    elif entity.startswith("reservation"):
+        print("No reservations in the system")
+    else:
+        print(f"scontrol: unsupported command {' '.join(argv)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def srun(argv: list[str]) -> int:
+    log_call("srun")
+    # Skip srun options, up to the command to run
+    while argv and argv[0].startswith("-"):
+        argv = argv[1:]
+    os.execvp(argv[0], argv)
+
+
+def batchspawner_singleuser(argv: list[str]) -> int:
+    """Report a port to the Hub, then answer every HTTP request with 200 OK"""
+    import urllib.request
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = b'{"version": "bench"}'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_HEAD = do_POST = do_GET
+
+        def log_message(self, format, *args):
+            pass
+
+    time.sleep(env_float("BENCH_START_DELAY"))
+    server = ThreadingHTTPServer((os.environ.get("BENCH_NODE_HOST", "127.0.0.1"), 0), Handler)
+    request = urllib.request.Request(
+        os.environ["JUPYTERHUB_API_URL"] + "/batchspawner",
+        data=json.dumps({"port": server.server_address[1]}).encode(),
+        headers={"Authorization": "token " + os.environ["JUPYTERHUB_API_TOKEN"]},
+        method="POST",
+    )
+    urllib.request.urlopen(request, timeout=30)
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    server.serve_forever()
+
+
+def slurmspawner_user_env(argv: list[str]) -> int:
+    log_call("slurmspawner_user_env")
+    fingerprint = "bench"
+    if sys.stdin.read().strip() != fingerprint:
+        time.sleep(env_float("BENCH_LOGIN_SHELL_DELAY"))
+        json.dump({"env": dict(os.environ), "fingerprint": fingerprint}, sys.stdout)
+    else:
+        json.dump({"fingerprint": fingerprint}, sys.stdout)
+    return 0
+
+
+COMMANDS = {
+    "ssh": ssh,
+    "sudo": sudo,
+    "sbatch": sbatch,
+    "slurmspawner_sbatch": sbatch,
+    "squeue": squeue,
+    "slurmspawner_squeue": slurmspawner_squeue,
+    "scancel": scancel,
+    "slurmspawner_scancel": slurmspawner_scancel,
+    "scontrol": scontrol,
+    "srun": srun,
+    "batchspawner-singleuser": batchspawner_singleuser,
+    "slurmspawner_user_env": slurmspawner_user_env,
+}
+
+
+def main() -> int:
+    if len(sys.argv) > 2 and sys.argv[1] == "_run_job":
+        return run_job(sys.argv[2])
+    command = Path(sys.argv[0]).name
+    if command not in COMMANDS:
+        print(f"fakeslurm: unknown command {command}", file=sys.stderr)
+        return 1
+    return COMMANDS[command](sys.argv[1:])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
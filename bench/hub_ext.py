@@ -0,0 +1,44 @@
+"""
+Benchmark-only additions loaded into the Hub by the configuration generated by
+spawn_storm.py
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+
+log = logging.getLogger("JupyterHub")
+
+
+def start_loop_lag_probe(path: str, interval: float = 0.1) -> None:
+    """
+    Measure event loop lag in the Hub process
+
+    Every `interval` seconds, the time by which a sleep overshoots is recorded
+    as a (wall clock time, lag) pair. Samples are written to `path` as a JSON
+    list once per second.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        log.warning("No running event loop when loading config, event loop lag will not be measured")
+        return
+
+    async def probe():
+        samples = []
+        written_at = time.monotonic()
+        while True:
+            started_at = loop.time()
+            await asyncio.sleep(interval)
+            samples.append((time.time(), loop.time() - started_at - interval))
+            if time.monotonic() - written_at >= 1.0:
+                tmp = f"{path}.tmp"
+                with open(tmp, "w") as f:
+                    json.dump(samples, f)
+                os.replace(tmp, path)
+                written_at = time.monotonic()
+
+    # Keep a reference to the task so that it is not garbage collected
+    start_loop_lag_probe.task = loop.create_task(probe())
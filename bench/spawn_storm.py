@@ -0,0 +1,788 @@
+#!/usr/bin/env python3
+"""
+Spawn-storm benchmark for the dev_dummyauth JupyterHub configurations
+
+Runs JupyterHub with the configuration for a dev_dummyauth* environment on the
+local machine, with Slurm, SSH and sudo replaced by the stand-ins in
+fakeslurm.py (and slurmrestd by fake_slurmrestd.py, with --slurm-rest), then
+has many users log in and start servers concurrently.
+
+Reports login, spawn form, spawn, activity update and stop latency
+percentiles, the number of SSH sessions and Slurm commands run, event loop lag
+and memory use (RSS) of the Hub process and failures. No network access is needed, so
+configurations can be compared by re-running with --extra-config files
+overriding settings of interest.
+
+Requires JupyterHub (with configurable-http-proxy), batchspawner and
+bricsauthenticator to be installed, e.g. run inside the JupyterHub container
+image (see "Benchmarking spawn storms" in the top-level README.md).
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import os
+import secrets
+import shutil
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from http.cookies import SimpleCookie
+from pathlib import Path
+from urllib.parse import urlencode
+
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest, HTTPResponse
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+
+# Commands emulated by fakeslurm.py, installed in the bin directory on PATH
+FAKE_COMMANDS = [
+    "ssh",
+    "sudo",
+    "sbatch",
+    "squeue",
+    "scancel",
+    "scontrol",
+    "srun",
+    "slurmspawner_sbatch",
+    "slurmspawner_squeue",
+    "slurmspawner_scancel",
+    "slurmspawner_user_env",
+    "batchspawner-singleuser",
+]
+
+HUB_CONFIG_TEMPLATE = """\
+# Generated by spawn_storm.py
+c = get_config()  # noqa
+
+import sys
+sys.path.insert(0, {bench_dir!r})
+from hub_ext import start_loop_lag_probe
+
+# Load the environment's configuration, keeping its namespace to reuse helpers
+env_config_file = {env_config!r}
+env_config = {{"get_config": get_config, "__file__": env_config_file, "__name__": "env_config"}}
+with open(env_config_file) as f:
+    exec(compile(f.read(), env_config_file, "exec"), env_config)
+
+c.JupyterHub.bind_url = "http://127.0.0.1:{proxy_port}" + env_config["BASE_URL"]
+c.JupyterHub.hub_bind_url = "http://127.0.0.1:{hub_port}"
+c.ConfigurableHTTPProxy.api_url = "http://127.0.0.1:{proxy_api_port}"
+c.JupyterHub.cookie_secret_file = "{workdir}/jupyterhub_cookie_secret"
+c.JupyterHub.pid_file = "{workdir}/jupyterhub.pid"
+
+# Service used by the benchmark driver to start and stop servers
+c.JupyterHub.services = [{{"name": "spawn-storm", "api_token": {api_token!r}}}]
+c.JupyterHub.load_roles = [
+    {{"name": "spawn-storm", "scopes": ["admin:users", "admin:servers"], "services": ["spawn-storm"]}}
+]
+
+start_loop_lag_probe({lag_file!r})
+"""
+
+
+@dataclass
+class UserResult:
+    name: str
+    login: float | None = None
+    form: float | None = None
+    spawn: float | None = None
+    activity: list[float] = field(default_factory=list)
+    stop: float | None = None
+    respawn: float | None = None
+    error: str | None = None
+
+
+class BenchError(Exception):
+    pass
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--env", default="dev_dummyauth", choices=["dev_dummyauth", "dev_dummyauth_extslurm"])
+    parser.add_argument("--users", type=int, default=200, help="number of users (default: %(default)s)")
+    parser.add_argument(
+        "--concurrency", type=int, default=0, help="maximum users logging in/spawning at once (default: all)"
+    )
+    parser.add_argument("--ramp", type=float, default=0.0, help="spread user arrivals over this many seconds")
+    parser.add_argument("--user-options", default="{}", help="JSON user_options sent with each spawn request")
+    parser.add_argument("--timeout", type=float, default=600.0, help="per-user spawn timeout in seconds")
+    parser.add_argument(
+        "--extra-config",
+        action="append",
+        default=[],
+        metavar="FILE",
+        help="JupyterHub config file loaded after the environment's config (may be repeated)",
+    )
+    parser.add_argument("--slurm-agent", action="store_true", help="enable the Slurm agent (slurmAgent key)")
+    parser.add_argument(
+        "--slurm-rest",
+        action="store_true",
+        help="submit, query and cancel jobs using a fake Slurm REST API, fake_slurmrestd.py (slurmRestUrl key)",
+    )
+    parser.add_argument(
+        "--submit-payload",
+        action="store_true",
+        help="submit jobs with a JSON payload on stdin (slurmSubmitPayload key)",
+    )
+    parser.add_argument(
+        "--user-env-cache",
+        action="store_true",
+        help="capture and cache users' login environments rather than using --get-user-env (userEnvCache key)",
+    )
+    parser.add_argument(
+        "--respawn",
+        action="store_true",
+        help="after stopping, start and stop each server again (e.g. to measure cached login environments)",
+    )
+    parser.add_argument(
+        "--spawn-options-form",
+        action="store_true",
+        help="show the spawn options form (spawnOptionsForm key), loaded by each user before spawning",
+    )
+    parser.add_argument("--log-level", default="INFO", help="JupyterHub log level (default: %(default)s)")
+    parser.add_argument(
+        "--log-format",
+        default="text",
+        choices=["text", "json"],
+        help="JupyterHub log format (logFormat key), JSON logs are written under <workdir>/logs (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--tracing",
+        action="store_true",
+        help="trace spawns (tracingFile key, written to <workdir>/logs/traces.jsonl) and report the slowest spawns",
+    )
+
+    parser.add_argument(
+        "--activity-rounds",
+        type=int,
+        default=3,
+        help="times each started server reports activity to the Hub, all at once (default: %(default)s)",
+    )
+
+    auth_state = parser.add_argument_group("auth_state")
+    auth_state.add_argument(
+        "--projects",
+        type=int,
+        default=1,
+        help="projects of each user in auth_state, as for users with many projects (default: %(default)s)",
+    )
+    auth_state.add_argument(
+        "--compact-auth-state",
+        action="store_true",
+        help="store compact rather than full auth_state (authStateCompact key set to true)",
+    )
+
+    db = parser.add_argument_group("JupyterHub database")
+    db.add_argument(
+        "--db-url",
+        help="database URL (dbUrl key), e.g. postgresql://postgres@127.0.0.1/jupyterhub (default: SQLite in workdir)",
+    )
+    db.add_argument("--db-pool-size", type=int, default=5, help="connection pool size (dbPoolSize key)")
+    db.add_argument("--sqlite-journal-mode", default="WAL", help="SQLite journal mode (dbSqliteJournalMode key)")
+    db.add_argument("--sqlite-synchronous", default="NORMAL", help="SQLite synchronous (dbSqliteSynchronous key)")
+
+    fake = parser.add_argument_group("fake Slurm/SSH behaviour")
+    fake.add_argument("--queue-delay", type=float, default=5.0, help="seconds each job is pending")
+    fake.add_argument("--queue-jitter", type=float, default=5.0, help="random extra pending time (uniform)")
+    fake.add_argument(
+        "--start-delay", type=float, default=1.0, help="seconds from job start until the server reports its port"
+    )
+    fake.add_argument(
+        "--login-shell-delay",
+        type=float,
+        default=2.0,
+        help="seconds for a login shell, run at job start with --get-user-env or to capture the user's environment",
+    )
+    fake.add_argument("--slurm-rpc-delay", type=float, default=0.02, help="seconds per sbatch/squeue/scancel")
+    fake.add_argument(
+        "--slurm-serial", action="store_true", help="handle Slurm commands one at a time, like a busy slurmctld"
+    )
+    fake.add_argument("--ssh-connect-delay", type=float, default=0.15, help="seconds for a new SSH connection")
+    fake.add_argument(
+        "--ssh-mux-delay", type=float, default=0.01, help="seconds for a session on a multiplexed connection"
+    )
+    fake.add_argument(
+        "--ssh-hosts",
+        nargs="+",
+        default=["localhost"],
+        metavar="HOST",
+        help="SSH host names (sshHostname key), all running commands locally (default: %(default)s)",
+    )
+    fake.add_argument(
+        "--ssh-down-hosts",
+        nargs="+",
+        default=[],
+        metavar="HOST",
+        help="SSH hosts refusing connections, e.g. to check failover to other --ssh-hosts",
+    )
+
+    output = parser.add_argument_group("output")
+    output.add_argument("--workdir", help="directory for Hub and fake Slurm state (default: new temporary dir)")
+    output.add_argument("--keep", action="store_true", help="keep the working directory (with logs) afterwards")
+    output.add_argument("--json", metavar="FILE", help="also write results as JSON to FILE")
+    return parser.parse_args()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Nearest-rank percentile of `values`"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def summarise(values: list[float]) -> dict[str, float]:
+    if not values:
+        return {}
+    return {
+        "n": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values),
+    }
+
+
+class SpawnStorm:
+    def __init__(self, args: argparse.Namespace, workdir: Path):
+        self.args = args
+        self.workdir = workdir
+        self.api_token = secrets.token_hex(32)
+        self.password = secrets.token_urlsafe(24)
+        self.usernames = [f"bench{i:04d}" for i in range(args.users)]
+        self.proxy_port, self.hub_port, self.proxy_api_port = free_port(), free_port(), free_port()
+        self.slurmrestd_port = free_port()
+        self.base_url = f"http://127.0.0.1:{self.proxy_port}/jupyter"
+        self.hub: subprocess.Popen | None = None
+        self.slurmrestd: subprocess.Popen | None = None
+        self.http = AsyncHTTPClient(force_instance=True, max_clients=2 * args.users + 10)
+        self.cookies: dict[str, dict[str, str]] = {}
+
+    # Setup
+
+    def prepare(self) -> dict[str, str]:
+        """Create fake commands and Hub config in the working directory, returning the Hub's environment"""
+        bin_dir = self.workdir / "bin"
+        state_dir = self.workdir / "slurm"
+        log_dir = self.workdir / "logs"
+        for path in [bin_dir, state_dir / "jobs", self.workdir / "tmp", self.workdir / "conda/bin", log_dir]:
+            path.mkdir(parents=True, exist_ok=True)
+        for name in FAKE_COMMANDS:
+            (bin_dir / name).symlink_to(BENCH_DIR / "fakeslurm.py")
+        (bin_dir / "python").symlink_to(sys.executable)
+        for name, args in [
+            ("slurmspawner_agent", ""),
+            ("slurmspawner_submit", f"--sbatch={bin_dir / 'slurmspawner_sbatch'} "),
+        ]:
+            (bin_dir / name).write_text(
+                f'#!/bin/sh\nexec {sys.executable} {REPO_DIR / "brics_slurm" / f"{name}.py"} {args}"$@"\n'
+            )
+            (bin_dir / name).chmod(0o755)
+        (self.workdir / "conda/bin/activate").write_text("# Conda environment activation not needed\n")
+        (self.workdir / "ssh_key").write_text("")
+        (self.workdir / "slurm_jwt_key").write_bytes(secrets.token_bytes(32))
+
+        env_config = REPO_DIR / "volumes" / self.args.env / "jupyterhub_root/etc/jupyterhub/jupyterhub_config.py"
+        config = HUB_CONFIG_TEMPLATE.format(
+            bench_dir=str(BENCH_DIR),
+            env_config=str(env_config),
+            proxy_port=self.proxy_port,
+            hub_port=self.hub_port,
+            proxy_api_port=self.proxy_api_port,
+            workdir=self.workdir,
+            api_token=self.api_token,
+            lag_file=str(self.workdir / "loop_lag.json"),
+        )
+        for extra_config in self.args.extra_config:
+            config += f"\nload_subconfig({str(Path(extra_config).resolve())!r})\n"
+        (self.workdir / "jupyterhub_config.py").write_text(config)
+
+        a = self.args
+        env = dict(os.environ)
+        env.update(
+            PATH=f"{bin_dir}:{os.environ['PATH']}",
+            PYTHONPATH=os.pathsep.join(
+                filter(None, [str(REPO_DIR / "brics_jupyterhub"), os.environ.get("PYTHONPATH")])
+            ),
+            TMPDIR=str(self.workdir / "tmp"),
+            JUPYTERHUB_SRV_DIR=str(self.workdir),
+            JUPYTERHUB_LOG_DIR=str(log_dir),
+            JUPYTERHUB_CRYPT_KEY=secrets.token_hex(32),
+            DEPLOY_CONFIG_LOG_LEVEL=a.log_level,
+            DEPLOY_CONFIG_LOG_FORMAT=a.log_format,
+            DEPLOY_CONFIG_TRACING_FILE="true" if a.tracing else "false",
+            DEPLOY_CONFIG_BASE_URL="/jupyter",
+            DEPLOY_CONFIG_DB_URL=a.db_url or f"sqlite:///{self.workdir}/jupyterhub.sqlite",
+            DEPLOY_CONFIG_DB_POOL_SIZE=str(a.db_pool_size),
+            DEPLOY_CONFIG_DB_SQLITE_JOURNAL_MODE=a.sqlite_journal_mode,
+            DEPLOY_CONFIG_DB_SQLITE_SYNCHRONOUS=a.sqlite_synchronous,
+            DEPLOY_CONFIG_DEV_USERS=" ".join(
+                f"{name}.benchproj{j or ''}" for name in self.usernames for j in range(a.projects)
+            ),
+            DEPLOY_CONFIG_AUTH_STATE_COMPACT="true" if a.compact_auth_state else "false",
+            DEPLOY_CONFIG_DUMMYAUTH_PASSWORD=self.password,
+            DEPLOY_CONFIG_DUMMYAUTH_MULTI_USER="true",
+            DEPLOY_CONFIG_SSH_HOSTNAME=" ".join(a.ssh_hosts),
+            DEPLOY_CONFIG_SLURMSPAWNER_WRAPPERS_BIN=str(bin_dir),
+            DEPLOY_CONFIG_SLURM_AGENT="true" if a.slurm_agent else "false",
+            DEPLOY_CONFIG_SLURM_SUBMIT_PAYLOAD="true" if a.submit_payload else "false",
+            DEPLOY_CONFIG_SLURM_REST_URL=f"http://127.0.0.1:{self.slurmrestd_port}" if a.slurm_rest else "",
+            DEPLOY_CONFIG_SLURM_REST_JWT_KEY_FILE=str(self.workdir / "slurm_jwt_key"),
+            DEPLOY_CONFIG_USER_ENV_CACHE="true" if a.user_env_cache else "false",
+            DEPLOY_CONFIG_SPAWN_OPTIONS_FORM="true" if a.spawn_options_form else "false",
+            DEPLOY_CONFIG_CONDA_PREFIX_DIR=str(self.workdir / "conda"),
+            DEPLOY_CONFIG_JUPYTER_DATA_DIR=str(self.workdir / "jupyter_data"),
+            DEPLOY_CONFIG_HUB_CONNECT_URL=f"http://127.0.0.1:{self.hub_port}",
+            DEPLOY_CONFIG_OIDC_SERVER="https://keycloak.example/realms/isambard",
+            DEPLOY_CONFIG_BRICS_PLATFORM="portal.dummy.platform.shared",
+            DEPLOY_CONFIG_JWT_AUDIENCE="dummy-audience",
+            BENCH_STATE_DIR=str(state_dir),
+            BENCH_NODE_HOST="127.0.0.1",
+            BENCH_QUEUE_DELAY=str(a.queue_delay),
+            BENCH_QUEUE_JITTER=str(a.queue_jitter),
+            BENCH_START_DELAY=str(a.start_delay),
+            BENCH_LOGIN_SHELL_DELAY=str(a.login_shell_delay),
+            BENCH_SLURM_RPC_DELAY=str(a.slurm_rpc_delay),
+            BENCH_SSH_CONNECT_DELAY=str(a.ssh_connect_delay),
+            BENCH_SSH_DOWN_HOSTS=" ".join(a.ssh_down_hosts),
+            BENCH_SSH_MUX_DELAY=str(a.ssh_mux_delay),
+        )
+        if a.slurm_serial:
+            env["BENCH_SLURM_RPC_SERIAL"] = "1"
+        return env
+
+    async def start_slurmrestd(self, env: dict[str, str]) -> None:
+        with open(self.workdir / "slurmrestd.log", "wb") as log:
+            self.slurmrestd = subprocess.Popen(
+                [
+                    sys.executable,
+                    str(BENCH_DIR / "fake_slurmrestd.py"),
+                    f"--port={self.slurmrestd_port}",
+                    f"--jwt-key-file={self.workdir / 'slurm_jwt_key'}",
+                ],
+                cwd=self.workdir,
+                env=env,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+            )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if self.slurmrestd.poll() is not None:
+                raise BenchError(f"fake_slurmrestd.py exited with status {self.slurmrestd.returncode}")
+            try:
+                socket.create_connection(("127.0.0.1", self.slurmrestd_port), timeout=1).close()
+                return
+            except OSError:
+                await asyncio.sleep(0.2)
+        raise BenchError("Timed out waiting for fake_slurmrestd.py to start")
+
+    async def start_hub(self, env: dict[str, str]) -> None:
+        with open(self.workdir / "jupyterhub.log", "wb") as log:
+            self.hub = subprocess.Popen(
+                ["jupyterhub", "-f", str(self.workdir / "jupyterhub_config.py")],
+                cwd=self.workdir,
+                env=env,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+            )
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if self.hub.poll() is not None:
+                raise BenchError(
+                    f"JupyterHub exited with status {self.hub.returncode}, see {self.workdir}/jupyterhub.log"
+                )
+            try:
+                response = await self.api("GET", "")
+                if response.code == 200:
+                    return
+            except OSError:
+                pass
+            await asyncio.sleep(0.5)
+        raise BenchError("Timed out waiting for JupyterHub to start")
+
+    def stop_hub(self) -> None:
+        if self.hub is not None and self.hub.poll() is None:
+            self.hub.send_signal(signal.SIGTERM)
+            try:
+                self.hub.wait(30)
+            except subprocess.TimeoutExpired:
+                self.hub.kill()
+        if self.slurmrestd is not None and self.slurmrestd.poll() is None:
+            self.slurmrestd.kill()
+        # Jobs are left running when the Hub stops (cleanup_servers = False)
+        for path in (self.workdir / "slurm/jobs").glob("*.json"):
+            try:
+                os.killpg(json.loads(path.read_text())["pid"], signal.SIGKILL)
+            except (ProcessLookupError, PermissionError, ValueError, KeyError):
+                pass
+
+    # HTTP
+
+    async def fetch(self, url: str, cookies: dict[str, str] | None = None, **kwargs) -> HTTPResponse:
+        headers = kwargs.pop("headers", {})
+        if cookies:
+            headers["Cookie"] = "; ".join(f"{name}={value}" for name, value in cookies.items())
+        request = HTTPRequest(url, headers=headers, follow_redirects=False, request_timeout=self.args.timeout, **kwargs)
+        response = await self.http.fetch(request, raise_error=False)
+        if response.code == 599:
+            raise OSError(f"{url}: {response.error}")
+        if cookies is not None:
+            for header in response.headers.get_list("Set-Cookie"):
+                cookies.update({name: morsel.value for name, morsel in SimpleCookie(header).items()})
+        return response
+
+    async def api(self, method: str, path: str, body: dict | None = None, **kwargs) -> HTTPResponse:
+        return await self.fetch(
+            f"{self.base_url}/hub/api/{path}",
+            method=method,
+            body=json.dumps(body) if body is not None else (b"" if method == "POST" else None),
+            headers={"Authorization": f"token {self.api_token}"},
+            allow_nonstandard_methods=True,
+            **kwargs,
+        )
+
+    # User actions
+
+    async def login(self, name: str) -> None:
+        cookies = self.cookies.setdefault(name, {})
+        await self.fetch(f"{self.base_url}/hub/login", cookies)
+        body = urlencode({"username": name, "password": self.password, "_xsrf": cookies.get("_xsrf", "")})
+        response = await self.fetch(f"{self.base_url}/hub/login", cookies, method="POST", body=body)
+        if response.code != 302:
+            raise BenchError(f"login: HTTP {response.code}")
+
+    async def load_spawn_form(self, name: str) -> None:
+        """Load the spawn options form, as a user does before starting a server"""
+        response = await self.fetch(f"{self.base_url}/hub/spawn", self.cookies[name])
+        if response.code != 200:
+            raise BenchError(f"spawn form: HTTP {response.code}")
+        if b'name="partition"' not in response.body:
+            raise BenchError("spawn form: no options form shown")
+
+    async def spawn(self, name: str) -> None:
+        response = await self.api("POST", f"users/{name}/server", json.loads(self.args.user_options))
+        if response.code not in (201, 202):
+            raise BenchError(f"spawn: HTTP {response.code}")
+
+        # Wait for the server to be ready using the progress event stream, as
+        # the spawn pending page does in a browser
+        events = []
+        buffer = b""
+
+        def on_chunk(chunk: bytes) -> None:
+            nonlocal buffer
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            events.extend(json.loads(line[5:]) for line in lines if line.startswith(b"data:"))
+
+        response = await self.api("GET", f"users/{name}/server/progress", streaming_callback=on_chunk)
+        if response.code != 200:
+            raise BenchError(f"progress: HTTP {response.code}")
+        if not events or not events[-1].get("ready"):
+            message = events[-1].get("message", "no progress events") if events else "no progress events"
+            raise BenchError(f"spawn failed: {message}")
+
+    async def report_activity(self, name: str) -> None:
+        """Report activity of the user's server, as the single-user server does periodically"""
+        now = datetime.now(timezone.utc).isoformat()
+        body = {"last_activity": now, "servers": {"": {"last_activity": now}}}
+        response = await self.api("POST", f"users/{name}/activity", body)
+        if response.code not in (200, 204):
+            raise BenchError(f"activity: HTTP {response.code}")
+
+    async def stop(self, name: str) -> None:
+        response = await self.api("DELETE", f"users/{name}/server")
+        if response.code == 204:
+            return
+        if response.code != 202:
+            raise BenchError(f"stop: HTTP {response.code}")
+        while True:
+            await asyncio.sleep(0.5)
+            user = json.loads((await self.api("GET", f"users/{name}")).body)
+            if not user.get("servers"):
+                return
+
+    async def run_user(self, result: UserResult, delay: float, limit: asyncio.Semaphore) -> None:
+        await asyncio.sleep(delay)
+        async with limit:
+            try:
+                started_at = time.monotonic()
+                await self.login(result.name)
+                result.login = time.monotonic() - started_at
+                if self.args.spawn_options_form:
+                    started_at = time.monotonic()
+                    await self.load_spawn_form(result.name)
+                    result.form = time.monotonic() - started_at
+                started_at = time.monotonic()
+                await asyncio.wait_for(self.spawn(result.name), self.args.timeout)
+                result.spawn = time.monotonic() - started_at
+            except asyncio.TimeoutError:
+                result.error = "spawn: timed out"
+            except (BenchError, OSError) as e:
+                result.error = str(e)
+
+    async def report_user_activity(self, result: UserResult) -> None:
+        try:
+            started_at = time.monotonic()
+            await self.report_activity(result.name)
+            result.activity.append(time.monotonic() - started_at)
+        except (BenchError, OSError) as e:
+            result.error = result.error or str(e)
+
+    async def stop_user(self, result: UserResult) -> None:
+        try:
+            started_at = time.monotonic()
+            await self.stop(result.name)
+            result.stop = time.monotonic() - started_at
+        except (BenchError, OSError) as e:
+            result.error = result.error or str(e)
+
+    async def respawn_user(self, result: UserResult, limit: asyncio.Semaphore) -> None:
+        async with limit:
+            try:
+                started_at = time.monotonic()
+                await asyncio.wait_for(self.spawn(result.name), self.args.timeout)
+                result.respawn = time.monotonic() - started_at
+                await self.stop(result.name)
+            except asyncio.TimeoutError:
+                result.error = result.error or "respawn: timed out"
+            except (BenchError, OSError) as e:
+                result.error = result.error or f"respawn: {e}"
+
+    # Results
+
+    def command_counts(self, start: float, end: float) -> Counter:
+        counts = Counter()
+        calls_log = self.workdir / "slurm/calls.log"
+        if calls_log.exists():
+            for line in calls_log.read_text().splitlines():
+                timestamp, name = line.split()[:2]
+                if start <= float(timestamp) <= end:
+                    counts[name] += 1
+        return counts
+
+    def loop_lag(self, start: float, end: float) -> dict[str, float]:
+        try:
+            samples = json.loads((self.workdir / "loop_lag.json").read_text())
+        except FileNotFoundError:
+            return {}
+        return summarise([lag for timestamp, lag in samples if start <= timestamp <= end])
+
+    def slowest_spawn_traces(self, count: int) -> list[dict]:
+        """Return the `count` longest spawn traces, with the spans directly below each root span"""
+
+        def seconds(timestamp: str) -> float:
+            return datetime.fromisoformat(timestamp.replace("Z", "+00:00")).timestamp()
+
+        try:
+            lines = (self.workdir / "logs/traces.jsonl").read_text().splitlines()
+        except FileNotFoundError:
+            return []
+        spans = [json.loads(line) for line in lines if line.strip()]
+        roots = sorted(
+            (span for span in spans if span["name"] == "spawn" and not span["parent_id"]),
+            key=lambda span: seconds(span["start_time"]) - seconds(span["end_time"]),
+        )[:count]
+        traces = []
+        for root in roots:
+            start = seconds(root["start_time"])
+            children = sorted(
+                (span for span in spans if span["parent_id"] == root["context"]["span_id"]),
+                key=lambda span: seconds(span["start_time"]),
+            )
+            traces.append(
+                {
+                    "user": root["attributes"].get("jupyterhub.user", ""),
+                    "trace_id": root["context"]["trace_id"],
+                    "duration_s": seconds(root["end_time"]) - start,
+                    "spans": [
+                        {
+                            "name": span["name"],
+                            "offset_s": seconds(span["start_time"]) - start,
+                            "duration_s": seconds(span["end_time"]) - seconds(span["start_time"]),
+                        }
+                        for span in children
+                    ],
+                }
+            )
+        return traces
+
+    def hub_rss_bytes(self) -> int:
+        """Return the resident set size of the Hub process"""
+        for line in Path(f"/proc/{self.hub.pid}/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+        return 0
+
+    def auth_state_bytes(self) -> float | None:
+        """Return the mean size of the stored (encrypted) auth_state of users, if the database is SQLite"""
+        if self.args.db_url:
+            return None
+        with contextlib.closing(sqlite3.connect(self.workdir / "jupyterhub.sqlite")) as db:
+            (size,) = db.execute(
+                "SELECT avg(length(encrypted_auth_state)) FROM users WHERE encrypted_auth_state IS NOT NULL"
+            ).fetchone()
+        return size
+
+    async def run(self) -> dict:
+        a = self.args
+        env = self.prepare()
+        if a.slurm_rest:
+            await self.start_slurmrestd(env)
+        await self.start_hub(env)
+        idle_rss = self.hub_rss_bytes()
+
+        results = [UserResult(name) for name in self.usernames]
+        limit = asyncio.Semaphore(a.concurrency or a.users)
+        spawn_started_at = time.time()
+        await asyncio.gather(
+            *(self.run_user(result, a.ramp * i / a.users, limit) for i, result in enumerate(results))
+        )
+        spawn_ended_at = time.time()
+        await asyncio.sleep(1.5)  # let the event loop lag probe write its last samples
+        spawn_lag = self.loop_lag(spawn_started_at, spawn_ended_at)
+        spawned_rss = self.hub_rss_bytes()
+
+        activity_started_at = time.time()
+        started = [result for result in results if result.spawn is not None]
+        for _ in range(a.activity_rounds):
+            await asyncio.gather(*(self.report_user_activity(result) for result in started))
+        activity_ended_at = time.time()
+
+        stop_started_at = time.time()
+        await asyncio.gather(*(self.stop_user(result) for result in started))
+        stop_ended_at = time.time()
+
+        respawn_started_at = time.time()
+        if a.respawn:
+            await asyncio.gather(*(self.respawn_user(result, limit) for result in started if result.stop is not None))
+        respawn_ended_at = time.time()
+        if a.tracing:
+            await asyncio.sleep(6)  # let the Hub export its last spans (every 5 s)
+
+        return {
+            "settings": {key: value for key, value in vars(a).items() if key not in ("workdir", "keep", "json")},
+            "spawn_phase_s": spawn_ended_at - spawn_started_at,
+            "activity_phase_s": activity_ended_at - activity_started_at,
+            "stop_phase_s": stop_ended_at - stop_started_at,
+            "respawn_phase_s": respawn_ended_at - respawn_started_at,
+            "latency_s": {
+                "login": summarise([r.login for r in results if r.login is not None]),
+                "form": summarise([r.form for r in results if r.form is not None]),
+                "spawn": summarise([r.spawn for r in results if r.spawn is not None]),
+                "activity": summarise([latency for r in results for latency in r.activity]),
+                "stop": summarise([r.stop for r in results if r.stop is not None]),
+                "respawn": summarise([r.respawn for r in results if r.respawn is not None]),
+            },
+            "succeeded": sum(r.spawn is not None for r in results),
+            "failures": dict(Counter(r.error for r in results if r.error)),
+            "commands": {
+                "spawn_phase": dict(self.command_counts(spawn_started_at, spawn_ended_at)),
+                "stop_phase": dict(self.command_counts(stop_started_at, stop_ended_at)),
+                "respawn_phase": dict(self.command_counts(respawn_started_at, respawn_ended_at)),
+            },
+            "hub_loop_lag_s": spawn_lag,
+            "hub_memory": {
+                "idle_rss_bytes": idle_rss,
+                "rss_bytes": spawned_rss,
+                "per_user_bytes": (spawned_rss - idle_rss) / max(1, sum(r.spawn is not None for r in results)),
+                "auth_state_bytes": self.auth_state_bytes(),
+            },
+            "slowest_spawn_traces": self.slowest_spawn_traces(5) if a.tracing else [],
+            "users": [asdict(r) for r in results],
+        }
+
+
+def print_report(report: dict) -> None:
+    settings = report["settings"]
+    print(
+        f"Spawn storm: {settings['users']} users, environment {settings['env']}, "
+        f"Slurm agent {'on' if settings['slurm_agent'] else 'off'}, "
+        f"Slurm REST API {'on' if settings['slurm_rest'] else 'off'}, "
+        f"submit payload {'on' if settings['submit_payload'] else 'off'}, "
+        f"user environment cache {'on' if settings['user_env_cache'] else 'off'}"
+    )
+    if settings["db_url"]:
+        print(f"  database {settings['db_url']} (pool size {settings['db_pool_size']})")
+    else:
+        print(
+            f"  database SQLite (journal mode {settings['sqlite_journal_mode']}, "
+            f"synchronous {settings['sqlite_synchronous']})"
+        )
+    print(
+        f"  spawn phase {report['spawn_phase_s']:.1f} s, activity phase {report['activity_phase_s']:.1f} s, "
+        f"stop phase {report['stop_phase_s']:.1f} s"
+    )
+    print(f"  {report['succeeded']}/{settings['users']} servers started")
+    print()
+    print(f"  {'latency (s)':<12}{'n':>6}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for phase, stats in report["latency_s"].items():
+        if stats:
+            print(f"  {phase:<12}{stats['n']:>6}" + "".join(f"{stats[p]:>9.3f}" for p in ("p50", "p95", "p99", "max")))
+    lag = report["hub_loop_lag_s"]
+    if lag:
+        print(f"  {'loop lag':<12}{'':>6}" + "".join(f"{lag[p]:>9.3f}" for p in ("p50", "p95", "p99", "max")))
+    memory = report["hub_memory"]
+    print()
+    print(
+        f"  hub RSS {memory['idle_rss_bytes'] / 2**20:.1f} MiB idle, {memory['rss_bytes'] / 2**20:.1f} MiB "
+        f"after spawning, {memory['per_user_bytes'] / 1024:.1f} KiB per active user"
+    )
+    if memory["auth_state_bytes"] is not None:
+        print(f"  stored auth_state {memory['auth_state_bytes']:.0f} bytes per user")
+    for phase, counts in report["commands"].items():
+        print()
+        print(f"  commands ({phase.replace('_', ' ')})")
+        for name, count in sorted(counts.items()):
+            print(f"    {name:<22}{count:>8}{count / max(1, report['succeeded']):>10.2f} per server")
+    for trace in report["slowest_spawn_traces"]:
+        print()
+        print(f"  slow spawn {trace['user']} {trace['duration_s']:.3f} s (trace {trace['trace_id']})")
+        for span in trace["spans"]:
+            print(f"    {span['name']:<28}{span['offset_s']:>9.3f}{span['duration_s']:>9.3f} s")
+    if report["failures"]:
+        print()
+        print("  failures")
+        for error, count in sorted(report["failures"].items(), key=lambda item: -item[1]):
+            print(f"    {count:>6}  {error}")
+
+
+async def main() -> int:
+    args = parse_args()
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="spawn-storm-")).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    storm = SpawnStorm(args, workdir)
+    try:
+        report = await storm.run()
+    except BenchError as e:
+        print(f"spawn_storm: {e}", file=sys.stderr)
+        return 1
+    finally:
+        storm.stop_hub()
+        if args.keep or args.workdir:
+            print(f"Working directory: {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    print_report(report)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
+    return 0 if not report["failures"] else 2
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,9 @@
+"""
+Extensions to BriCS JupyterHub components for the containerised JupyterHub deployment
+
+The modules in this package are installed into the JupyterHub container image
+and imported from ``jupyterhub_config.py``. They extend the classes provided by
+bricsauthenticator (registered as the "brics" JupyterHub entry points) with
+behaviour specific to this deployment, e.g. how Slurm commands are run over
+SSH.
+"""
@@ -0,0 +1,153 @@
+"""
+Hub-wide admission control for Slurm operations, with a fair queue across groups of users
+"""
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+from bricshub import metrics
+
+
+class FairAdmissionQueue:
+    """
+    Limit on the number of operations of a kind running at once in the Hub
+
+    Up to `limit` operations are admitted at once (if 0, the number is not
+    limited). Further operations wait in a queue until a running operation
+    completes. Waiting operations are grouped by a key (e.g. the user's
+    project): groups are admitted in round-robin order, and operations within
+    a group in the order they arrived. A group with many waiting operations
+    (e.g. all members of a project starting servers at the start of a
+    training session) then delays the operations of other groups by at most
+    one operation per round.
+
+    Use `ticket()` to request admission, e.g.
+
+    .. code-block:: python
+
+        async with queue.ticket(project) as ticket:
+            ...  # run the operation
+
+    The number of waiting operations (`bricshub_admission_queue_depth`) and the
+    time operations wait to be admitted (`bricshub_admission_wait_seconds`) are
+    recorded as Prometheus metrics labelled by `operation`.
+    """
+
+    def __init__(self, operation: str, limit: int):
+        self.operation = operation
+        self.limit = limit
+
+        # Number of admitted operations which have not completed
+        self._running = 0
+
+        # Waiting tickets by group key, in the order in which groups are next
+        # admitted
+        self._waiting: OrderedDict[str, deque["AdmissionTicket"]] = OrderedDict()
+
+    def ticket(self, key: str) -> "AdmissionTicket":
+        """Return a ticket requesting admission of an operation for group `key`"""
+        return AdmissionTicket(self, key)
+
+    @property
+    def depth(self) -> int:
+        """Number of waiting operations"""
+        return sum(len(tickets) for tickets in self._waiting.values())
+
+    def ahead_of(self, ticket: "AdmissionTicket") -> int:
+        """Return the number of waiting operations which will be admitted before `ticket`"""
+        tickets = self._waiting.get(ticket.key)
+        if tickets is None or ticket not in tickets:
+            return 0
+        index = tickets.index(ticket)
+        # Each complete round admits one operation from each group, then in the
+        # ticket's round, groups before the ticket's group are admitted first
+        ahead = sum(min(len(group), index) for group in self._waiting.values())
+        for key, group in self._waiting.items():
+            if key == ticket.key:
+                break
+            ahead += len(group) > index
+        return ahead
+
+    async def _acquire(self, ticket: "AdmissionTicket") -> None:
+        if self.limit <= 0 or (self._running < self.limit and not self._waiting):
+            self._running += 1
+            ticket.admitted_at = time.monotonic()
+        else:
+            self._waiting.setdefault(ticket.key, deque()).append(ticket)
+            self._update_depth()
+            try:
+                await ticket._future
+            except asyncio.CancelledError:
+                if ticket.admitted:
+                    # Admitted as the waiting task was cancelled
+                    self._release()
+                else:
+                    self._remove(ticket)
+                raise
+        metrics.ADMISSION_WAIT_SECONDS.labels(operation=self.operation).observe(
+            ticket.admitted_at - ticket.requested_at
+        )
+
+    def _release(self) -> None:
+        self._running -= 1
+        self._admit_next()
+
+    def _admit_next(self) -> None:
+        while self._waiting and (self.limit <= 0 or self._running < self.limit):
+            key, tickets = next(iter(self._waiting.items()))
+            ticket = tickets.popleft()
+            if tickets:
+                self._waiting.move_to_end(key)
+            else:
+                del self._waiting[key]
+            if ticket._future.done():
+                continue
+            self._running += 1
+            ticket.admitted_at = time.monotonic()
+            ticket._future.set_result(None)
+        self._update_depth()
+
+    def _remove(self, ticket: "AdmissionTicket") -> None:
+        tickets = self._waiting.get(ticket.key)
+        if tickets is not None and ticket in tickets:
+            tickets.remove(ticket)
+            if not tickets:
+                del self._waiting[ticket.key]
+        self._update_depth()
+
+    def _update_depth(self) -> None:
+        metrics.ADMISSION_QUEUE_DEPTH.labels(operation=self.operation).set(self.depth)
+
+
+class AdmissionTicket:
+    """
+    Request for admission of an operation by a `FairAdmissionQueue`
+
+    Entering the ticket as an async context manager waits until the operation
+    is admitted, and exiting it completes the operation, admitting the next
+    waiting operation.
+    """
+
+    def __init__(self, queue: FairAdmissionQueue, key: str):
+        self.queue = queue
+        self.key = key
+        self.requested_at = time.monotonic()
+        self.admitted_at: float | None = None
+        self._future = asyncio.get_running_loop().create_future()
+
+    @property
+    def admitted(self) -> bool:
+        return self.admitted_at is not None
+
+    @property
+    def ahead(self) -> int:
+        """Number of waiting operations which will be admitted before this one"""
+        return self.queue.ahead_of(self)
+
+    async def __aenter__(self) -> "AdmissionTicket":
+        await self.queue._acquire(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self.queue._release()
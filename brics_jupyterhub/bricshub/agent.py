@@ -0,0 +1,145 @@
+"""
+Client for the Slurm agent running on the SSH host (slurmspawner_agent)
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+from typing import Callable
+
+from bricshub import metrics
+
+
+class SlurmAgentUnavailableError(RuntimeError):
+    """Raised when a request fails because the Slurm agent is not running, exited or did not respond"""
+
+
+class SlurmAgentClient:
+    """
+    Client sending requests to a long-running slurmspawner_agent process
+
+    The agent is started by running `make_command()` in a shell (typically an
+    ``ssh`` command running the agent on the SSH host), and requests are sent
+    to its stdin as newline-delimited JSON. Requests made while the event loop
+    is busy are sent together as a single line, so that the agent can answer
+    all job status queries in the line with a single Slurm RPC.
+
+    If the agent process exits, any outstanding requests fail and the agent is
+    restarted when the next request is made. If a request times out, the agent
+    is assumed to be hung: it is killed and outstanding requests fail, so that
+    the next request starts a new agent.
+    """
+
+    def __init__(self, make_command: Callable[[], str], timeout: float, log: logging.Logger):
+        self.make_command = make_command
+        self.timeout = timeout
+        self.log = log
+
+        self._proc: asyncio.subprocess.Process | None = None
+        self._start_lock = asyncio.Lock()
+        self._request_ids = itertools.count()
+        self._pending: dict[int, asyncio.Future] = {}
+        self._outgoing: list[dict] = []
+
+    async def request(self, op: str, **params) -> dict:
+        """
+        Send a request to the agent and return the response
+
+        Raises RuntimeError if the agent reports that the request failed, or
+        SlurmAgentUnavailableError if the agent exits or is killed before
+        responding. Raises asyncio.TimeoutError if no response is received
+        within `timeout` seconds.
+        """
+        await self._ensure_started()
+        request_id = next(self._request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        if not self._outgoing:
+            asyncio.get_running_loop().call_soon(self._flush)
+        self._outgoing.append({"id": request_id, "op": op, **params})
+        try:
+            response = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self._kill(f"Slurm agent did not respond within {self.timeout} s")
+            raise
+        finally:
+            self._pending.pop(request_id, None)
+        if response.get("unavailable"):
+            raise SlurmAgentUnavailableError(response["error"])
+        if not response.get("ok"):
+            raise RuntimeError(response.get("error", "Slurm agent request failed"))
+        return response
+
+    def _flush(self) -> None:
+        """Write all outgoing requests to the agent's stdin as a single line"""
+        requests, self._outgoing = self._outgoing, []
+        if self._proc is None or self._proc.stdin.is_closing():
+            self._fail_pending("Slurm agent is not running")
+            return
+        asyncio.ensure_future(self._write(self._proc, json.dumps(requests).encode() + b"\n"))
+
+    async def _write(self, proc: asyncio.subprocess.Process, line: bytes) -> None:
+        try:
+            proc.stdin.write(line)
+            await proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError) as e:
+            if proc is self._proc:
+                self._fail_pending(f"Failed to send requests to Slurm agent: {e}")
+
+    def _kill(self, message: str) -> None:
+        """Kill the agent process and fail outstanding requests, so that the next request starts a new agent"""
+        proc, self._proc = self._proc, None
+        if proc is not None and proc.returncode is None:
+            self.log.warning("%s, restarting it", message)
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+        self._fail_pending(message)
+        self._pending.clear()
+
+    async def _ensure_started(self) -> None:
+        async with self._start_lock:
+            if self._proc is not None and self._proc.returncode is None:
+                return
+            cmd = self.make_command()
+            self.log.info("Starting Slurm agent: %s", cmd)
+            self._proc = await asyncio.create_subprocess_shell(
+                cmd,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                limit=2**24,
+            )
+            asyncio.ensure_future(self._read_responses(self._proc))
+            asyncio.ensure_future(self._log_stderr(self._proc))
+
+    async def _read_responses(self, proc: asyncio.subprocess.Process) -> None:
+        while line := await proc.stdout.readline():
+            try:
+                response = json.loads(line)
+            except json.JSONDecodeError:
+                self.log.warning("Invalid response from Slurm agent: %r", line)
+                continue
+            future = self._pending.get(response.get("id"))
+            if future is not None and not future.done():
+                future.set_result(response)
+            elif response.get("id") is None:
+                self.log.warning("Slurm agent error: %s", response.get("error"))
+        returncode = await proc.wait()
+        self.log.warning("Slurm agent exited with status %s", returncode)
+        if returncode == 255:
+            # The ssh command running the agent failed, e.g. to connect
+            metrics.SSH_CONNECT_FAILURES.labels(operation="agent").inc()
+        if proc is self._proc:
+            self._fail_pending(f"Slurm agent exited with status {returncode}")
+
+    async def _log_stderr(self, proc: asyncio.subprocess.Process) -> None:
+        while line := await proc.stderr.readline():
+            self.log.warning("Slurm agent: %s", line.decode().rstrip())
+
+    def _fail_pending(self, message: str) -> None:
+        for future in self._pending.values():
+            if not future.done():
+                future.set_result({"ok": False, "error": message, "unavailable": True})
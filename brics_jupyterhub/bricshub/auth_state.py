@@ -0,0 +1,78 @@
+"""
+Compact storage of BricsAuthenticator auth_state
+
+BricsAuthenticator's auth_state maps the key of each of the user's projects on
+the platform (<PROJECT>.<PORTAL>) to the project's human-readable name and the
+user's Unix username for the project (<USER>.<PROJECT>)::
+
+    {"<PROJECT>.<PORTAL>": {"name": "<name>", "username": "<USER>.<PROJECT>"}, ...}
+
+JupyterHub stores auth_state encrypted with JUPYTERHUB_CRYPT_KEY and decrypts
+it each time it is needed (e.g. for each spawn). `compact_auth_state()` keeps
+only the fields the spawner uses, as a list of ``[key, name, username]``
+entries in which a username of the usual form <USER>.<PROJECT> is omitted
+(stored as ""), and `expand_auth_state()` restores the original form.
+
+Both are applied through JupyterHub extension points:
+`compact_auth_state_hook()` is used as `Authenticator.post_auth_hook`, so
+auth_state is compacted before JupyterHub stores it, and
+`BricsHubSlurmSpawner.run_auth_state_hook()` expands it before it is passed to
+the spawner's `auth_state_hook`. Other readers of stored auth_state (e.g. the
+REST API) see the compact form.
+"""
+
+from typing import Any
+
+# Key of the list of projects in compact auth_state. Project keys contain a "."
+# (<PROJECT>.<PORTAL>), so this cannot be the key of a project.
+COMPACT_KEY = "projects_v1"
+
+
+def _default_username(username: str, project_key: str) -> str:
+    """Return the usual Unix username (<USER>.<PROJECT>) of `username` for project `project_key`"""
+    return f"{username}.{project_key.partition('.')[0]}"
+
+
+def compact_auth_state(auth_state: Any, username: str) -> Any:
+    """
+    Return the compact form of BricsAuthenticator auth_state `auth_state` of user `username`
+
+    Fields of projects other than the name and Unix username are discarded.
+    Returns `auth_state` unchanged if it is empty, already compact or not of
+    the form produced by BricsAuthenticator.
+    """
+    if not isinstance(auth_state, dict) or not auth_state or COMPACT_KEY in auth_state:
+        return auth_state
+    projects = []
+    for key, project in auth_state.items():
+        if not (isinstance(project, dict) and isinstance(project.get("name"), str)):
+            return auth_state
+        unix_username = project.get("username")
+        if not isinstance(unix_username, str):
+            return auth_state
+        if unix_username == _default_username(username, key):
+            unix_username = ""
+        projects.append([key, project["name"], unix_username])
+    return {COMPACT_KEY: projects}
+
+
+def expand_auth_state(auth_state: Any, username: str) -> Any:
+    """
+    Return auth_state `auth_state` of user `username` in the form produced by
+    BricsAuthenticator, expanding it if compact (see `compact_auth_state()`)
+    """
+    if not isinstance(auth_state, dict) or COMPACT_KEY not in auth_state:
+        return auth_state
+    return {
+        key: {"name": name, "username": unix_username or _default_username(username, key)}
+        for key, name, unix_username in auth_state[COMPACT_KEY]
+    }
+
+
+def compact_auth_state_hook(authenticator, handler, authentication: dict) -> dict:
+    """
+    `Authenticator.post_auth_hook` compacting the auth_state of `authentication` (see `compact_auth_state()`)
+    """
+    if authentication.get("auth_state") is not None:
+        authentication["auth_state"] = compact_auth_state(authentication["auth_state"], authentication["name"])
+    return authentication
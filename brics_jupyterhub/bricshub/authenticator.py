@@ -0,0 +1,224 @@
+"""
+BricsAuthenticator extended for the containerised JupyterHub deployment
+"""
+
+from importlib.metadata import entry_points
+from pathlib import Path
+
+import jwt
+from jupyterhub.handlers import BaseHandler
+from tornado import web
+from tornado.ioloop import IOLoop
+from traitlets import Float, Integer, List, Unicode
+
+from bricshub.jwt_verifier import JWTVerifier, VerifiedJWTCache
+from bricshub.oidc import OIDCMetadataCache
+
+# BricsAuthenticator is registered as the "brics" authenticator entry point by
+# the bricsauthenticator package
+BricsAuthenticator = entry_points(group="jupyterhub.authenticators")["brics"].load()
+
+
+class BricsHubLoginHandler(BaseHandler):
+    """
+    Login handler which verifies the JWT in the request using `BricsHubAuthenticator.verify_jwt()`
+
+    The verified claims are passed to `BricsAuthenticator.authenticate()`,
+    which maps them to the JupyterHub user and auth_state.
+    """
+
+    async def get(self):
+        authenticator = self.authenticator
+        token = self.request.headers.get(authenticator.jwt_header)
+        if not token:
+            raise web.HTTPError(401, f"Missing {authenticator.jwt_header} header")
+        try:
+            claims = await authenticator.verify_jwt(token)
+        except jwt.PyJWTError as e:
+            self.log.warning("Failed to verify JWT: %s", e)
+            if authenticator.invalid_jwt_logout:
+                self.redirect(authenticator.logout_redirect_url)
+                return
+            raise web.HTTPError(403, "Invalid JWT") from e
+        except (OSError, ValueError) as e:
+            self.log.error("Failed to fetch OIDC metadata from %s: %s", authenticator.oidc_server, e)
+            raise web.HTTPError(503, "OIDC server unavailable") from e
+        user = await self.login_user(claims)
+        if user is None:
+            raise web.HTTPError(403)
+        self.redirect(self.get_next_url(user))
+
+
+class BricsHubAuthenticator(BricsAuthenticator):
+    """
+    BricsAuthenticator which caches the results of verifying JWTs and OIDC metadata
+
+    Every request handled by BricsAuthenticator carries a JWT, which can be
+    large (the projects claim lists all of the user's projects). Tokens are
+    verified by a `bricshub.jwt_verifier.JWTVerifier` at login (see
+    `BricsHubLoginHandler`) and when JupyterHub refreshes the authentication
+    of a logged in user (see `refresh_user()`). The verified and decoded
+    claims are cached (see `VerifiedJWTCache`) until the token expires, so
+    that repeated requests with the same token skip signature verification
+    and JSON parsing. Cache hits and misses and the time taken to verify
+    tokens are recorded as Prometheus metrics.
+
+    Tokens are verified against the discovery document and signing keys
+    (JWKS) of `oidc_server` kept in a cache refreshed in the background (see
+    `OIDCMetadataCache`), so that verifying a token does not wait for the OIDC
+    server. If `oidc_cache_persist_path` is set, the last good copy is loaded
+    when the Hub starts.
+    """
+
+    jwt_header = Unicode(
+        "X-Auth-Id-Token",
+        config=True,
+        help="HTTP request header containing the JWT",
+    )
+
+    jwt_required_claims = List(
+        Unicode(),
+        ["exp", "iat", "iss", "aud"],
+        config=True,
+        help="""
+        Claims which a JWT must contain to be valid
+
+        Tokens without an "exp", "iss" or "aud" claim would otherwise not be
+        checked for expiry, issuer or audience.
+        """,
+    )
+
+    jwt_cache_size = Integer(
+        1024,
+        config=True,
+        help="Maximum number of verified JWTs cached. If 0, verified JWTs are not cached.",
+    )
+
+    jwt_cache_max_ttl = Float(
+        300.0,
+        config=True,
+        help="""
+        Maximum time (in seconds) for which a verified JWT is cached
+
+        Tokens are cached until they expire (including `jwt_leeway`), or for
+        this many seconds if sooner.
+        """,
+    )
+
+    oidc_cache_refresh_interval = Float(
+        300.0,
+        config=True,
+        help="""
+        Interval (in seconds) between background refreshes of the OIDC metadata cache
+
+        If 0, OIDC metadata is not refreshed in the background, and is fetched
+        for each login.
+        """,
+    )
+
+    oidc_cache_retry_interval = Float(
+        30.0,
+        config=True,
+        help="Interval (in seconds) between attempts to refresh the OIDC metadata cache after a failure",
+    )
+
+    oidc_cache_unknown_kid_refetch_interval = Float(
+        30.0,
+        config=True,
+        help="""
+        Minimum interval (in seconds) between fetches of the JWKS for unknown key IDs
+
+        A token signed with a key ID not in the cached JWKS causes the JWKS to
+        be fetched immediately, unless it was fetched for an unknown key ID
+        less than this many seconds ago.
+        """,
+    )
+
+    oidc_cache_fetch_timeout = Float(
+        10.0,
+        config=True,
+        help="Timeout (in seconds) for requests to the OIDC server made by the OIDC metadata cache",
+    )
+
+    oidc_cache_persist_path = Unicode(
+        "",
+        config=True,
+        help="""
+        File in which to store the last good copy of the OIDC metadata cache
+
+        The copy is loaded when the Hub starts, so that tokens can be verified
+        before the OIDC server has been contacted. If empty, the cache is not
+        persisted.
+        """,
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._oidc_cache = OIDCMetadataCache(
+            oidc_server=self.oidc_server,
+            refresh_interval=self.oidc_cache_refresh_interval,
+            retry_interval=self.oidc_cache_retry_interval,
+            unknown_kid_refetch_interval=self.oidc_cache_unknown_kid_refetch_interval,
+            fetch_timeout=self.oidc_cache_fetch_timeout,
+            persist_path=Path(self.oidc_cache_persist_path) if self.oidc_cache_persist_path else None,
+            log=self.log,
+        )
+        if self.oidc_cache_refresh_interval > 0:
+            self._oidc_cache.load_persisted()
+            IOLoop.current().add_callback(self._oidc_cache.start)
+        self._jwt_verifier = JWTVerifier(
+            oidc_cache=self._oidc_cache,
+            audience=self.jwt_audience,
+            leeway=self.jwt_leeway,
+            required_claims=self.jwt_required_claims,
+            cache=(
+                VerifiedJWTCache(max_size=self.jwt_cache_size, max_ttl=self.jwt_cache_max_ttl)
+                if self.jwt_cache_size > 0
+                else None
+            ),
+            fetch_metadata=self.oidc_cache_refresh_interval <= 0,
+        )
+
+    def get_handlers(self, app):
+        return [(r"/login", BricsHubLoginHandler)]
+
+    async def verify_jwt(self, token: str) -> dict:
+        """
+        Return the claims of JWT `token` after verifying it with the cached OIDC metadata
+
+        See `bricshub.jwt_verifier.JWTVerifier`. Raises a `jwt.PyJWTError` if
+        the token is invalid, or an `OSError` or `ValueError` if the OIDC
+        metadata could not be fetched.
+        """
+        return await self._jwt_verifier.verify(token)
+
+    async def refresh_user(self, user, handler=None):
+        """
+        Check that the JWT in the request (if any) is valid and belongs to `user`
+
+        Called by JupyterHub for requests authenticated by a cookie once every
+        `auth_refresh_age` seconds. Returns False, so that the user must log in
+        again, if the token is invalid (e.g. expired) or is for a different
+        user, or the user's new auth model if its auth_state has changed (e.g.
+        the user's projects). Requests without a token (e.g. API requests) and
+        requests made while the OIDC server is unavailable are allowed.
+        """
+        token = handler.request.headers.get(self.jwt_header) if handler is not None else None
+        if not token:
+            return True
+        try:
+            claims = await self.verify_jwt(token)
+        except jwt.PyJWTError as e:
+            self.log.warning("Invalid JWT in request for user %s: %s", user.name, e)
+            return False
+        except (OSError, ValueError) as e:
+            self.log.warning("Could not verify JWT for user %s, OIDC server unavailable: %s", user.name, e)
+            return True
+        model = await self.authenticate(handler, claims)
+        if model is None or model.get("name") != user.name:
+            self.log.warning("JWT in request for user %s does not authenticate that user", user.name)
+            return False
+        model = await self.run_post_auth_hook(handler, model)
+        if model.get("auth_state") == await user.get_auth_state():
+            return True
+        return model
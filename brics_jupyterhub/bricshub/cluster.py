@@ -0,0 +1,287 @@
+"""
+Hub-wide snapshot of cluster resources (partitions, idle nodes and GPUs, reservations) refreshed in the background
+"""
+
+import asyncio
+import logging
+import re
+import time
+from typing import Awaitable, Callable
+
+from bricshub import metrics
+
+# "Key=value" fields of `scontrol --oneliner show` output. Values may contain
+# spaces (e.g. OS=Linux 5.14.0 ...), so extend up to the next " Key=".
+_FIELD_RE = re.compile(r"(\w+)=(.*?)(?=\s+\w+=|\s*$)")
+
+# Node state flags (following the base state, e.g. IDLE+DRAIN) for which new
+# jobs are not started on the node
+_UNAVAILABLE_NODE_FLAGS = {
+    "DOWN",
+    "DRAIN",
+    "DRAINED",
+    "DRAINING",
+    "FAIL",
+    "FAILING",
+    "MAINT",
+    "NOT_RESPONDING",
+    "POWERING_DOWN",
+    "REBOOT_ISSUED",
+    "REBOOT_REQUESTED",
+    "RESERVED",
+}
+
+
+def slurm_time_minutes(value: str) -> int | None:
+    """
+    Return the number of minutes in Slurm time limit `value` (e.g. ``1-12:00:00``), or None if unlimited
+
+    Accepts the formats of sbatch --time: ``minutes``, ``minutes:seconds``,
+    ``hours:minutes:seconds``, ``days-hours``, ``days-hours:minutes`` and
+    ``days-hours:minutes:seconds``. Raises ValueError for other values.
+    """
+    value = value.strip()
+    if value.upper() in ("UNLIMITED", "INFINITE"):
+        return None
+    days, sep, clock = value.rpartition("-")
+    parts = [int(part) for part in clock.split(":")]
+    if len(parts) > 3 or any(part < 0 for part in parts):
+        raise ValueError(f"Invalid Slurm time {value!r}")
+    if sep:
+        # days-hours[:minutes[:seconds]]
+        hours, minutes, seconds = (parts + [0, 0])[:3]
+        return int(days) * 24 * 60 + hours * 60 + minutes + (seconds > 0)
+    if len(parts) == 3:
+        hours, minutes, seconds = parts
+    else:
+        hours, (minutes, seconds) = 0, (parts + [0])[:2]
+    return hours * 60 + minutes + (seconds > 0)
+
+
+def _parse_fields(line: str) -> dict[str, str]:
+    return {key: value.strip() for key, value in _FIELD_RE.findall(line)}
+
+
+def _parse_list(value: str) -> list[str]:
+    """Parse a comma-separated list field, where ``(null)`` is empty"""
+    return [item for item in value.split(",") if item and item != "(null)"]
+
+
+def _gpu_count(tres: str) -> int:
+    """Return the number of GPUs in a TRES string (e.g. ``cpu=72,gres/gpu=4``)"""
+    for item in _parse_list(tres):
+        name, _, count = item.partition("=")
+        if name == "gres/gpu":
+            return int(count)
+    return 0
+
+
+class Partition:
+    """Availability of a Slurm partition in a `ClusterSnapshot`"""
+
+    def __init__(self, name: str, max_time: str, default: bool):
+        self.name = name
+        self.max_time = max_time
+        self.max_time_minutes = slurm_time_minutes(max_time)
+        self.default = default
+        self.nodes = 0
+        self.idle_nodes = 0
+        self.idle_gpus = 0
+        # Largest number of GPUs in a node of the partition
+        self.gpus_per_node = 0
+
+
+class Reservation:
+    """Active Slurm reservation in a `ClusterSnapshot`"""
+
+    def __init__(self, name: str, partition: str, end_time: str, users: list[str], accounts: list[str]):
+        self.name = name
+        self.partition = partition
+        self.end_time = end_time
+        self.users = users
+        self.accounts = accounts
+
+    def allows(self, user: str, account: str) -> bool:
+        """
+        Return True if `user` (with Slurm account `account`) may be able to use the reservation
+
+        Reservations granted to groups are assumed to be usable by any user
+        (sbatch rejects the job if not).
+        """
+        if f"-{user}" in self.users or f"-{account}" in self.accounts:
+            return False
+        users = [name for name in self.users if not name.startswith("-")]
+        accounts = [name for name in self.accounts if not name.startswith("-")]
+        if users:
+            return user in users
+        if accounts:
+            return account in accounts
+        return True
+
+
+class ClusterSnapshot:
+    """
+    Partitions and active reservations of a cluster at a point in time
+
+    Parsed from the concatenated output of
+
+        scontrol --oneliner show partition
+        scontrol --oneliner show node
+        scontrol --oneliner show reservation
+
+    i.e. one line per partition, node and reservation of ``Key=value``
+    fields. Only partitions which are up, and reservations which are active,
+    are included. A node is idle if its state is IDLE, and its idle GPUs (the
+    GPUs configured in ``CfgTRES`` and not allocated in ``AllocTRES``) count
+    towards each of its partitions if the node is idle or partly allocated
+    (MIXED) and not drained, down or reserved.
+    """
+
+    def __init__(self, partitions: dict[str, Partition], reservations: list[Reservation], fetched_at: float):
+        self.partitions = partitions
+        self.reservations = reservations
+        # Unix time at which the query for the snapshot started
+        self.fetched_at = fetched_at
+
+    @classmethod
+    def parse(cls, out: str, fetched_at: float) -> "ClusterSnapshot":
+        partitions: dict[str, Partition] = {}
+        nodes: list[dict[str, str]] = []
+        reservations: list[Reservation] = []
+        for line in out.splitlines():
+            fields = _parse_fields(line)
+            if "PartitionName" in fields and "ReservationName" not in fields:
+                if fields.get("State", "UP") == "UP":
+                    name = fields["PartitionName"]
+                    partitions[name] = Partition(
+                        name, max_time=fields.get("MaxTime", "UNLIMITED"), default=fields.get("Default") == "YES"
+                    )
+            elif "NodeName" in fields:
+                nodes.append(fields)
+            elif "ReservationName" in fields and fields.get("State") == "ACTIVE":
+                reservations.append(
+                    Reservation(
+                        fields["ReservationName"],
+                        partition=fields.get("PartitionName", "(null)").replace("(null)", ""),
+                        end_time=fields.get("EndTime", ""),
+                        users=_parse_list(fields.get("Users", "")),
+                        accounts=_parse_list(fields.get("Accounts", "")),
+                    )
+                )
+
+        for fields in nodes:
+            base_state, *flags = fields.get("State", "UNKNOWN").split("+")
+            available = base_state in ("IDLE", "MIXED") and not _UNAVAILABLE_NODE_FLAGS.intersection(flags)
+            gpus = _gpu_count(fields.get("CfgTRES", ""))
+            idle_gpus = max(0, gpus - _gpu_count(fields.get("AllocTRES", ""))) if available else 0
+            for name in _parse_list(fields.get("Partitions", "")):
+                partition = partitions.get(name)
+                if partition is None:
+                    continue
+                partition.nodes += 1
+                partition.idle_nodes += available and base_state == "IDLE"
+                partition.idle_gpus += idle_gpus
+                partition.gpus_per_node = max(partition.gpus_per_node, gpus)
+
+        return cls(partitions, reservations, fetched_at)
+
+    def reservations_for(self, user: str, account: str) -> list[Reservation]:
+        """Return the active reservations which `user` (with Slurm account `account`) may be able to use"""
+        return [reservation for reservation in self.reservations if reservation.allows(user, account)]
+
+
+class ClusterResourceCache:
+    """
+    Snapshot of cluster resources shared by all spawners in the Hub
+
+    A `ClusterSnapshot` is taken by running the command returned by
+    `make_command` in the background every `refresh_interval` seconds (or
+    `retry_interval` seconds after a failed query), and the most recent
+    snapshot is served in the meantime. Reading the snapshot (e.g. to render
+    the spawn options form) never runs a Slurm command, but may wait for the
+    first background query to complete. Once the most recent
+    snapshot is older than `max_staleness` seconds (e.g. while Slurm is
+    unreachable), `snapshot` is None, so callers can fall back to defaults
+    rather than showing out-of-date availability.
+
+    The time of the most recent snapshot
+    (`bricshub_cluster_snapshot_timestamp_seconds`) and the number of queries
+    by result (`bricshub_cluster_snapshot_refreshes_total{result}`) are
+    recorded as Prometheus metrics.
+    """
+
+    def __init__(
+        self,
+        run_command: Callable[[str], Awaitable[str]],
+        make_command: Callable[[], str],
+        refresh_interval: float,
+        retry_interval: float,
+        max_staleness: float,
+        log: logging.Logger,
+    ):
+        self.run_command = run_command
+        self.make_command = make_command
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.max_staleness = max_staleness
+        self.log = log
+
+        # Most recent snapshot, however old
+        self.latest: ClusterSnapshot | None = None
+
+        self._refresh_task: asyncio.Task | None = None
+        # Set when the first snapshot has been taken
+        self._ready = asyncio.Event()
+
+    @property
+    def snapshot(self) -> ClusterSnapshot | None:
+        """The most recent snapshot, or None if there is none younger than `max_staleness`"""
+        if self.latest is None or time.time() - self.latest.fetched_at > self.max_staleness:
+            return None
+        return self.latest
+
+    async def wait_for_snapshot(self, timeout: float) -> ClusterSnapshot | None:
+        """
+        Return the most recent snapshot, waiting up to `timeout` seconds for the
+        first snapshot to be taken (e.g. just after the Hub starts)
+
+        Returns None if no snapshot younger than `max_staleness` is available.
+        """
+        if self.latest is None:
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.snapshot
+
+    def start(self) -> None:
+        """Start refreshing the snapshot in the background"""
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.ensure_future(self._refresh_loop())
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+                interval = self.refresh_interval
+            except Exception as e:
+                metrics.CLUSTER_SNAPSHOT_REFRESHES.labels(result="error").inc()
+                age = time.time() - self.latest.fetched_at if self.latest else float("inf")
+                self.log.warning("Failed to refresh cluster resources (snapshot is %.0f s old): %s", age, e)
+                interval = self.retry_interval
+            await asyncio.sleep(interval)
+
+    async def refresh(self) -> None:
+        """Take a new snapshot, replacing the cached snapshot"""
+        fetched_at = time.time()
+        out = await self.run_command(self.make_command())
+        self.latest = ClusterSnapshot.parse(out, fetched_at)
+        self._ready.set()
+        metrics.CLUSTER_SNAPSHOT_REFRESHES.labels(result="success").inc()
+        metrics.CLUSTER_SNAPSHOT_TIMESTAMP_SECONDS.set(fetched_at)
+        self.log.debug(
+            "Refreshed cluster resources: %d partitions, %d active reservations in %.3f s",
+            len(self.latest.partitions),
+            len(self.latest.reservations),
+            time.time() - fetched_at,
+        )
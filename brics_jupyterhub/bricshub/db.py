@@ -0,0 +1,89 @@
+"""
+Connection settings for the JupyterHub database (SQLite PRAGMAs, connection pool)
+"""
+
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# PRAGMAs set on each new SQLite connection, see enable_sqlite_pragmas()
+_sqlite_pragmas: dict[str, str | int] = {}
+
+
+def sqlite_pragmas(journal_mode: str = "WAL", synchronous: str = "NORMAL") -> dict[str, str | int]:
+    """
+    Return PRAGMAs tuning SQLite for the JupyterHub database
+
+    With the default `journal_mode` ("WAL"), readers do not block the writer
+    and a transaction is committed by appending to the write-ahead log, rather
+    than rewriting pages in the database file and journal. With `synchronous`
+    "NORMAL", the log is only synced to disk at checkpoints, so a commit does
+    not wait for an fsync. The database stays consistent if JupyterHub or the
+    container crashes, but the most recently committed transactions may be
+    lost if the host loses power or crashes. Use "FULL" (SQLite's default) to
+    sync every commit.
+
+    WAL mode requires the database to be on a local filesystem (not a network
+    filesystem), since the log index is shared using memory-mapped files.
+    Raises ValueError for invalid modes.
+    """
+    journal_mode, synchronous = journal_mode.upper(), synchronous.upper()
+    if journal_mode not in ("DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"):
+        raise ValueError(f"Invalid SQLite journal mode: {journal_mode}")
+    if synchronous not in ("OFF", "NORMAL", "FULL", "EXTRA"):
+        raise ValueError(f"Invalid SQLite synchronous setting: {synchronous}")
+    return {
+        "journal_mode": journal_mode,
+        "synchronous": synchronous,
+        # Wait for locks held by other connections rather than failing with
+        # "database is locked"
+        "busy_timeout": 5000,
+        # Page cache of up to 64 MiB per connection (negative values are KiB)
+        "cache_size": -64 * 1024,
+        "temp_store": "MEMORY",
+    }
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    if not isinstance(dbapi_connection, sqlite3.Connection) or not _sqlite_pragmas:
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in _sqlite_pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+    finally:
+        cursor.close()
+
+
+def enable_sqlite_pragmas(pragmas: dict[str, str | int]) -> None:
+    """
+    Set `pragmas` on each new SQLite connection made by SQLAlchemy
+
+    Applies to connections made by all engines, e.g. the engine JupyterHub
+    creates for `db_url`. Connections to other databases are not affected.
+    Replaces any previously enabled PRAGMAs.
+    """
+    _sqlite_pragmas.clear()
+    _sqlite_pragmas.update(pragmas)
+    if not event.contains(Engine, "connect", _set_sqlite_pragmas):
+        event.listen(Engine, "connect", _set_sqlite_pragmas)
+
+
+def pool_kwargs(pool_size: int = 5, max_overflow: int = 10) -> dict:
+    """
+    Return `create_engine()` arguments for the connection pool of a database server (e.g. PostgreSQL)
+
+    The pool keeps up to `pool_size` connections open, opening up to
+    `max_overflow` more when busy. Connections are checked before use
+    (`pool_pre_ping`) and replaced after an hour, so that connections closed by
+    the server (e.g. after a database restart) are not handed to JupyterHub.
+    Pass as `c.JupyterHub.db_kwargs`.
+    """
+    return {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": 30,
+        "pool_pre_ping": True,
+        "pool_recycle": 3600,
+    }
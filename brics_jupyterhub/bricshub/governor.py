@@ -0,0 +1,100 @@
+"""
+Adaptive interval between bulk job status queries, tuned to the load on the SSH host and Slurm
+"""
+
+import logging
+
+from bricshub import metrics
+
+
+class PollGovernor:
+    """
+    Governor choosing the maximum age of cached job states (see
+    `bricshub.poller.SlurmJobStatusPoller`), i.e. the interval between bulk job
+    status queries sent to Slurm
+
+    The latency and outcome of every Slurm command (or Slurm agent request) is
+    passed to `observe()`, and tracked as exponentially weighted moving
+    averages. After each bulk query, `update()` chooses the next interval
+    between `min_age` and `max_age`:
+
+    * If the average latency is above `latency_target` or the average error
+      rate (commands failing or timing out) is above `max_error_rate`, the SSH
+      host or slurmctld is overloaded and the interval is doubled.
+    * If the average latency and error rate are below half their targets, the
+      system is idle: while any job is pending, the interval is halved down to
+      `min_age`, so that the start of jobs is detected sooner; otherwise the
+      interval returns to `base_age`.
+    * Otherwise, the interval is unchanged.
+
+    Each change is logged with the reason, and the current interval, averages
+    and number of changes by reason are exported as Prometheus metrics.
+    """
+
+    # Weight of each new observation in the moving averages
+    smoothing = 0.2
+
+    def __init__(
+        self,
+        base_age: float,
+        min_age: float,
+        max_age: float,
+        latency_target: float,
+        max_error_rate: float,
+        log: logging.Logger,
+    ):
+        self.base_age = base_age
+        self.min_age = min(min_age, base_age)
+        self.max_age = max(max_age, base_age)
+        self.latency_target = latency_target
+        self.max_error_rate = max_error_rate
+        self.log = log
+
+        self.age = base_age
+        self.latency: float | None = None
+        self.error_rate = 0.0
+        metrics.POLL_GOVERNOR_QUERY_INTERVAL_SECONDS.set(self.age)
+
+    def observe(self, duration: float, succeeded: bool) -> None:
+        """Record the latency (in seconds) and outcome of a Slurm command"""
+        if self.latency is None:
+            self.latency = duration
+        else:
+            self.latency += self.smoothing * (duration - self.latency)
+        self.error_rate += self.smoothing * ((0.0 if succeeded else 1.0) - self.error_rate)
+        metrics.POLL_GOVERNOR_LATENCY_SECONDS.set(self.latency)
+        metrics.POLL_GOVERNOR_ERROR_RATE.set(self.error_rate)
+
+    def update(self, pending_jobs: int) -> float:
+        """
+        Return the interval (in seconds) until the next bulk job status query,
+        given the number of jobs pending in the Slurm queue
+        """
+        latency = self.latency or 0.0
+        if latency > self.latency_target:
+            age, reason = self.age * 2, f"latency {latency:.2f} s above target {self.latency_target:.2f} s"
+            label = "latency"
+        elif self.error_rate > self.max_error_rate:
+            age, reason = self.age * 2, f"error rate {self.error_rate:.0%} above {self.max_error_rate:.0%}"
+            label = "errors"
+        elif latency > self.latency_target / 2 or self.error_rate > self.max_error_rate / 2:
+            return self.age
+        elif pending_jobs:
+            age, reason = self.age / 2, f"{pending_jobs} pending jobs, latency {latency:.2f} s"
+            label = "pending"
+        elif self.age > self.base_age:
+            age, reason = self.age / 2, f"recovered, latency {latency:.2f} s"
+            label = "recovered"
+        else:
+            age, reason = self.base_age, "no pending jobs"
+            label = "idle"
+
+        age = max(self.min_age, min(self.max_age, age))
+        if label == "recovered":
+            age = max(age, self.base_age)
+        if age != self.age:
+            self.log.info("Bulk job status query interval changed from %.1f s to %.1f s: %s", self.age, age, reason)
+            metrics.POLL_GOVERNOR_CHANGES.labels(reason=label).inc()
+            self.age = age
+            metrics.POLL_GOVERNOR_QUERY_INTERVAL_SECONDS.set(age)
+        return self.age
@@ -0,0 +1,152 @@
+"""
+Health tracking and least-loaded routing of commands across several SSH hosts
+"""
+
+import asyncio
+import logging
+import random
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable
+
+from bricshub import metrics
+
+
+class SSHHost:
+    """Health and load of an SSH host, as observed by `SSHHostPool`"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.healthy = True
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.last_failure = float("-inf")
+        # Moving averages of command latency (None until a command completes)
+        # and of the fraction of commands failing with SSH errors
+        self.latency: float | None = None
+        self.failure_rate = 0.0
+
+    def score(self) -> float:
+        """Return the cost of routing a command to this host (lower is better)"""
+        return (self.in_flight + 1) * ((self.latency or 0.0) + 0.05) * (1 + 4 * self.failure_rate)
+
+
+class SSHHostPool:
+    """
+    Pool of equivalent SSH hosts (e.g. login nodes of a cluster) to which commands are routed
+
+    Each command is routed by `choose()` to the healthy host with the lowest
+    cost, which combines the number of commands currently running on the host,
+    the moving average of command latency on the host and its recent rate of
+    SSH failures. A host is marked unhealthy after `failure_threshold`
+    consecutive SSH failures (e.g. connection timeouts while the host reboots)
+    and only used if no healthy host is available, until a command or probe
+    succeeds again.
+
+    If `probe` is given, once `start()` is called every host is probed every
+    `probe_interval` seconds by awaiting ``probe(host)`` (e.g. running ``true``
+    over SSH), which should raise an exception if the host cannot be used, so
+    that unhealthy hosts are detected and recover without routing users'
+    commands to them.
+
+    Each host's health (`bricshub_ssh_host_healthy{host}`) and latency
+    (`bricshub_ssh_host_latency_seconds{host}`) are exported as Prometheus
+    metrics.
+    """
+
+    # Weight of each new observation in the moving averages
+    smoothing = 0.2
+
+    def __init__(
+        self,
+        hosts: list[str],
+        log: logging.Logger,
+        probe: Callable[[str], Awaitable] | None = None,
+        probe_interval: float = 30.0,
+        failure_threshold: int = 3,
+    ):
+        self.hosts = {name: SSHHost(name) for name in hosts}
+        self.log = log
+        self.probe = probe
+        self.probe_interval = probe_interval
+        self.failure_threshold = failure_threshold
+        for host in self.hosts.values():
+            metrics.SSH_HOST_HEALTHY.labels(host=host.name).set(1)
+
+        self._probe_task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        """Start probing hosts in the background, if `probe` is given"""
+        if self._probe_task is None and self.probe is not None and self.probe_interval > 0:
+            self._probe_task = asyncio.ensure_future(self._probe_loop())
+
+    def choose(self, exclude: list[str] = ()) -> str:
+        """
+        Return the name of the host to route a command to, not including hosts in `exclude`
+
+        Raises ValueError if all hosts are excluded.
+        """
+        candidates = [host for name, host in self.hosts.items() if name not in exclude]
+        if not candidates:
+            raise ValueError("No SSH hosts available")
+        healthy = [host for host in candidates if host.healthy]
+        if healthy:
+            # Shuffle so that hosts with equal cost share the load
+            random.shuffle(healthy)
+            return min(healthy, key=SSHHost.score).name
+        # Try the unhealthy host which has failed least recently
+        return min(candidates, key=lambda host: host.last_failure).name
+
+    @contextmanager
+    def running(self, name: str):
+        """Context manager counting a command as running on host `name`"""
+        host = self.hosts[name]
+        host.in_flight += 1
+        try:
+            yield
+        finally:
+            host.in_flight -= 1
+
+    def record(self, name: str, duration: float, succeeded: bool) -> None:
+        """
+        Record the latency (in seconds) and outcome of a command run on host
+        `name`, where `succeeded` is False for SSH failures
+        """
+        host = self.hosts[name]
+        if host.latency is None:
+            host.latency = duration
+        else:
+            host.latency += self.smoothing * (duration - host.latency)
+        host.failure_rate += self.smoothing * ((0.0 if succeeded else 1.0) - host.failure_rate)
+        metrics.SSH_HOST_LATENCY_SECONDS.labels(host=name).set(host.latency)
+
+        if succeeded:
+            host.consecutive_failures = 0
+            if not host.healthy:
+                self.log.info("SSH host %s is healthy again", name)
+                self._set_healthy(host, True)
+        else:
+            host.consecutive_failures += 1
+            host.last_failure = time.monotonic()
+            if host.healthy and host.consecutive_failures >= self.failure_threshold:
+                self.log.warning("SSH host %s marked unhealthy after %d failures", name, host.consecutive_failures)
+                self._set_healthy(host, False)
+
+    def _set_healthy(self, host: SSHHost, healthy: bool) -> None:
+        host.healthy = healthy
+        metrics.SSH_HOST_HEALTHY.labels(host=host.name).set(int(healthy))
+
+    async def _probe_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.probe_interval)
+            await asyncio.gather(*(self._probe(name) for name in self.hosts))
+
+    async def _probe(self, name: str) -> None:
+        start = time.monotonic()
+        try:
+            await self.probe(name)
+        except Exception as e:
+            self.log.debug("Probe of SSH host %s failed: %s", name, e)
+            self.record(name, time.monotonic() - start, succeeded=False)
+        else:
+            self.record(name, time.monotonic() - start, succeeded=True)
@@ -0,0 +1,158 @@
+"""
+Verification of JWTs issued by an OIDC server, with a cache of verified claims
+"""
+
+import hashlib
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+import jwt
+from jwt.api_jwk import PyJWK
+
+from bricshub import metrics
+from bricshub.oidc import OIDCMetadataCache
+
+
+class VerifiedJWTCache:
+    """
+    Bounded LRU cache of the results of verifying and decoding JWTs
+
+    Entries are keyed by a hash of the token, the key used to verify its
+    signature and the verification options, so a token is only served from
+    the cache if it was previously verified in the same way. Entries expire
+    when the token expires (its "exp" claim plus the leeway used when it was
+    verified), or `max_ttl` seconds after they were added if sooner. When the
+    cache holds `max_size` entries, the least recently used entry is evicted.
+    """
+
+    def __init__(self, max_size: int, max_ttl: float):
+        self.max_size = max_size
+        self.max_ttl = max_ttl
+
+        # Cache key mapped to (expiry Unix time, decoded claims)
+        self._entries: OrderedDict[tuple, tuple[float, dict]] = OrderedDict()
+
+    def get(self, key: tuple) -> dict | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, decoded = entry
+        if time.time() >= expires_at:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return decoded
+
+    def put(self, key: tuple, decoded: dict, leeway: float) -> None:
+        expires_at = time.time() + self.max_ttl
+        exp = decoded.get("exp")
+        if isinstance(exp, (int, float)):
+            expires_at = min(expires_at, exp + leeway)
+        self._entries[key] = (expires_at, decoded)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _key_fingerprint(key) -> str | None:
+    """
+    Return a fingerprint of a JWT verification key, or None if it is not supported
+
+    Supports keys as strings or bytes (e.g. PEM or HMAC secrets), PyJWK
+    objects and cryptography public key objects.
+    """
+    if isinstance(key, PyJWK):
+        key = key.key
+    if isinstance(key, str):
+        key = key.encode()
+    if not isinstance(key, bytes) and hasattr(key, "public_bytes"):
+        from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+
+        key = key.public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo)
+    if isinstance(key, bytes):
+        return hashlib.sha256(key).hexdigest()
+    return None
+
+
+class JWTVerifier:
+    """
+    Verifier of JWTs signed by an OIDC server, using the server's cached metadata
+
+    A token is valid if it is signed with the key in the OIDC server's JWKS
+    named by the token's "kid" header (using that key's algorithm only), its
+    "aud" claim contains `audience`, its "iss" claim is the issuer in the
+    discovery document, it has not expired (allowing `leeway` seconds), and it
+    has all of the claims in `required_claims`.
+
+    If `cache` is given, the claims of valid tokens are cached (see
+    `VerifiedJWTCache`), so that verifying the same token again skips
+    signature verification and JSON parsing. If `fetch_metadata` is set, the
+    OIDC metadata is fetched before each token is verified, rather than being
+    refreshed in the background (see `OIDCMetadataCache.start()`).
+    """
+
+    def __init__(
+        self,
+        oidc_cache: OIDCMetadataCache,
+        audience: str,
+        leeway: float | timedelta,
+        required_claims: list[str],
+        cache: VerifiedJWTCache | None,
+        fetch_metadata: bool = False,
+    ):
+        self.oidc_cache = oidc_cache
+        self.audience = audience
+        self.leeway = leeway
+        self.required_claims = required_claims
+        self.cache = cache
+        self.fetch_metadata = fetch_metadata
+
+    async def verify(self, token: str) -> dict:
+        """
+        Return the claims of JWT `token` after verifying it
+
+        Raises a `jwt.PyJWTError` if the token is invalid (invalid tokens are
+        not cached), or an `OSError` or `ValueError` if the OIDC metadata could
+        not be fetched.
+        """
+        if self.fetch_metadata:
+            await self.oidc_cache.fetch()
+        key = await self.oidc_cache.get_signing_key(jwt.get_unverified_header(token).get("kid"))
+        options = {
+            "algorithms": [key.algorithm_name],
+            "audience": self.audience,
+            "issuer": self.oidc_cache.discovery.get("issuer", self.oidc_cache.oidc_server),
+            "leeway": self.leeway,
+            "options": {"require": list(self.required_claims)},
+        }
+        if self.cache is None:
+            return jwt.decode(token, key=key.key, **options)
+
+        cache_key = (
+            hashlib.sha256(token.encode()).digest(),
+            _key_fingerprint(key),
+            repr(sorted(options.items())),
+        )
+        claims = self.cache.get(cache_key)
+        if claims is not None:
+            metrics.JWT_CACHE_REQUESTS.labels(result="hit").inc()
+        else:
+            metrics.JWT_CACHE_REQUESTS.labels(result="miss").inc()
+            start = time.perf_counter()
+            try:
+                claims = jwt.decode(token, key=key.key, **options)
+            finally:
+                metrics.JWT_VERIFICATION_DURATION_SECONDS.observe(time.perf_counter() - start)
+            leeway = self.leeway
+            if isinstance(leeway, timedelta):
+                leeway = leeway.total_seconds()
+            self.cache.put(cache_key, claims, leeway)
+        metrics.JWT_CACHE_ENTRIES.set(len(self.cache))
+
+        # Return a copy, so callers modifying the claims do not modify the
+        # cached claims
+        return dict(claims)
@@ -0,0 +1,191 @@
+"""
+Structured (JSON lines) logging written by a background thread to rotating files
+
+Enable by adding a handler created by `make_queued_handler()` to the
+JupyterHub logger using the ``logging_config`` configuration attribute, e.g.
+
+.. code-block:: python
+
+    c.JupyterHub.logging_config = {
+        "handlers": {
+            "json": {
+                "()": "bricshub.log.make_queued_handler",
+                "level": "INFO",
+                "filename": "/var/log/jupyterhub/jupyterhub.log",
+            },
+        },
+        "loggers": {"JupyterHub": {"handlers": ["json"]}},
+    }
+"""
+
+import copy
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+# Fields added to log records emitted by the current task, e.g. the spawn ID,
+# user and server name while running spawner methods
+_log_context: ContextVar[dict] = ContextVar("log_context", default={})
+
+
+@contextmanager
+def log_context(**fields):
+    """Context manager adding `fields` to JSON log records emitted within it"""
+    token = _log_context.set({**_log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+class JSONFormatter(logging.Formatter):
+    """Format log records as single-line JSON objects, including log context fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "line": record.lineno,
+            "message": record.getMessage(),
+            **getattr(record, "context", _log_context.get()),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        if record.stack_info:
+            entry["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class QueuedLogHandler(logging.handlers.QueueHandler):
+    """
+    Handler passing log records to a `QueueListener` writing them in a background thread
+
+    Unlike `logging.handlers.QueueHandler`, records are not formatted before
+    being queued, only their message arguments and exception information are
+    converted to strings (since these may change after the record is queued),
+    so that the listener's handlers can format them as structured data. The
+    log context (see `log_context()`) of the emitting task is attached to the
+    record. Closing the handler stops the listener, after writing queued
+    records.
+    """
+
+    def __init__(self, log_queue: queue.SimpleQueue, listener: logging.handlers.QueueListener):
+        super().__init__(log_queue)
+        self._listener = listener
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.context = _log_context.get()
+        return record
+
+    def close(self) -> None:
+        if self._listener is not None:
+            self._listener.stop()
+            for handler in self._listener.handlers:
+                handler.close()
+            self._listener = None
+        super().close()
+
+
+class RotatingCompressedFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    File handler rotating the log file by size and age, optionally compressing rotated files
+
+    The log file is rotated when writing a record would make it larger than
+    `max_bytes`, or `rotate_interval` seconds after it was last rotated (or the
+    handler was created), whichever comes first. Rotated files are named
+    ``<filename>.1``, ``<filename>.2``, ..., up to `backup_count` (older files
+    are deleted), with suffix ``.gz`` if compressed. A limit of 0 disables
+    rotation by size or age.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        max_bytes: int = 0,
+        rotate_interval: float = 0,
+        backup_count: int = 0,
+        compress: bool = False,
+    ):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+        self.rotate_interval = rotate_interval
+        self._rotate_at = self._next_rotate_at()
+        if compress:
+            self.namer = lambda name: f"{name}.gz"
+            self.rotator = _compress_rotated_file
+
+    def _next_rotate_at(self) -> float:
+        return time.time() + self.rotate_interval if self.rotate_interval > 0 else float("inf")
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        return time.time() >= self._rotate_at or bool(super().shouldRollover(record))
+
+    def doRollover(self) -> None:
+        super().doRollover()
+        self._rotate_at = self._next_rotate_at()
+
+
+def _compress_rotated_file(source: str, dest: str) -> None:
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def make_queued_handler(
+    filename: str,
+    max_bytes: int = 100 * 1024 * 1024,
+    rotate_interval: float = 24 * 60 * 60,
+    backup_count: int = 14,
+    compress: bool = True,
+    console: bool = True,
+) -> QueuedLogHandler:
+    """
+    Return a handler writing JSON log records to a rotating file in a background thread
+
+    Records are written to `filename`, rotated by size (`max_bytes`) and age
+    (`rotate_interval`, in seconds) keeping `backup_count` rotated files,
+    compressed using gzip if `compress` is True (see
+    `RotatingCompressedFileHandler`). If `console` is True, records are also
+    written to stderr.
+
+    Formatting and writing records (including rotating and compressing files)
+    is done by a `logging.handlers.QueueListener` thread, so the emitting
+    thread (e.g. the Hub's event loop) only puts records in a queue. This can
+    be used as a handler factory (``"()"`` key) in a `logging.config.dictConfig()`
+    configuration.
+    """
+    formatter = JSONFormatter()
+    file_handler = RotatingCompressedFileHandler(
+        filename,
+        max_bytes=max_bytes,
+        rotate_interval=rotate_interval,
+        backup_count=backup_count,
+        compress=compress,
+    )
+    handlers = [file_handler]
+    if console:
+        handlers.append(logging.StreamHandler(sys.stderr))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *handlers)
+    listener.start()
+    return QueuedLogHandler(log_queue, listener)
@@ -0,0 +1,151 @@
+"""
+Prometheus metrics exposed by JupyterHub at /hub/metrics
+"""
+
+from prometheus_client import Counter, Gauge, Histogram
+
+STARTUP_PHASE_DURATION_SECONDS = Histogram(
+    "bricshub_startup_phase_duration_seconds",
+    "Duration of single-user server startup phases (see bricshub.startup_timing.PHASES)",
+    ["phase"],
+    buckets=[0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30, 60, 120, 300, 600, float("inf")],
+)
+
+# Metrics for commands run by the spawner. The "operation" label is the Slurm
+# operation the command is run for ("submit", "query", "bulk_query", "cancel",
+# "cluster_query", "start_estimate", "user_env", or "other" for commands not run
+# as part of an operation).
+
+SLURM_COMMAND_DURATION_SECONDS = Histogram(
+    "bricshub_slurm_command_duration_seconds",
+    "Duration of Slurm commands and Slurm agent or REST API requests, by result (success, error or timeout)",
+    ["operation", "result"],
+    buckets=[0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, float("inf")],
+)
+
+SLURM_COMMAND_EXIT_STATUS = Counter(
+    "bricshub_slurm_command_exit_status",
+    "Slurm commands completed, by exit status (not including Slurm agent or REST API requests)",
+    ["operation", "exit_status"],
+)
+
+SLURM_COMMAND_TIMEOUTS = Counter(
+    "bricshub_slurm_command_timeouts",
+    "Slurm commands and Slurm agent or REST API requests which timed out, including SSH connection timeouts",
+    ["operation"],
+)
+
+SSH_CONNECT_FAILURES = Counter(
+    "bricshub_ssh_connect_failures",
+    "Commands failing with an SSH error (exit status 255), e.g. failing to connect to the SSH host",
+    ["operation"],
+)
+
+SLURM_COMMANDS_IN_FLIGHT = Gauge(
+    "bricshub_slurm_commands_in_flight",
+    "Slurm commands and Slurm agent or REST API requests currently running",
+    ["operation"],
+)
+
+JWT_CACHE_REQUESTS = Counter(
+    "bricshub_jwt_cache_requests",
+    "Requests to verify a JWT, by whether the verified claims were cached (hit or miss)",
+    ["result"],
+)
+
+JWT_VERIFICATION_DURATION_SECONDS = Histogram(
+    "bricshub_jwt_verification_duration_seconds",
+    "Time taken to verify and decode JWTs not found in the verified JWT cache",
+    buckets=[0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, float("inf")],
+)
+
+JWT_CACHE_ENTRIES = Gauge(
+    "bricshub_jwt_cache_entries",
+    "Number of verified JWTs in the verified JWT cache",
+)
+
+# Metrics for Hub-wide admission control of Slurm operations (see
+# bricshub.admission). The "operation" label is "submit" or "query".
+
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "bricshub_admission_queue_depth",
+    "Slurm operations waiting to be admitted by Hub-wide admission control",
+    ["operation"],
+)
+
+ADMISSION_WAIT_SECONDS = Histogram(
+    "bricshub_admission_wait_seconds",
+    "Time Slurm operations waited to be admitted by Hub-wide admission control",
+    ["operation"],
+    buckets=[0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, float("inf")],
+)
+
+# Metrics for the adaptive interval between bulk job status queries (see
+# bricshub.governor)
+
+POLL_GOVERNOR_QUERY_INTERVAL_SECONDS = Gauge(
+    "bricshub_poll_governor_query_interval_seconds",
+    "Current maximum age of cached job states, i.e. interval between bulk job status queries",
+)
+
+POLL_GOVERNOR_LATENCY_SECONDS = Gauge(
+    "bricshub_poll_governor_latency_seconds",
+    "Moving average of Slurm command latency observed by the poll governor",
+)
+
+POLL_GOVERNOR_ERROR_RATE = Gauge(
+    "bricshub_poll_governor_error_rate",
+    "Moving average of the fraction of Slurm commands failing or timing out observed by the poll governor",
+)
+
+POLL_GOVERNOR_CHANGES = Counter(
+    "bricshub_poll_governor_changes",
+    "Changes to the interval between bulk job status queries, by reason (latency, errors, pending, recovered or idle)",
+    ["reason"],
+)
+
+# Metrics for routing commands across several SSH hosts (see bricshub.hosts)
+
+SSH_HOST_HEALTHY = Gauge(
+    "bricshub_ssh_host_healthy",
+    "Whether commands are routed to the SSH host (1), or it is considered unhealthy (0)",
+    ["host"],
+)
+
+SSH_HOST_LATENCY_SECONDS = Gauge(
+    "bricshub_ssh_host_latency_seconds",
+    "Moving average of the latency of commands and probes run on the SSH host",
+    ["host"],
+)
+
+SSH_HOST_FAILOVERS = Counter(
+    "bricshub_ssh_host_failovers",
+    "Commands retried on another SSH host after an SSH error",
+    ["operation"],
+)
+
+# Metrics for the snapshot of cluster resources (see bricshub.cluster)
+
+CLUSTER_SNAPSHOT_TIMESTAMP_SECONDS = Gauge(
+    "bricshub_cluster_snapshot_timestamp_seconds",
+    "Unix time at which the most recent snapshot of cluster resources was taken",
+)
+
+CLUSTER_SNAPSHOT_REFRESHES = Counter(
+    "bricshub_cluster_snapshot_refreshes",
+    "Queries for snapshots of cluster resources, by result (success or error)",
+    ["result"],
+)
+
+# Metrics for requests to the Slurm REST API (see bricshub.slurmrest)
+
+SLURM_REST_RESPONSES = Counter(
+    "bricshub_slurm_rest_responses",
+    "Responses received from slurmrestd, by request method and HTTP status",
+    ["method", "status"],
+)
+
+SLURM_REST_CONNECTIONS_OPENED = Counter(
+    "bricshub_slurm_rest_connections_opened",
+    "Connections opened to slurmrestd (requests are otherwise sent on existing persistent connections)",
+)
@@ -0,0 +1,195 @@
+"""
+Cache of OIDC discovery metadata and signing keys (JWKS) refreshed in the background
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+import urllib.request
+from pathlib import Path
+
+from jwt import PyJWK, PyJWKClientError
+
+
+class OIDCMetadataCache:
+    """
+    Cache of the discovery document and JWKS of an OIDC server
+
+    The discovery document (``<oidc_server>/.well-known/openid-configuration``)
+    and the JWKS it references are fetched in the background every
+    `refresh_interval` seconds (or `retry_interval` seconds after a failed
+    fetch), and the most recently fetched copies are served in the meantime,
+    even if a refresh is failing (stale-while-revalidate). Fetches run in a
+    worker thread, so a slow OIDC server never blocks the event loop.
+
+    Signing keys are looked up with `get_signing_key()`. If a token is signed
+    with a key ID not in the cached JWKS (e.g. after the OIDC server rotates
+    its keys), the JWKS is fetched immediately, at most once every
+    `unknown_kid_refetch_interval` seconds.
+
+    If `persist_path` is set, the last good copies are written to that file and
+    loaded when the cache is created, so that a restarted Hub can verify tokens
+    before the first fetch completes.
+    """
+
+    def __init__(
+        self,
+        oidc_server: str,
+        refresh_interval: float,
+        retry_interval: float,
+        unknown_kid_refetch_interval: float,
+        fetch_timeout: float,
+        persist_path: Path | None,
+        log: logging.Logger,
+    ):
+        self.oidc_server = oidc_server
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.unknown_kid_refetch_interval = unknown_kid_refetch_interval
+        self.fetch_timeout = fetch_timeout
+        self.persist_path = persist_path
+        self.log = log
+
+        self.discovery: dict | None = None
+        self.jwks: dict | None = None
+        # Unix time at which the cached copies were fetched
+        self.fetched_at = float("-inf")
+
+        self._unknown_kid_refetched_at = float("-inf")
+        self._refresh_task: asyncio.Task | None = None
+        # Held while fetching on demand, so concurrent logins share one fetch
+        self._fetch_lock = asyncio.Lock()
+
+    @property
+    def discovery_url(self) -> str:
+        return self.oidc_server.rstrip("/") + "/.well-known/openid-configuration"
+
+    @property
+    def jwks_uri(self) -> str | None:
+        return self.discovery.get("jwks_uri") if self.discovery else None
+
+    def has_kid(self, kid: str) -> bool:
+        """Return True if the cached JWKS contains a key with ID `kid`"""
+        return any(key.get("kid") == kid for key in (self.jwks or {}).get("keys", []))
+
+    def start(self) -> None:
+        """Start refreshing the cache in the background"""
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.ensure_future(self._refresh_loop())
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            try:
+                await self.fetch()
+                interval = self.refresh_interval
+            except Exception as e:
+                age = time.time() - self.fetched_at
+                self.log.warning(
+                    "Failed to refresh OIDC metadata from %s (serving copy fetched %.0f s ago): %s",
+                    self.oidc_server,
+                    age,
+                    e,
+                )
+                interval = self.retry_interval
+            await asyncio.sleep(interval)
+
+    def refresh(self) -> None:
+        """Fetch the discovery document and JWKS, replacing the cached copies"""
+        fetched_at = time.time()
+        discovery = self._fetch_json(self.discovery_url)
+        jwks = self._fetch_json(discovery["jwks_uri"])
+        self._update(discovery, jwks, fetched_at)
+        self.log.debug("Refreshed OIDC metadata from %s", self.oidc_server)
+
+    async def fetch(self) -> None:
+        """Fetch the discovery document and JWKS in a worker thread, replacing the cached copies"""
+        await asyncio.to_thread(self.refresh)
+
+    async def get_signing_key(self, kid: str | None) -> PyJWK:
+        """
+        Return the key with ID `kid` from the cached JWKS
+
+        Fetches the discovery document and JWKS if nothing is cached yet, and
+        the JWKS if `kid` is not in the cached JWKS (see
+        `refetch_jwks_for_unknown_kid()`). Raises `PyJWKClientError` if there
+        is no such key, or an `OSError` or `ValueError` if the OIDC metadata
+        could not be fetched.
+        """
+        if self.jwks is None:
+            async with self._fetch_lock:
+                if self.jwks is None:
+                    await self.fetch()
+        if not self.has_kid(kid):
+            await self.refetch_jwks_for_unknown_kid(kid)
+        for key in self.jwks["keys"]:
+            if key.get("kid") == kid:
+                return PyJWK(key)
+        raise PyJWKClientError(f"Unable to find a signing key that matches: {kid}")
+
+    async def refetch_jwks_for_unknown_kid(self, kid: str | None) -> None:
+        """
+        Fetch the JWKS because a token was signed with unknown key ID `kid`
+
+        Rate limited by `unknown_kid_refetch_interval`. Concurrent calls wait
+        for the same fetch. Failures are logged.
+        """
+        async with self._fetch_lock:
+            if self.has_kid(kid):
+                return
+            now = time.monotonic()
+            if now - self._unknown_kid_refetched_at < self.unknown_kid_refetch_interval:
+                return
+            self._unknown_kid_refetched_at = now
+            self.log.info("Fetching JWKS from %s for unknown key ID %s", self.jwks_uri, kid)
+            try:
+                jwks = await asyncio.to_thread(self._fetch_json, self.jwks_uri)
+                self._update(self.discovery, jwks, time.time())
+            except Exception as e:
+                self.log.warning("Failed to fetch JWKS from %s: %s", self.jwks_uri, e)
+
+    def _fetch_json(self, url: str) -> dict:
+        with urllib.request.urlopen(url, timeout=self.fetch_timeout) as response:
+            return json.load(response)
+
+    def _update(self, discovery: dict, jwks: dict, fetched_at: float) -> None:
+        if not isinstance(jwks.get("keys"), list):
+            raise ValueError("JWKS does not contain a list of keys")
+        self.discovery, self.jwks, self.fetched_at = discovery, jwks, fetched_at
+        if self.persist_path is not None:
+            try:
+                self._persist()
+            except OSError as e:
+                self.log.warning("Failed to write OIDC metadata to %s: %s", self.persist_path, e)
+
+    def _persist(self) -> None:
+        data = {
+            "oidc_server": self.oidc_server,
+            "fetched_at": self.fetched_at,
+            "discovery": self.discovery,
+            "jwks": self.jwks,
+        }
+        tmp_path = self.persist_path.with_name(f".{self.persist_path.name}.{os.getpid()}")
+        tmp_path.write_text(json.dumps(data))
+        tmp_path.replace(self.persist_path)
+
+    def load_persisted(self) -> None:
+        """Load copies previously written to `persist_path`, if any"""
+        if self.persist_path is None or not self.persist_path.exists():
+            return
+        try:
+            data = json.loads(self.persist_path.read_text())
+        except (OSError, ValueError) as e:
+            self.log.warning("Failed to read OIDC metadata from %s: %s", self.persist_path, e)
+            return
+        if data.get("oidc_server") != self.oidc_server:
+            self.log.info("Ignoring OIDC metadata in %s for a different OIDC server", self.persist_path)
+            return
+        self.discovery, self.jwks, self.fetched_at = data["discovery"], data["jwks"], data["fetched_at"]
+        self.log.info(
+            "Loaded OIDC metadata from %s (fetched %.0f s ago)",
+            self.persist_path,
+            time.time() - self.fetched_at,
+        )
+
@@ -0,0 +1,190 @@
+"""
+Spawn options form for choosing Slurm job resources, rendered from a snapshot of cluster resources
+"""
+
+import functools
+import time
+from html import escape
+
+from bricshub.cluster import ClusterSnapshot, Partition, Reservation, slurm_time_minutes
+
+
+def offered_partitions(snapshot: ClusterSnapshot, partitions: tuple[str, ...]) -> dict[str, Partition]:
+    """Return the partitions in `snapshot` offered in the form (all partitions if `partitions` is empty)"""
+    if not partitions:
+        return snapshot.partitions
+    return {name: snapshot.partitions[name] for name in partitions if name in snapshot.partitions}
+
+
+def offered_runtimes(offered: dict[str, Partition], runtimes: tuple[str, ...]) -> list[str]:
+    """Return the `runtimes` allowed in at least one of the `offered` partitions"""
+    limits = [partition.max_time_minutes for partition in offered.values()]
+    if None in limits:
+        return list(runtimes)
+    return [runtime for runtime in runtimes if slurm_time_minutes(runtime) <= max(limits, default=0)]
+
+
+def _option(value: str, label: str, selected: bool) -> str:
+    return f'<option value="{escape(value)}"{" selected" if selected else ""}>{escape(label)}</option>'
+
+
+def _partition_label(partition: Partition, queue_label: str) -> str:
+    label = f"{partition.name}{' (default)' if partition.default else ''}: "
+    label += f"{partition.idle_nodes} of {partition.nodes} nodes idle"
+    if partition.gpus_per_node:
+        label += f", {partition.idle_gpus} GPUs idle"
+    if queue_label:
+        label += f", {queue_label}"
+    return label + f", max runtime {partition.max_time}"
+
+
+@functools.lru_cache(maxsize=64)
+def render_resource_fields(
+    snapshot: ClusterSnapshot,
+    partitions: tuple[str, ...],
+    runtimes: tuple[str, ...],
+    default_partition: str,
+    default_ngpus: str,
+    default_runtime: str,
+    queue_labels: tuple[tuple[str, str], ...] = (),
+) -> str:
+    """
+    Return the form fields for the partition, number of GPUs and runtime
+
+    `queue_labels` maps partition names to a description of the queue (e.g.
+    the typical wait), shown with the partition. The result depends only on
+    the arguments (not the user), so is cached.
+    """
+    queue_label = dict(queue_labels)
+    offered = offered_partitions(snapshot, partitions)
+    if default_partition not in offered:
+        default_partition = next((name for name, p in offered.items() if p.default), next(iter(offered), ""))
+    fetched_at = time.strftime("%H:%M:%S", time.localtime(snapshot.fetched_at))
+    fields = [
+        f'<p class="form-text">Availability as of {fetched_at}</p>',
+        '<div class="mb-3">',
+        '<label for="brics-partition" class="form-label">Partition</label>',
+        '<select class="form-select" id="brics-partition" name="partition">',
+        *(
+            _option(name, _partition_label(p, queue_label.get(name, "")), name == default_partition)
+            for name, p in offered.items()
+        ),
+        "</select>",
+        "</div>",
+    ]
+
+    max_gpus = max((p.gpus_per_node for p in offered.values()), default=0)
+    if max_gpus:
+        ngpus = default_ngpus if default_ngpus.isdigit() and int(default_ngpus) <= max_gpus else "1"
+        fields += [
+            '<div class="mb-3">',
+            '<label for="brics-ngpus" class="form-label">GPUs</label>',
+            f'<input class="form-control" type="number" id="brics-ngpus" name="ngpus" min="0" max="{max_gpus}" '
+            f'value="{escape(ngpus)}">',
+            '<div class="form-text">Number of GPUs, up to the number per node in the chosen partition</div>',
+            "</div>",
+        ]
+
+    allowed_runtimes = offered_runtimes(offered, runtimes)
+    if allowed_runtimes:
+        if default_runtime not in allowed_runtimes:
+            default_runtime = allowed_runtimes[0]
+        fields += [
+            '<div class="mb-3">',
+            '<label for="brics-runtime" class="form-label">Runtime</label>',
+            '<select class="form-select" id="brics-runtime" name="runtime">',
+            *(_option(runtime, runtime, runtime == default_runtime) for runtime in allowed_runtimes),
+            "</select>",
+            "</div>",
+        ]
+    return "\n".join(fields)
+
+
+def render_reservation_field(reservations: list[Reservation], default_reservation: str) -> str:
+    """Return the form field for the reservation, or an empty string if there are no `reservations`"""
+    if not reservations:
+        return ""
+    options = [_option("", "None", not default_reservation)]
+    for reservation in reservations:
+        label = reservation.name
+        if reservation.partition:
+            label += f" (partition {reservation.partition})"
+        label += f", until {reservation.end_time}"
+        options.append(_option(reservation.name, label, reservation.name == default_reservation))
+    return "\n".join(
+        [
+            '<div class="mb-3">',
+            '<label for="brics-reservation" class="form-label">Reservation</label>',
+            '<select class="form-select" id="brics-reservation" name="reservation">',
+            *options,
+            "</select>",
+            "</div>",
+        ]
+    )
+
+
+def render_accept_wait_field() -> str:
+    """Return the checkbox confirming that the user accepts a long expected wait in the queue"""
+    return "\n".join(
+        [
+            '<div class="mb-3 form-check">',
+            '<input class="form-check-input" type="checkbox" id="brics-accept-wait" name="accept_wait">',
+            '<label for="brics-accept-wait" class="form-check-label">Submit even if the expected wait is long</label>',
+            "</div>",
+        ]
+    )
+
+
+def parse_options_form(
+    formdata: dict[str, list[str]],
+    snapshot: ClusterSnapshot,
+    partitions: tuple[str, ...],
+    runtimes: tuple[str, ...],
+    user: str,
+    account: str,
+) -> dict[str, str]:
+    """
+    Return user options (batch script template variables) from submitted form data
+
+    Raises ValueError (shown to the user with the form) if the choices are
+    not allowed by `snapshot`, e.g. more GPUs than a node of the partition has.
+    """
+
+    def value(name: str) -> str:
+        return formdata.get(name, [""])[0].strip()
+
+    offered = offered_partitions(snapshot, partitions)
+    partition = offered.get(value("partition"))
+    if partition is None:
+        raise ValueError(f"Unknown partition {value('partition')!r}")
+    options = {"partition": partition.name}
+
+    if "ngpus" in formdata:
+        try:
+            ngpus = int(value("ngpus") or "0")
+        except ValueError:
+            raise ValueError(f"Invalid number of GPUs {value('ngpus')!r}") from None
+        if not 0 <= ngpus <= partition.gpus_per_node:
+            raise ValueError(f"Partition {partition.name} has at most {partition.gpus_per_node} GPUs per node")
+        options["ngpus"] = str(ngpus) if ngpus else ""
+
+    if "runtime" in formdata:
+        runtime = value("runtime")
+        if runtime not in runtimes:
+            raise ValueError(f"Invalid runtime {runtime!r}")
+        if partition.max_time_minutes is not None and slurm_time_minutes(runtime) > partition.max_time_minutes:
+            raise ValueError(f"Partition {partition.name} has a maximum runtime of {partition.max_time}")
+        options["runtime"] = runtime
+
+    reservation_name = value("reservation")
+    if reservation_name:
+        reservation = next(
+            (r for r in snapshot.reservations_for(user, account) if r.name == reservation_name),
+            None,
+        )
+        if reservation is None:
+            raise ValueError(f"Unknown reservation {reservation_name!r}")
+        if reservation.partition and reservation.partition != partition.name:
+            raise ValueError(f"Reservation {reservation.name} is for partition {reservation.partition}")
+    options["reservation"] = reservation_name
+    return options
@@ -0,0 +1,191 @@
+"""
+Hub-wide cache of Slurm job states populated by bulk job status queries
+"""
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+
+from bricshub.governor import PollGovernor
+
+# Number of jobs found by individual queries after being missing from the bulk
+# query output, with no tracked job in the output since, before a warning that
+# the bulk query does not show the Hub's jobs is logged
+HIDDEN_JOBS_WARNING_THRESHOLD = 3
+
+
+class SlurmJobStatusPoller:
+    """
+    Cache of Slurm job states shared by all spawners in the Hub
+
+    Spawners request the status of their job from the cache instead of each
+    running a job status query. When a requested state is older than `max_age`
+    seconds, a single bulk query is run to get the states of all jobs, which
+    is shared by all spawners requesting states while it runs. The number of
+    job status queries sent to Slurm is then independent of the number of
+    spawners.
+
+    The bulk query command is expected to output one line per job of the form
+
+        <job_id> <job_status>
+
+    where <job_status> has the same form as the output of a single-job status
+    query (e.g. ``RUNNING nodename``).
+
+    If a `governor` is given, `max_age` is chosen by the governor after each
+    bulk query, based on the load on Slurm and the number of pending jobs
+    (see `bricshub.governor.PollGovernor`).
+    """
+
+    def __init__(
+        self,
+        run_command: Callable[[str], Awaitable[str]],
+        make_command: Callable[[], str],
+        max_age: float,
+        log: logging.Logger,
+        governor: PollGovernor | None = None,
+    ):
+        self.run_command = run_command
+        self.make_command = make_command
+        self.max_age = max_age
+        self.log = log
+        self.governor = governor
+
+        # Job IDs with spawners requesting states, mapped to monotonic time at
+        # which each job ID was first requested
+        self._tracked: dict[str, float] = {}
+
+        # Job states from the most recent successful bulk query and the
+        # monotonic time at which that query started
+        self._states: dict[str, str] = {}
+        self._refreshed_at = float("-inf")
+
+        # Bulk query currently running, shared between callers of refresh()
+        self._refresh_task: asyncio.Task | None = None
+
+        # IDs of jobs found by individual queries after being missing from the
+        # bulk query output, since the output last included a tracked job
+        self._hidden_jobs: set[str] = set()
+
+    def track(self, job_id: str) -> None:
+        """Start tracking the state of `job_id`"""
+        self._tracked.setdefault(job_id, time.monotonic())
+
+    def untrack(self, job_id: str) -> None:
+        """Stop tracking the state of `job_id`"""
+        self._tracked.pop(job_id, None)
+        self._hidden_jobs.discard(job_id)
+
+    @property
+    def tracked_job_ids(self) -> list[str]:
+        """IDs of all tracked jobs"""
+        return list(self._tracked)
+
+    @property
+    def pending_job_count(self) -> int:
+        """
+        Number of tracked jobs which are pending, or were first tracked after
+        the most recent bulk query started (e.g. jobs just submitted)
+        """
+        return sum(
+            self._states.get(job_id, "").startswith("PENDING") or tracked_at >= self._refreshed_at
+            for job_id, tracked_at in self._tracked.items()
+        )
+
+    def is_stale(self, job_id: str) -> bool:
+        """
+        Return True if the cached state for `job_id` needs refreshing
+
+        The state is stale if it is older than `max_age`, or if the job was
+        first tracked after the most recent bulk query started (so may not be
+        included in its output).
+        """
+        tracked_at = self._tracked.get(job_id, float("-inf"))
+        return (
+            time.monotonic() - self._refreshed_at > self.max_age
+            or tracked_at >= self._refreshed_at
+        )
+
+    async def get_status(self, job_id: str) -> str | None:
+        """
+        Return the cached job status for `job_id`, refreshing the cache if stale
+
+        Returns None if `job_id` was not in the output of the most recent bulk
+        query. This is expected when the job has finished, but could also occur
+        if jobs are hidden from the bulk query (e.g. Slurm PrivateData), so
+        callers should confirm the job's state by querying it individually,
+        and call `job_hidden()` if the job exists.
+
+        Raises the exception raised by the bulk query command if the cache
+        could not be refreshed.
+        """
+        self.track(job_id)
+        while self.is_stale(job_id):
+            await self.refresh()
+        return self._states.get(job_id)
+
+    def job_hidden(self, job_id: str) -> None:
+        """
+        Record that `job_id`, missing from the most recent bulk query output,
+        was found to be pending or running by an individual query
+
+        If this keeps happening while no tracked jobs are in the bulk query
+        output, the bulk query cannot see the Hub's jobs (e.g. because of
+        Slurm's PrivateData setting), so every poll falls back to an individual
+        query, and a warning is logged.
+        """
+        if job_id in self._hidden_jobs:
+            return
+        self._hidden_jobs.add(job_id)
+        if len(self._hidden_jobs) == HIDDEN_JOBS_WARNING_THRESHOLD:
+            self.log.warning(
+                "Bulk job status query output is missing %d running or pending jobs (most recently job %s), "
+                "so their states are queried individually. Check that the bulk query command can see all jobs "
+                "submitted by the Hub (e.g. Slurm PrivateData=jobs hides other users' jobs from non-operators)",
+                len(self._hidden_jobs),
+                job_id,
+            )
+
+    async def refresh(self) -> None:
+        """
+        Refresh cached job states using a bulk query
+
+        If a bulk query is already running, wait for that query to complete
+        rather than starting a new one.
+        """
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.ensure_future(self._refresh())
+            self._refresh_task.add_done_callback(self._clear_refresh_task)
+        await asyncio.shield(self._refresh_task)
+
+    def _clear_refresh_task(self, task: asyncio.Task) -> None:
+        self._refresh_task = None
+
+    async def _refresh(self) -> None:
+        started_at = time.monotonic()
+        out = await self.run_command(self.make_command())
+        self._states = self.parse(out)
+        self._refreshed_at = started_at
+        if any(job_id in self._states for job_id in self._tracked):
+            self._hidden_jobs.clear()
+        if self.governor is not None:
+            self.max_age = self.governor.update(self.pending_job_count)
+        self.log.debug(
+            "Bulk job status query returned %d jobs (%d tracked) in %.3f s",
+            len(self._states),
+            len(self._tracked),
+            time.monotonic() - started_at,
+        )
+
+    @staticmethod
+    def parse(out: str) -> dict[str, str]:
+        """
+        Parse bulk query output into a dict mapping job ID to job status
+        """
+        states = {}
+        for line in out.splitlines():
+            job_id, _, job_status = line.strip().partition(" ")
+            if job_id:
+                states[job_id] = job_status.strip()
+        return states
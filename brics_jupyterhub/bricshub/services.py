@@ -0,0 +1,969 @@
+"""
+Hub-wide services shared by all BricsHubSlurmSpawner instances
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import re
+import signal
+import tempfile
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from batchspawner.batchspawner import format_template
+from tornado.ioloop import IOLoop
+from traitlets import Bool, Float, Integer, List, Unicode, default
+from traitlets.config import SingletonConfigurable
+
+from bricshub import metrics, ssh, tracing
+from bricshub.admission import FairAdmissionQueue
+from bricshub.agent import SlurmAgentClient, SlurmAgentUnavailableError
+from bricshub.cluster import ClusterResourceCache
+from bricshub.governor import PollGovernor
+from bricshub.hosts import SSHHostPool
+from bricshub.poller import SlurmJobStatusPoller
+from bricshub.slurmrest import SlurmRestClient, SlurmRestError, SlurmRestTokens
+from bricshub.start_estimates import StartTimeEstimates
+from bricshub.user_env import UserEnvironmentCache
+
+# Exit status of ssh if an error occurred in ssh itself, e.g. failing to connect
+SSH_ERROR_EXIT_STATUS = 255
+
+# Template variable replaced by the SSH host a command is routed to when the
+# command is run (it expands to itself when templates are formatted)
+SSH_HOST_VARIABLE = "{ssh_host}"
+
+# Placeholder in ``{ssh_options}`` replaced by the SSH pool slot assigned to a
+# command when the command is run
+SSH_SLOT_VARIABLE = "{ssh_slot}"
+
+# ssh error messages for failures before the remote command was started, after
+# which a command can be run on another host without running it twice
+SSH_CONNECT_ERROR_RE = re.compile(
+    r"ssh: connect to host|ssh: Could not resolve hostname|kex_exchange_identification"
+    r"|Connection timed out during banner exchange|Connection closed by .* port \d+$"
+    r"|Permission denied \(",
+    re.MULTILINE,
+)
+
+# Slurm operations which are sent to the Slurm agent if `slurm_agent_cmd` is set,
+# or to slurmrestd if `slurm_rest_url` is set
+SLURM_AGENT_OPERATIONS = ("submit", "query", "cancel", "bulk_query")
+
+# Slurm operation ("submit", "query", "cancel", "bulk_query", "cluster_query",
+# "start_estimate" or "user_env") for which the current task is running a
+# command
+_slurm_operation: ContextVar[str | None] = ContextVar("slurm_operation", default=None)
+
+# Trace of the spawn for which the current task is running a command, in which
+# the command is recorded as a span (commands shared between spawns are
+# recorded as separate traces)
+_spawn_trace: ContextVar[tracing.SpawnTrace | None] = ContextVar("spawn_trace", default=None)
+
+
+@contextmanager
+def slurm_operation(name: str, trace: tracing.SpawnTrace | None = None):
+    """
+    Context manager marking commands run within it as part of Slurm operation
+    `name`, for the spawn recorded by `trace` (if any)
+    """
+    tokens = _slurm_operation.set(name), _spawn_trace.set(trace)
+    try:
+        yield
+    finally:
+        _slurm_operation.reset(tokens[0])
+        _spawn_trace.reset(tokens[1])
+
+
+class CommandError(RuntimeError):
+    """Raised when a command exits with non-zero status"""
+
+    def __init__(self, returncode: int, stderr: str):
+        super().__init__(stderr)
+        self.returncode = returncode
+        self.stderr = stderr
+
+
+def slurm_unavailable(e: BaseException) -> bool:
+    """
+    Return True if exception `e` raised running a Slurm command means that
+    Slurm could not be reached, so the command's result is unknown: the
+    command timed out, ssh failed (exit status 255), the Slurm agent or
+    slurmrestd could not be reached, or slurmrestd responded with a server error
+    """
+    if isinstance(e, CommandError):
+        return e.returncode == SSH_ERROR_EXIT_STATUS
+    if isinstance(e, SlurmRestError):
+        return e.unavailable
+    return isinstance(e, (asyncio.TimeoutError, OSError, SlurmAgentUnavailableError))
+
+
+class BricsHubSlurmServices(SingletonConfigurable):
+    """
+    Services shared by all spawners in the Hub, built once from the Hub's configuration
+
+    The single instance (see `instance()`) is created with the Hub's
+    configuration (``c.BricsHubSlurmServices``) when the first spawner is
+    created, and holds everything the spawners share: the SSH connection pool
+    and host routing (see `bricshub.hosts.SSHHostPool`), the job state cache
+    and its governor (see `bricshub.poller.SlurmJobStatusPoller` and
+    `bricshub.governor.PollGovernor`), the admission queues (see
+    `bricshub.admission`), the Slurm agent and REST API clients, the cluster
+    resource snapshot, start time estimates and cached login environments.
+    Commands for background tasks run using the Hub-wide template variables
+    (see `hub_subvars()`), never those of a user.
+
+    Spawners run their Slurm commands using `run_command()`, which sends them
+    to slurmrestd or the Slurm agent if configured, or runs them in a shell,
+    and records metrics and tracing spans for each command.
+    """
+
+    ssh_hosts = List(
+        Unicode(),
+        config=True,
+        help="""
+        Equivalent SSH hosts on which Slurm commands can be run (e.g. login nodes of the cluster)
+
+        The ``{ssh_host}`` template variable in commands (e.g. `exec_prefix`,
+        `bulk_query_cmd`, `slurm_agent_cmd`) is replaced by the host each
+        command is routed to when it is run. Commands are routed to the
+        healthy host with the lowest cost, based on the number of commands
+        running on the host, their recent latency and SSH failure rate. A host
+        is considered unhealthy after 3 consecutive SSH failures, until a
+        command or probe (see `ssh_probe_cmd`) succeeds.
+
+        If a command fails with an SSH error (exit status 255), it is retried
+        on another host if this is safe: job status queries and cancellations
+        (Slurm job IDs are the same on every host) are retried after any SSH
+        error, while job submissions are only retried if ssh failed to
+        connect, so a job is never submitted twice.
+        """,
+    )
+
+    ssh_probe_cmd = Unicode(
+        "",
+        config=True,
+        help="""
+        Command probing an SSH host's health, e.g. ``ssh ... jupyterspawner@{ssh_host} true``
+
+        Run for each of `ssh_hosts` every `ssh_probe_interval` seconds, with
+        ``{ssh_host}`` replaced by the host. The host is healthy if the
+        command succeeds. The Hub-wide template variable ``{ssh_options}`` is
+        also expanded. If empty, hosts are not probed.
+        """,
+    )
+
+    ssh_probe_interval = Float(
+        30.0,
+        config=True,
+        help="Seconds between probes of each SSH host using `ssh_probe_cmd`",
+    )
+
+    ssh_pool_size = Integer(
+        4,
+        config=True,
+        help="""
+        Number of SSH master connections shared between spawners
+
+        Each master connection multiplexes many sessions, but OpenSSH servers
+        limit the number of concurrent sessions per connection (sshd
+        MaxSessions, default 10). Commands are assigned to connections in
+        round-robin order.
+        """,
+    )
+
+    ssh_control_dir = Unicode(
+        config=True,
+        help="Directory in which to create SSH control sockets for master connections",
+    )
+
+    ssh_control_persist = Integer(
+        300,
+        config=True,
+        help="Seconds an idle SSH master connection stays open after its last session closes",
+    )
+
+    ssh_server_alive_interval = Integer(
+        15,
+        config=True,
+        help="Seconds between keepalive messages sent over SSH master connections",
+    )
+
+    ssh_server_alive_count_max = Integer(
+        3,
+        config=True,
+        help="""
+        Number of unanswered keepalive messages after which an SSH connection is closed
+
+        The next command using the closed connection's pool slot opens a new
+        master connection.
+        """,
+    )
+
+    ssh_connect_timeout = Integer(
+        10,
+        config=True,
+        help="Timeout (in seconds) when establishing a new SSH connection",
+    )
+
+    slow_command_threshold = Float(
+        5.0,
+        config=True,
+        help="Log a warning for Slurm commands taking longer than this many seconds",
+    )
+
+    command_timeout = Float(
+        0.0,
+        config=True,
+        help="""
+        Timeout (in seconds) for Slurm commands, after which the command is killed
+
+        If 0, commands are not timed out (SSH connection attempts are still
+        limited by `ssh_connect_timeout`).
+        """,
+    )
+
+    bulk_query_cmd = Unicode(
+        "",
+        config=True,
+        help="""
+        Command to query the status of all jobs submitted by the Hub
+
+        The command should output one line per job of the form
+        ``<job_id> <job_status>``, where ``<job_status>`` has the same form as
+        the output of `batch_query_cmd`. Unlike `batch_query_cmd`, `exec_prefix`
+        is not prepended, since the command is not run on behalf of a specific
+        user. Only the Hub-wide template variables ``{ssh_options}`` and
+        ``{ssh_host}`` are expanded.
+
+        The command must be able to see the jobs of all users: under Slurm's
+        ``PrivateData=jobs``, it must be run as a Slurm operator or
+        administrator. Jobs missing from the output are queried individually,
+        and a warning is logged if running or pending jobs keep being missing.
+
+        If empty, each spawner queries its job using `batch_query_cmd`.
+        """,
+    )
+
+    bulk_query_max_age = Float(
+        30.0,
+        config=True,
+        help="""
+        Maximum age (in seconds) of cached job states from `bulk_query_cmd`
+
+        Job status queries made when the cached states are older than this run
+        `bulk_query_cmd` once to refresh the states of all jobs.
+        """,
+    )
+
+    adaptive_polling = Bool(
+        False,
+        config=True,
+        help="""
+        Adjust the interval between bulk job status queries to the load on the SSH host and Slurm
+
+        If True, the maximum age of cached job states starts at
+        `bulk_query_max_age` and is adjusted after each bulk query between
+        `adaptive_polling_min_age` and `adaptive_polling_max_age`: doubled
+        while the average latency of Slurm commands is above
+        `adaptive_polling_latency_target` or the average fraction of commands
+        failing is above `adaptive_polling_max_error_rate`, and reduced while
+        jobs are pending and Slurm is idle, so that job starts are detected
+        sooner. Changes are logged and exported as Prometheus metrics.
+        """,
+    )
+
+    adaptive_polling_min_age = Float(
+        5.0,
+        config=True,
+        help="Minimum interval (in seconds) between bulk job status queries if `adaptive_polling` is set",
+    )
+
+    adaptive_polling_max_age = Float(
+        300.0,
+        config=True,
+        help="Maximum interval (in seconds) between bulk job status queries if `adaptive_polling` is set",
+    )
+
+    adaptive_polling_latency_target = Float(
+        2.0,
+        config=True,
+        help="""
+        Average Slurm command latency (in seconds) above which bulk job status queries are slowed down
+
+        Queries are only sped up while the average latency is below half this
+        value.
+        """,
+    )
+
+    adaptive_polling_max_error_rate = Float(
+        0.1,
+        config=True,
+        help="""
+        Average fraction of Slurm commands failing or timing out above which bulk job status queries are slowed down
+
+        Queries are only sped up while the average fraction is below half this
+        value.
+        """,
+    )
+
+    individual_query_concurrency = Integer(
+        8,
+        config=True,
+        help="""
+        Maximum number of individual job status queries running at once in the Hub
+
+        Jobs are queried individually (using `batch_query_cmd`) if the bulk
+        job status query is not configured or fails, or to confirm the state of
+        jobs missing from its output. Further queries wait, and are admitted
+        fairly across projects. If 0, the number is not limited.
+        """,
+    )
+
+    submit_concurrency = Integer(
+        4,
+        config=True,
+        help="""
+        Maximum number of job submissions running at once in the Hub
+
+        When many users start servers at once, further submissions wait in a
+        queue rather than all running `batch_submit_cmd` at once (which would
+        overload the SSH host and slurmctld). Waiting submissions are admitted
+        in round-robin order across projects (in arrival order within a
+        project), and the number of submissions ahead in the queue is reported
+        as spawn progress. If 0, the number is not limited.
+        """,
+    )
+
+    submit_payload = Bool(
+        False,
+        config=True,
+        help="""
+        Send the job's environment and batch script to `batch_submit_cmd` as a JSON payload on stdin
+
+        If True, the input of `batch_submit_cmd` is a single JSON object of
+        the form ``{"env": {<name>: <value>, ...}, "script": <script>}``,
+        where "env" contains the variables in ``keepvars``, rather than the
+        batch script alone. `batch_submit_cmd` should set the variables and
+        submit the script (e.g. slurmspawner_submit), so that the variables
+        need not be expanded into `VAR=value` arguments of the command, which
+        is then the same for every spawn. Not used if `slurm_agent_cmd` is set.
+        """,
+    )
+
+    slurm_agent_cmd = Unicode(
+        "",
+        config=True,
+        help="""
+        Command to start a long-running slurmspawner_agent process
+
+        If set, Slurm operations are sent as requests to the agent's stdin
+        instead of running `batch_submit_cmd`, `batch_query_cmd`,
+        `batch_cancel_cmd` and `bulk_query_cmd` (`exec_prefix` is not used).
+        The command is run in a shell once and restarted if it exits. Only the
+        Hub-wide template variables ``{ssh_options}`` and ``{ssh_host}`` are
+        expanded.
+        """,
+    )
+
+    slurm_agent_timeout = Float(
+        60.0,
+        config=True,
+        help="Timeout (in seconds) waiting for a response from the Slurm agent",
+    )
+
+    slurm_rest_url = Unicode(
+        "",
+        config=True,
+        help="""
+        URL of the Slurm REST API (slurmrestd)
+
+        For example ``http://slurmrestd.example:6820`` or
+        ``unix:///run/slurmrestd.sock``. If set, Slurm operations are sent as
+        requests to slurmrestd instead of running `batch_submit_cmd`,
+        `batch_query_cmd`, `batch_cancel_cmd` and `bulk_query_cmd`
+        (`exec_prefix` and `slurm_agent_cmd` are not used for these
+        operations). Job submissions, cancellations and individual job status
+        queries are made as the user, and bulk job status queries as
+        `slurm_rest_service_user`, using JWTs signed with
+        `slurm_rest_jwt_key_file`.
+
+        The job description is taken from the #SBATCH directives of the batch
+        script (see `bricshub.slurmrest.sbatch_job_description`), and the job's
+        environment is the variables in ``keepvars``. slurmrestd does not run
+        a login shell for the user, so ``--get-user-env`` is ignored: set
+        `user_env_cmd` to set the user's login environment in the batch
+        script.
+        """,
+    )
+
+    slurm_rest_api_version = Unicode(
+        "v0.0.40",
+        config=True,
+        help="Version of the Slurm REST API used, the form of job descriptions is that of v0.0.40",
+    )
+
+    slurm_rest_jwt_key_file = Unicode(
+        "",
+        config=True,
+        help="""
+        File containing the cluster's Slurm JWT key (``AuthAltParameters=jwt_key=...`` in slurm.conf)
+
+        Used to sign a JWT for each user on whose behalf requests are sent to
+        slurmrestd.
+        """,
+    )
+
+    slurm_rest_token_lifetime = Float(
+        3600.0,
+        config=True,
+        help="Lifetime (in seconds) of JWTs signed for slurmrestd requests, renewed after half their lifetime",
+    )
+
+    slurm_rest_service_user = Unicode(
+        "",
+        config=True,
+        help="""
+        User as which bulk job status queries are sent to slurmrestd
+
+        The user must be able to see the jobs of all users (e.g. a Slurm
+        operator, if ``PrivateData=jobs`` is set in slurm.conf).
+        """,
+    )
+
+    slurm_rest_max_connections = Integer(
+        8,
+        config=True,
+        help="Maximum number of persistent connections to slurmrestd, limiting the number of concurrent requests",
+    )
+
+    slurm_rest_idle_timeout = Float(
+        30.0,
+        config=True,
+        help="""
+        Seconds after which an idle connection to slurmrestd is closed rather than reused
+
+        Should be shorter than the time after which slurmrestd closes idle
+        connections.
+        """,
+    )
+
+    slurm_rest_timeout = Float(
+        30.0,
+        config=True,
+        help="Timeout (in seconds) waiting for a response from slurmrestd",
+    )
+
+    cluster_query_cmd = Unicode(
+        "",
+        config=True,
+        help="""
+        Command to query the partitions, nodes and reservations of the cluster for the spawn options form
+
+        The command should output ``scontrol --oneliner show`` lines for
+        partitions, nodes and reservations (see
+        `bricshub.cluster.ClusterSnapshot`). As for `bulk_query_cmd`,
+        `exec_prefix` is not prepended and only the Hub-wide template
+        variables are expanded.
+
+        If set, the command is run in the background every
+        `cluster_refresh_interval` seconds, and the spawn options form (for
+        the partition, number of GPUs, runtime and reservation of the job) is
+        rendered from the most recent snapshot, so showing the form never runs
+        a Slurm command. The choices are passed to the batch script as the
+        ``partition``, ``ngpus``, ``runtime`` and ``reservation`` variables.
+        If no snapshot younger than `cluster_max_staleness` is available, no
+        form is shown and jobs are submitted with the default resources.
+        """,
+    )
+
+    cluster_refresh_interval = Float(
+        60.0,
+        config=True,
+        help="Interval (in seconds) between queries of cluster resources using `cluster_query_cmd`",
+    )
+
+    cluster_retry_interval = Float(
+        15.0,
+        config=True,
+        help="Interval (in seconds) before retrying a failed query of cluster resources",
+    )
+
+    cluster_max_staleness = Float(
+        600.0,
+        config=True,
+        help="""
+        Maximum age (in seconds) of the cluster resource snapshot used to render the spawn options form
+
+        If queries of cluster resources fail for longer than this, the form is
+        not shown rather than showing out-of-date availability.
+        """,
+    )
+
+    start_estimate_cmd = Unicode(
+        "",
+        config=True,
+        help="""
+        Command to query the expected start times of all pending jobs
+
+        The command should output one line per pending job of the form
+        ``<job_id> <partitions> <start_time> <reason>`` (see
+        `bricshub.start_estimates.StartTimeEstimates`), with <start_time> a
+        Unix timestamp, e.g. using ``SLURM_TIME_FORMAT=%s squeue --start``.
+        As for `bulk_query_cmd`, `exec_prefix` is not prepended and only the
+        Hub-wide template variables are expanded.
+
+        If set, the spawn progress page shows when a pending job is expected
+        to start, and the spawn options form shows the typical wait in each
+        partition. Estimates are shared by all spawners and refreshed at most
+        once every `start_estimate_max_age` seconds, so the number of queries
+        does not grow with the number of users.
+        """,
+    )
+
+    start_estimate_max_age = Float(
+        60.0,
+        config=True,
+        help="Maximum age (in seconds) of cached start time estimates from `start_estimate_cmd`",
+    )
+
+    user_env_ttl = Float(
+        3600.0,
+        config=True,
+        help="""
+        Time (in seconds) for which a cached login environment is used before checking it is current
+
+        After this time, the spawner's `user_env_cmd` is run again, but only
+        runs a login shell if the user's shell startup files have changed.
+        """,
+    )
+
+    user_env_exclude = List(
+        Unicode(),
+        [
+            "SLURM_*",
+            "JUPYTERHUB_*",
+            "JPY_*",
+            "SSH_*",
+            "SUDO_*",
+            "XDG_*",
+            "BASH_FUNC_*",
+            "DISPLAY",
+            "HOSTNAME",
+            "KRB5CCNAME",
+            "MAIL",
+            "OLDPWD",
+            "PWD",
+            "SHLVL",
+            "TERM",
+            "_",
+            "*TOKEN*",
+            "*SECRET*",
+            "*PASSWORD*",
+            "*PASSWD*",
+            "*CREDENTIAL*",
+            "*_API_KEY",
+            "*_PRIVATE_KEY",
+        ],
+        config=True,
+        help="""
+        Glob patterns of names of variables in the login environment not set by the batch script
+
+        The defaults exclude variables set by Slurm and JupyterHub for the job,
+        variables describing the session in which the environment was captured
+        rather than the user's environment, and variables whose names suggest
+        they hold secrets (e.g. ``*_TOKEN``), which are not copied into batch
+        scripts.
+        """,
+    )
+
+    @default("ssh_control_dir")
+    def _ssh_control_dir_default(self) -> str:
+        return f"{tempfile.gettempdir()}/bricshub-ssh"
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+        # Counter used to assign commands to pool slots in round-robin order
+        self._ssh_slot_counter = itertools.count()
+        # True once the SSH control socket directory has been created by the
+        # first command using a pool slot
+        self._ssh_control_dir_created = False
+
+        self.host_pool: SSHHostPool | None = None
+        if self.ssh_hosts:
+            self.host_pool = SSHHostPool(
+                self.ssh_hosts,
+                log=self.log,
+                probe=self._probe_ssh_host if self.ssh_probe_cmd else None,
+                probe_interval=self.ssh_probe_interval,
+            )
+
+        self.poll_governor: PollGovernor | None = None
+        self.job_status_poller: SlurmJobStatusPoller | None = None
+        if self.bulk_query_enabled:
+            if self.adaptive_polling:
+                self.poll_governor = PollGovernor(
+                    base_age=self.bulk_query_max_age,
+                    min_age=self.adaptive_polling_min_age,
+                    max_age=self.adaptive_polling_max_age,
+                    latency_target=self.adaptive_polling_latency_target,
+                    max_error_rate=self.adaptive_polling_max_error_rate,
+                    log=self.log,
+                )
+            self.job_status_poller = SlurmJobStatusPoller(
+                run_command=self._run_hub_command("bulk_query"),
+                make_command=lambda: format_template(self.bulk_query_cmd, **self.hub_subvars()),
+                max_age=self.bulk_query_max_age,
+                log=self.log,
+                governor=self.poll_governor,
+            )
+
+        # Admission queues limiting the number of job submissions and
+        # individual job status queries running at once
+        self.admission_queues = {
+            "submit": FairAdmissionQueue("submit", self.submit_concurrency),
+            "query": FairAdmissionQueue("query", self.individual_query_concurrency),
+        }
+
+        self.slurm_agent: SlurmAgentClient | None = None
+        if self.slurm_agent_cmd:
+            self.slurm_agent = SlurmAgentClient(
+                make_command=self._make_slurm_agent_command,
+                timeout=self.slurm_agent_timeout,
+                log=self.log,
+            )
+
+        self.slurm_rest: SlurmRestClient | None = None
+        if self.slurm_rest_url:
+            with open(self.slurm_rest_jwt_key_file, "rb") as f:
+                key = f.read()
+            self.slurm_rest = SlurmRestClient(
+                url=self.slurm_rest_url,
+                api_version=self.slurm_rest_api_version,
+                tokens=SlurmRestTokens(key, lifetime=self.slurm_rest_token_lifetime),
+                max_connections=self.slurm_rest_max_connections,
+                idle_timeout=self.slurm_rest_idle_timeout,
+                timeout=self.slurm_rest_timeout,
+                log=self.log,
+            )
+
+        self.cluster_resources: ClusterResourceCache | None = None
+        if self.cluster_query_cmd:
+            self.cluster_resources = ClusterResourceCache(
+                run_command=self._run_hub_command("cluster_query"),
+                make_command=lambda: format_template(self.cluster_query_cmd, **self.hub_subvars()),
+                refresh_interval=self.cluster_refresh_interval,
+                retry_interval=self.cluster_retry_interval,
+                max_staleness=self.cluster_max_staleness,
+                log=self.log,
+            )
+
+        self.start_estimates: StartTimeEstimates | None = None
+        if self.start_estimate_cmd:
+            self.start_estimates = StartTimeEstimates(
+                run_command=self._run_hub_command("start_estimate"),
+                make_command=lambda: format_template(self.start_estimate_cmd, **self.hub_subvars()),
+                max_age=self.start_estimate_max_age,
+                log=self.log,
+            )
+
+        # Login environments are captured by commands run as each user (see
+        # `BricsHubSlurmSpawner.user_env_cmd`), within the "user_env" operation
+        # of the spawn requesting the environment
+        self.user_environments = UserEnvironmentCache(
+            run_command=self.run_command,
+            ttl=self.user_env_ttl,
+            exclude=self.user_env_exclude,
+            log=self.log,
+        )
+
+        if self.host_pool is not None or self.cluster_resources is not None:
+            IOLoop.current().add_callback(self.start)
+
+    def start(self) -> None:
+        """
+        Start the Hub-wide background tasks: probes of SSH hosts, and snapshots
+        of cluster resources, so the first spawn options form requested does
+        not have to wait
+        """
+        if self.host_pool is not None:
+            self.host_pool.start()
+        if self.cluster_resources is not None:
+            self.cluster_resources.start()
+
+    @property
+    def bulk_query_enabled(self) -> bool:
+        """True if job states are obtained using bulk job status queries"""
+        return bool(self.bulk_query_cmd or self.slurm_agent_cmd or self.slurm_rest_url)
+
+    def hub_subvars(self) -> dict:
+        """
+        Return the template variables of commands run on behalf of the Hub
+        rather than a user: SSH connection multiplexing options
+        (``{ssh_options}``) and the ``{ssh_host}`` variable
+
+        These depend only on the configuration, not on the user. The pool slot
+        in ``{ssh_options}`` and ``{ssh_host}`` are placeholders, replaced when
+        the command is run (see `_assign_ssh_slot()` and `ssh_hosts`), so
+        generating the variables has no side effects.
+        """
+        return {
+            "ssh_host": SSH_HOST_VARIABLE,
+            "ssh_options": ssh.multiplex_options(
+                control_dir=self.ssh_control_dir,
+                slot=SSH_SLOT_VARIABLE,
+                control_persist=self.ssh_control_persist,
+                server_alive_interval=self.ssh_server_alive_interval,
+                server_alive_count_max=self.ssh_server_alive_count_max,
+                connect_timeout=self.ssh_connect_timeout,
+            ),
+        }
+
+    async def run_command(
+        self,
+        cmd: str,
+        input: str | None = None,
+        env: dict | None = None,
+        user: str = "",
+        job_id: str = "",
+        job_env: dict | None = None,
+    ) -> str:
+        """
+        Run a command for the current Slurm operation (see `slurm_operation()`),
+        logging the time taken and recording metrics and, if tracing is
+        enabled, a span
+
+        If the operation is handled by the Slurm agent and `slurm_rest_url` or
+        `slurm_agent_cmd` is set, the operation is sent to slurmrestd or the
+        agent respectively as `user` (for job `job_id`, or a job with
+        environment `job_env` for submissions), and `cmd` is not run.
+        Otherwise, `cmd` is run in a shell, with the input of the submit
+        command replaced by a JSON payload if `submit_payload` is set.
+        """
+        op = _slurm_operation.get()
+        use_rest = bool(self.slurm_rest_url) and op in SLURM_AGENT_OPERATIONS
+        use_agent = not use_rest and bool(self.slurm_agent_cmd) and op in SLURM_AGENT_OPERATIONS
+        if use_rest:
+            cmd = f"Slurm REST API {op} request"
+        elif use_agent:
+            cmd = f"Slurm agent {op} request"
+        elif op == "submit" and self.submit_payload:
+            input = json.dumps({"env": job_env or {}, "script": input})
+        cmd = self._assign_ssh_slot(cmd)
+        operation = op or "other"
+        result = "error"
+        metrics.SLURM_COMMANDS_IN_FLIGHT.labels(operation=operation).inc()
+        backend = "rest" if use_rest else "agent" if use_agent else "command"
+        span = tracing.command_span(
+            _spawn_trace.get(),
+            f"slurm {operation}",
+            {"bricshub.slurm.operation": operation, "bricshub.slurm.backend": backend},
+        )
+        start = time.monotonic()
+        with span:
+            try:
+                if use_rest:
+                    out = await self._run_slurm_rest_request(op, input, user, job_id, job_env)
+                elif use_agent:
+                    out = await self._run_slurm_agent_request(op, input, user, job_id, job_env)
+                else:
+                    out = await self._run_routed_command(cmd, op, input=input, env=env)
+                    metrics.SLURM_COMMAND_EXIT_STATUS.labels(operation=operation, exit_status="0").inc()
+                result = "success"
+                return out
+            except asyncio.TimeoutError:
+                result = "timeout"
+                raise
+            except CommandError as e:
+                metrics.SLURM_COMMAND_EXIT_STATUS.labels(operation=operation, exit_status=str(e.returncode)).inc()
+                tracing.set_attribute("bricshub.command.exit_status", e.returncode)
+                if e.returncode == SSH_ERROR_EXIT_STATUS:
+                    metrics.SSH_CONNECT_FAILURES.labels(operation=operation).inc()
+                    if "timed out" in e.stderr.lower():
+                        result = "timeout"
+                raise
+            finally:
+                elapsed = time.monotonic() - start
+                metrics.SLURM_COMMANDS_IN_FLIGHT.labels(operation=operation).dec()
+                metrics.SLURM_COMMAND_DURATION_SECONDS.labels(operation=operation, result=result).observe(elapsed)
+                if self.poll_governor is not None and op is not None:
+                    self.poll_governor.observe(elapsed, succeeded=result == "success")
+                if result == "timeout":
+                    metrics.SLURM_COMMAND_TIMEOUTS.labels(operation=operation).inc()
+                outcome = "completed" if result == "success" else "failed"
+                if elapsed > self.slow_command_threshold:
+                    self.log.warning("Slow command %s in %.3f s: %s", outcome, elapsed, cmd)
+                else:
+                    self.log.debug("Command %s in %.3f s: %s", outcome, elapsed, cmd)
+
+    def _run_hub_command(self, op: str):
+        """Return a function running a command for Hub-wide Slurm operation `op`"""
+
+        async def run(cmd: str) -> str:
+            with slurm_operation(op):
+                return await self.run_command(cmd)
+
+        return run
+
+    def _assign_ssh_slot(self, cmd: str) -> str:
+        """
+        Replace the pool slot placeholder in `cmd` (from ``{ssh_options}``) by
+        the next slot in round-robin order, creating the SSH control socket
+        directory if this is the first command using a slot
+        """
+        if SSH_SLOT_VARIABLE not in cmd:
+            return cmd
+        if not self._ssh_control_dir_created:
+            ssh.make_control_dir(self.ssh_control_dir)
+            self._ssh_control_dir_created = True
+        return cmd.replace(SSH_SLOT_VARIABLE, str(next(self._ssh_slot_counter) % self.ssh_pool_size))
+
+    async def _run_shell_command(self, cmd: str, input: str | None = None, env: dict | None = None) -> str:
+        """
+        Run `cmd` in a shell and return its stripped stdout
+
+        As for `BatchSpawnerBase.run_command()`, but making the exit status
+        available for metrics. Raises CommandError if the command exits with
+        non-zero status, or asyncio.TimeoutError if it does not complete within
+        `command_timeout` seconds (in which case it is killed).
+        """
+        # The command is run in a new process group, so that processes started
+        # by the shell (which would otherwise hold its output pipes open) are
+        # also killed
+        proc = await asyncio.create_subprocess_shell(
+            cmd,
+            env=env,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True,
+        )
+        try:
+            out, err = await asyncio.wait_for(
+                proc.communicate(input=input.encode() if input else None),
+                timeout=self.command_timeout or None,
+            )
+        except BaseException:
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            await proc.wait()
+            self.log.error("Command did not complete, killed process: %s", cmd)
+            raise
+        if proc.returncode != 0:
+            err = err.decode().strip()
+            self.log.error("Subprocess returned exitcode %s", proc.returncode)
+            self.log.error(err)
+            raise CommandError(proc.returncode, err)
+        return out.decode().strip()
+
+    async def _run_routed_command(self, cmd: str, op: str | None, input: str | None, env: dict | None) -> str:
+        """
+        Run `cmd` in a shell, on the SSH host chosen from `ssh_hosts` if `cmd`
+        contains ``{ssh_host}``, failing over to other hosts after SSH errors
+        where safe for Slurm operation `op`
+        """
+        if SSH_HOST_VARIABLE not in cmd or self.host_pool is None:
+            return await self._run_shell_command(cmd, input=input, env=env)
+        pool = self.host_pool
+        tried = []
+        while True:
+            host = pool.choose(exclude=tried)
+            tried.append(host)
+            tracing.set_attribute("bricshub.ssh.host", host)
+            start = time.monotonic()
+            try:
+                with pool.running(host):
+                    out = await self._run_shell_command(cmd.replace(SSH_HOST_VARIABLE, host), input=input, env=env)
+            except asyncio.TimeoutError:
+                pool.record(host, time.monotonic() - start, succeeded=False)
+                raise
+            except CommandError as e:
+                ssh_error = e.returncode == SSH_ERROR_EXIT_STATUS
+                pool.record(host, time.monotonic() - start, succeeded=not ssh_error)
+                if not ssh_error or len(tried) == len(pool.hosts) or not self._failover_safe(op, e.stderr):
+                    raise
+                self.log.warning("SSH error running command on %s, retrying on another host: %s", host, e.stderr)
+                metrics.SSH_HOST_FAILOVERS.labels(operation=op or "other").inc()
+            else:
+                pool.record(host, time.monotonic() - start, succeeded=True)
+                return out
+
+    @staticmethod
+    def _failover_safe(op: str | None, stderr: str) -> bool:
+        """
+        Return True if a command for Slurm operation `op` which failed with an
+        SSH error (with `stderr`) can be retried on another host
+
+        Queries (including cluster resource and login environment queries) and
+        cancellations can be repeated. Other commands (e.g. submissions) are
+        only retried if ssh failed before running the remote command.
+        """
+        return op in ("query", "bulk_query", "cancel", "cluster_query", "start_estimate", "user_env") or bool(
+            SSH_CONNECT_ERROR_RE.search(stderr)
+        )
+
+    async def _probe_ssh_host(self, host: str) -> None:
+        cmd = self._assign_ssh_slot(format_template(self.ssh_probe_cmd, **self.hub_subvars()))
+        await self._run_shell_command(cmd.replace(SSH_HOST_VARIABLE, host))
+
+    def _make_slurm_agent_command(self) -> str:
+        """Return the command starting the Slurm agent, on the healthiest SSH host if routed"""
+        cmd = self._assign_ssh_slot(format_template(self.slurm_agent_cmd, **self.hub_subvars()))
+        if SSH_HOST_VARIABLE in cmd and self.host_pool is not None:
+            cmd = cmd.replace(SSH_HOST_VARIABLE, self.host_pool.choose())
+        return cmd
+
+    async def _run_slurm_agent_request(
+        self, op: str, input: str | None, user: str, job_id: str, job_env: dict | None
+    ) -> str:
+        """
+        Perform Slurm operation `op` using the Slurm agent
+
+        Returns a string of the same form as the output of the command which
+        would otherwise have been run for the operation.
+        """
+        agent = self.slurm_agent
+        if op == "submit":
+            response = await agent.request("submit", user=user, env=job_env or {}, script=input)
+            return response["job_id"]
+        elif op == "query":
+            response = await agent.request("query", job_ids=[job_id])
+            return response["states"].get(job_id, "")
+        elif op == "bulk_query":
+            response = await agent.request("query", job_ids=self.job_status_poller.tracked_job_ids)
+            return "".join(f"{job_id} {job_status}\n" for job_id, job_status in response["states"].items())
+        elif op == "cancel":
+            await agent.request("cancel", user=user, job_id=job_id)
+            return ""
+        raise ValueError(f"Unknown Slurm operation {op}")
+
+    async def _run_slurm_rest_request(
+        self, op: str, input: str | None, user: str, job_id: str, job_env: dict | None
+    ) -> str:
+        """
+        Perform Slurm operation `op` using the Slurm REST API
+
+        Returns a string of the same form as the output of the command which
+        would otherwise have been run for the operation.
+        """
+        client = self.slurm_rest
+        if op == "submit":
+            return await client.submit(user, script=input, env=job_env or {})
+        elif op == "query":
+            states = await client.job_states(user, job_ids=[job_id])
+            return states.get(job_id, "")
+        elif op == "bulk_query":
+            states = await client.job_states(
+                self.slurm_rest_service_user, job_ids=self.job_status_poller.tracked_job_ids
+            )
+            return "".join(f"{job_id} {job_status}\n" for job_id, job_status in states.items())
+        elif op == "cancel":
+            await client.cancel(user, job_id)
+            return ""
+        raise ValueError(f"Unknown Slurm operation {op}")
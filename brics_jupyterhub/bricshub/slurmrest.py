@@ -0,0 +1,401 @@
+"""
+Client for the Slurm REST API (slurmrestd), used in place of Slurm commands run over SSH
+"""
+
+import asyncio
+import json
+import logging
+import re
+import shlex
+import ssl
+import time
+from urllib.parse import urlsplit
+
+import jwt
+
+from bricshub import metrics
+from bricshub.cluster import slurm_time_minutes
+
+# Slurm error number for an invalid (e.g. unknown or purged) job ID
+ESLURM_INVALID_JOB_ID = 2017
+
+# sbatch options which can be given in #SBATCH directives of a script submitted
+# using the REST API, mapped to fields of the job description (v0.0.40), by
+# long and short option name
+_JOB_FIELDS = {
+    "job-name": "name",
+    "output": "standard_output",
+    "error": "standard_error",
+    "chdir": "current_working_directory",
+    "partition": "partition",
+    "reservation": "reservation",
+    "account": "account",
+    "qos": "qos",
+    "constraint": "constraints",
+    "cpus-per-task": "cpus_per_task",
+    "ntasks": "tasks",
+    "time": "time_limit",
+    "mem": "memory_per_node",
+    "mem-per-cpu": "memory_per_cpu",
+    "gres": "tres_per_node",
+    "gpus": "tres_per_job",
+    "nodes": "minimum_nodes",
+}
+_SHORT_OPTIONS = {
+    "J": "job-name",
+    "o": "output",
+    "e": "error",
+    "D": "chdir",
+    "p": "partition",
+    "A": "account",
+    "q": "qos",
+    "C": "constraint",
+    "c": "cpus-per-task",
+    "n": "ntasks",
+    "t": "time",
+    "G": "gpus",
+    "N": "nodes",
+}
+
+# sbatch options not passed to the REST API: the job's environment is given
+# explicitly rather than exported from the submitting process (--export), and
+# slurmrestd does not run a login shell for the user (--get-user-env), so the
+# login environment should be set by the script (see
+# BricsHubSlurmSpawner.user_env_cmd)
+_IGNORED_OPTIONS = {"export", "get-user-env"}
+
+# Status line of an HTTP/1.x response (the reason phrase is optional)
+_STATUS_LINE = re.compile(r"HTTP/(1\.[01]) ([1-5][0-9][0-9])(?: [^\r\n]*)?\r\n")
+
+# Multipliers converting sizes with sbatch --mem unit suffixes to MiB
+_MEMORY_UNITS = {"K": 1 / 1024, "M": 1, "G": 1024, "T": 1024 * 1024}
+
+
+def _no_val(number: int) -> dict:
+    """Return a "no_val" structure (an optional integer) of the REST API"""
+    return {"set": True, "infinite": False, "number": number}
+
+
+def _memory_mib(value: str) -> int:
+    unit = value[-1:].upper()
+    if unit in _MEMORY_UNITS:
+        return int(float(value[:-1]) * _MEMORY_UNITS[unit])
+    return int(value)
+
+
+def _tres(value: str) -> str:
+    """Return a TRES string (e.g. ``gres/gpu:4``) for sbatch --gres or --gpus `value` (e.g. ``gpu:4`` or ``4``)"""
+    items = []
+    for item in value.split(","):
+        if item.isdigit():
+            item = f"gpu:{item}"
+        items.append(item if item.startswith("gres/") else f"gres/{item}")
+    return ",".join(items)
+
+
+def sbatch_job_description(script: str) -> dict:
+    """
+    Return the job description (v0.0.40) set by the #SBATCH directives of batch script `script`
+
+    As for sbatch, directives are read from the comment lines at the start of
+    the script, up to the first command. Raises ValueError for options which
+    cannot be passed to the REST API.
+    """
+    job = {}
+    for line in script.splitlines()[1:]:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            break
+        if not line.startswith("#SBATCH"):
+            continue
+        args = iter(shlex.split(line[len("#SBATCH") :], comments=True))
+        for arg in args:
+            if arg.startswith("--"):
+                name, sep, value = arg[2:].partition("=")
+            elif arg.startswith("-") and len(arg) > 1:
+                name, value = _SHORT_OPTIONS.get(arg[1], arg), arg[2:]
+                sep = "=" if value else ""
+            else:
+                raise ValueError(f"Invalid #SBATCH directive: {line}")
+            if name in _IGNORED_OPTIONS:
+                continue
+            if name not in _JOB_FIELDS:
+                raise ValueError(f"sbatch option {arg} is not supported by the Slurm REST API backend")
+            if not sep:
+                value = next(args, "")
+            field = _JOB_FIELDS[name]
+            if name == "time":
+                minutes = slurm_time_minutes(value)
+                job[field] = _no_val(minutes) if minutes is not None else {"set": True, "infinite": True}
+            elif name in ("mem", "mem-per-cpu"):
+                job[field] = _no_val(_memory_mib(value))
+            elif name in ("cpus-per-task", "ntasks"):
+                job[field] = int(value)
+            elif name in ("gres", "gpus"):
+                job[field] = _tres(value)
+            elif name == "nodes":
+                minimum, _, maximum = value.partition("-")
+                job["minimum_nodes"] = int(minimum)
+                job["maximum_nodes"] = int(maximum or minimum)
+            else:
+                job[field] = value
+    return job
+
+
+class SlurmRestError(RuntimeError):
+    """Raised when slurmrestd responds with an error"""
+
+    def __init__(self, status: int, message: str, error_numbers: tuple[int, ...] = ()):
+        super().__init__(message)
+        self.status = status
+        self.error_numbers = error_numbers
+
+    @property
+    def unavailable(self) -> bool:
+        """
+        True if the error is a server error (HTTP 5xx) or a malformed response,
+        rather than an error in the request (e.g. an unknown job)
+        """
+        return (self.status == 0 or self.status >= 500) and ESLURM_INVALID_JOB_ID not in self.error_numbers
+
+
+class SlurmRestTokens:
+    """
+    Slurm JWTs for users, signed with the cluster's JWT key (AuthAltParameters=jwt_key)
+
+    A token is created for a user when first needed and reused until less
+    than half of its `lifetime` remains. Expired tokens are discarded when a
+    token is created, so tokens are only kept for users with recent requests.
+    """
+
+    def __init__(self, key: bytes, lifetime: float):
+        self.key = key
+        self.lifetime = lifetime
+
+        # Tokens by user, with the Unix time at which each expires
+        self._tokens: dict[str, tuple[str, float]] = {}
+
+    def get(self, user: str) -> str:
+        now = time.time()
+        token, expires_at = self._tokens.get(user, ("", 0.0))
+        if expires_at - now < self.lifetime / 2:
+            self._tokens = {name: entry for name, entry in self._tokens.items() if entry[1] > now}
+            expires_at = now + self.lifetime
+            token = jwt.encode({"iat": int(now), "exp": int(expires_at), "sun": user}, self.key, algorithm="HS256")
+            self._tokens[user] = (token, expires_at)
+        return token
+
+
+class SlurmRestClient:
+    """
+    Client for slurmrestd, shared by all spawners in the Hub
+
+    Requests are sent over a pool of at most `max_connections` persistent
+    HTTP/1.1 connections to `url` (``http://``, ``https://`` or
+    ``unix://<socket path>``), so that a request does not start a process or
+    open a new connection. Each request is authenticated as the user it is made
+    for, using a token from `tokens`. Connections idle for longer than
+    `idle_timeout` seconds are closed rather than reused, before slurmrestd
+    would close them.
+
+    Requests which are safe to repeat (all but job submissions) are retried
+    once on a new connection if a reused connection turns out to have been
+    closed by slurmrestd.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        api_version: str,
+        tokens: SlurmRestTokens,
+        max_connections: int,
+        idle_timeout: float,
+        timeout: float,
+        log: logging.Logger,
+    ):
+        self.url = urlsplit(url)
+        self.api_version = api_version
+        self.tokens = tokens
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.log = log
+
+        self._connection_slots = asyncio.Semaphore(max_connections)
+        # Idle connections, with the monotonic time at which each became idle
+        self._idle: list[tuple[asyncio.StreamReader, asyncio.StreamWriter, float]] = []
+
+    async def submit(self, user: str, script: str, env: dict[str, str]) -> str:
+        """Submit batch script `script` as `user` with environment `env`, returning the job ID"""
+        job = sbatch_job_description(script)
+        job["environment"] = [f"{name}={value}" for name, value in env.items()]
+        response = await self.request("POST", "job/submit", user, {"script": script, "job": job})
+        return str(response["job_id"])
+
+    async def job_states(self, user: str, job_ids: list[str] | None = None) -> dict[str, str]:
+        """
+        Return states of jobs visible to `user` (or only jobs in `job_ids`)
+
+        States have the same form as the output of a single-job status query
+        (e.g. ``RUNNING nodename``). If a single job ID is given, only that job
+        is queried, and an empty dict is returned if Slurm does not know it.
+        """
+        if job_ids is not None and not job_ids:
+            return {}
+        if job_ids is not None and len(job_ids) == 1:
+            try:
+                response = await self.request("GET", f"job/{job_ids[0]}", user)
+            except SlurmRestError as e:
+                if ESLURM_INVALID_JOB_ID in e.error_numbers:
+                    return {}
+                raise
+        else:
+            response = await self.request("GET", "jobs", user)
+        wanted = set(job_ids) if job_ids is not None else None
+        states = {}
+        for job in response.get("jobs", []):
+            job_id = str(job["job_id"])
+            if wanted is not None and job_id not in wanted:
+                continue
+            state = job["job_state"]
+            # job_state is a list of the base state and state flags
+            state = state[0] if isinstance(state, list) else state
+            states[job_id] = f"{state} {job['batch_host']}" if job.get("batch_host") else state
+        return states
+
+    async def cancel(self, user: str, job_id: str) -> None:
+        """Cancel job `job_id` as `user`"""
+        await self.request("DELETE", f"job/{job_id}", user)
+
+    async def request(self, method: str, path: str, user: str, body: dict | None = None) -> dict:
+        """
+        Send a request to ``/slurm/<api_version>/<path>`` as `user` and return the decoded response
+
+        Raises SlurmRestError if slurmrestd responds with an error or a
+        malformed response, OSError if it cannot be reached, or
+        asyncio.TimeoutError if no response is received within `timeout`
+        seconds.
+        """
+        base_path = self.url.path.rstrip("/") if self.url.scheme != "unix" else ""
+        target = f"{base_path}/slurm/{self.api_version}/{path}"
+        data = json.dumps(body).encode() if body is not None else b""
+        headers = {
+            "Host": self.url.netloc if self.url.scheme != "unix" else "localhost",
+            "X-SLURM-USER-NAME": user,
+            "X-SLURM-USER-TOKEN": self.tokens.get(user),
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+            "Content-Length": str(len(data)),
+        }
+        request = "".join(
+            [f"{method} {target} HTTP/1.1\r\n", *(f"{name}: {value}\r\n" for name, value in headers.items()), "\r\n"]
+        ).encode() + data
+        async with self._connection_slots:
+            status, response = await asyncio.wait_for(self._send(request, retry=method != "POST"), self.timeout)
+        metrics.SLURM_REST_RESPONSES.labels(method=method, status=str(status)).inc()
+        try:
+            result = json.loads(response) if response else {}
+        except ValueError as e:
+            raise SlurmRestError(status, f"Invalid response from slurmrestd (HTTP {status}): {e}") from e
+        errors = result.get("errors") or []
+        if status >= 400 or errors:
+            message = "; ".join(error.get("description") or error.get("error", "") for error in errors)
+            raise SlurmRestError(
+                status,
+                f"slurmrestd {method} {path} failed (HTTP {status}): {message or 'no error message'}",
+                tuple(error.get("error_number", 0) for error in errors),
+            )
+        return result
+
+    async def _send(self, request: bytes, retry: bool) -> tuple[int, bytes]:
+        """Send `request` on a pooled connection and return the response status and body"""
+        while True:
+            reader, writer, reused = await self._checkout()
+            try:
+                writer.write(request)
+                await writer.drain()
+                status, keep_alive, body = await self._read_response(reader)
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                writer.close()
+                if reused and retry:
+                    self.log.debug("slurmrestd closed idle connection, retrying request: %s", e)
+                    retry = False
+                    continue
+                raise ConnectionError(f"Connection to slurmrestd failed: {e}") from e
+            except BaseException:
+                # The connection is in an unknown state (e.g. the request timed out)
+                writer.close()
+                raise
+            if keep_alive:
+                self._idle.append((reader, writer, time.monotonic()))
+            else:
+                writer.close()
+            return status, body
+
+    async def _checkout(self) -> tuple[asyncio.StreamReader, asyncio.StreamWriter, bool]:
+        """Return the most recently used idle connection, or a new connection, and whether it was reused"""
+        while self._idle:
+            reader, writer, idle_since = self._idle.pop()
+            if time.monotonic() - idle_since < self.idle_timeout and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        metrics.SLURM_REST_CONNECTIONS_OPENED.inc()
+        if self.url.scheme == "unix":
+            reader, writer = await asyncio.open_unix_connection(self.url.path or self.url.netloc)
+        else:
+            https = self.url.scheme == "https"
+            reader, writer = await asyncio.open_connection(
+                self.url.hostname,
+                self.url.port or (443 if https else 80),
+                ssl=ssl.create_default_context() if https else None,
+            )
+        return reader, writer, False
+
+    @staticmethod
+    async def _read_response(reader: asyncio.StreamReader) -> tuple[int, bool, bytes]:
+        """
+        Read an HTTP/1.x response, returning its status, whether the connection can be reused, and its body
+
+        Interim (1xx) responses are skipped. Raises SlurmRestError if the
+        response is malformed.
+        """
+        try:
+            while True:
+                status_line = (await reader.readuntil(b"\r\n")).decode("latin-1")
+                match = _STATUS_LINE.fullmatch(status_line)
+                if match is None:
+                    raise ValueError(f"invalid status line {status_line!r}")
+                version, status = match.group(1), int(match.group(2))
+                headers = {}
+                while (line := await reader.readuntil(b"\r\n")) != b"\r\n":
+                    name, sep, value = line.decode("latin-1").partition(":")
+                    if not sep:
+                        raise ValueError(f"invalid header line {line!r}")
+                    headers[name.strip().lower()] = value.strip()
+                if status == 101:
+                    raise ValueError("unexpected protocol switch")
+                if status >= 200:
+                    break
+            keep_alive = version == "1.1" and headers.get("connection", "").lower() != "close"
+            if status in (204, 304):
+                body = b""
+            elif headers.get("transfer-encoding", "").lower() == "chunked":
+                chunks = []
+                while size := int((await reader.readuntil(b"\r\n")).split(b";")[0], 16):
+                    chunks.append(await reader.readexactly(size))
+                    if await reader.readexactly(2) != b"\r\n":
+                        raise ValueError("chunk not terminated by CRLF")
+                # Skip trailers
+                while await reader.readuntil(b"\r\n") != b"\r\n":
+                    pass
+                body = b"".join(chunks)
+            elif "content-length" in headers:
+                length = int(headers["content-length"])
+                if length < 0:
+                    raise ValueError(f"invalid Content-Length {length}")
+                body = await reader.readexactly(length)
+            else:
+                body = await reader.read()
+                keep_alive = False
+        except (ValueError, asyncio.LimitOverrunError) as e:
+            raise SlurmRestError(0, f"Malformed response from slurmrestd: {e}") from e
+        return status, keep_alive, body
@@ -0,0 +1,766 @@
+"""
+BricsSlurmSpawner extended for the containerised JupyterHub deployment
+"""
+
+import asyncio
+import random
+import re
+import time
+import uuid
+from importlib.metadata import entry_points
+
+from batchspawner.batchspawner import JobStatus, format_template
+from tornado.ioloop import IOLoop
+from traitlets import Any, Bool, Dict, Float, List, Unicode, default, observe
+
+from bricshub import log, metrics, startup_timing, tracing
+from bricshub.auth_state import expand_auth_state
+from bricshub.options_form import (
+    parse_options_form,
+    render_accept_wait_field,
+    render_reservation_field,
+    render_resource_fields,
+)
+from bricshub.services import BricsHubSlurmServices, _slurm_operation, slurm_operation, slurm_unavailable
+from bricshub.start_estimates import StartEstimate, format_wait
+from bricshub.user_env import export_lines
+
+# BricsSlurmSpawner is registered as the "brics" spawner entry point by the
+# bricsauthenticator package
+BricsSlurmSpawner = entry_points(group="jupyterhub.spawners")["brics"].load()
+
+# Placeholders in the batch script replaced by the user's login environment and
+# the startup timing launcher source when the job is submitted, so that they
+# are not in the template variables and script logged by BatchSpawner
+USER_ENV_EXPORTS_VARIABLE = "{user_env_exports}"
+STARTUP_TIMING_LAUNCHER_VARIABLE = "{startup_timing_launcher}"
+
+# Slurm operations run for a single spawn, whose commands are recorded as spans
+# in the trace of the spawn (commands for other operations, which are shared
+# between spawns, are recorded as separate traces)
+SPAWN_TRACE_OPERATIONS = ("submit", "query", "cancel", "user_env")
+
+# Seconds to wait after the server started for the job to report its startup
+# timing before ending the trace of the spawn without the job's phases
+STARTUP_TIMING_TRACE_WAIT = 60
+
+
+class BricsHubSlurmSpawner(BricsSlurmSpawner):
+    """
+    BricsSlurmSpawner which reduces the cost of Slurm commands run over SSH
+
+    Everything shared between spawners is held by the Hub-wide
+    `bricshub.services.BricsHubSlurmServices` instance, which is configured
+    separately (``c.BricsHubSlurmServices``) and built once from the Hub's
+    configuration: SSH connection multiplexing (the ``{ssh_options}`` template
+    variable) and routing across login hosts (``{ssh_host}``), the job state
+    cache answering job status queries from a single bulk query, admission
+    control of submissions and individual queries, the Slurm agent and REST API
+    backends, the cluster resource snapshot from which the spawn options form
+    is rendered, start time estimates and cached login environments. The
+    spawner runs its Slurm commands through the services.
+
+    For each spawn, the spawner:
+
+    * waits for the Hub-wide submission queue, reporting its position as spawn
+      progress, then while the job is pending reports when Slurm expects it to
+      start (if `BricsHubSlurmServices.start_estimate_cmd` is set)
+    * accepts a notification from the batch script that the job started
+      (`job_started`), so that startup need not wait for the job state cache,
+      and limits individual queries of pending jobs
+      (`individual_query_min_interval`, `restart_query_jitter`)
+    * sets the user's cached login environment in the batch script (if
+      `user_env_cmd` is set)
+    * records the times of startup phases reported by the job
+      (`startup_timing`), combined with its own, as log records, Prometheus
+      metrics and the `startup_phases` state
+    * adds a spawn ID (`spawn_id`) to JSON log records (see `bricshub.log`),
+      and records the spawn as an OpenTelemetry trace if tracing is enabled
+      (see `bricshub.tracing`)
+    """
+
+    individual_query_min_interval = Float(
+        15.0,
+        config=True,
+        help="""
+        Minimum interval (in seconds) between individual status queries of a pending job
+
+        Startup polls (every `startup_poll_interval` seconds) which cannot be
+        answered from the Hub-wide job state cache (e.g. if
+        `BricsHubSlurmServices.bulk_query_cmd` is not set, or the job is
+        missing from its output) only query a
+        pending job individually if this many seconds have passed since its
+        last individual query. In between, the job is reported as pending, or
+        as running if it has notified the Hub that it started (see
+        `job_started`). A short `startup_poll_interval` then detects job starts
+        promptly through the cache and notifications without running a Slurm
+        command per poll for each spawn.
+        """,
+    )
+
+
+    restart_query_jitter = Float(
+        5.0,
+        config=True,
+        help="""
+        Maximum random delay (in seconds) before individually querying a restored job
+
+        When the Hub restarts without stopping servers (`JupyterHub.cleanup_servers`
+        is False), every restored spawner checks its job at once. Restored jobs
+        are resolved using a single bulk job status query if configured, and
+        jobs which must be queried individually are delayed by a random time up
+        to this many seconds, to spread the SSH sessions opened over time.
+        """,
+    )
+
+
+    start_estimate_max_wait = Float(
+        0.0,
+        config=True,
+        help="""
+        Typical wait (in seconds) in a partition above which submitting from the spawn options form is checked
+
+        If positive and the pending jobs in the partition chosen in the spawn
+        options form are expected to start (median) more than this many seconds
+        from now, the form is shown again asking the user to choose another
+        partition, or to confirm that they accept the wait. If 0, no check is
+        made.
+        """,
+    )
+
+    options_form_partitions = List(
+        Unicode(),
+        config=True,
+        help="Partitions offered in the spawn options form, in order (if empty, all partitions which are up)",
+    )
+
+    options_form_runtimes = List(
+        Unicode(),
+        ["1:00:00", "2:00:00", "4:00:00", "8:00:00", "12:00:00"],
+        config=True,
+        help="""
+        Runtimes (Slurm time limits, e.g. ``4:00:00``) offered in the spawn options form
+
+        Runtimes longer than the maximum runtime of every offered partition are
+        not shown, and a runtime longer than the chosen partition's maximum is
+        rejected when the form is submitted.
+        """,
+    )
+
+    user_env_cmd = Unicode(
+        "",
+        config=True,
+        help="""
+        Command to capture the user's login environment, run as the user
+
+        The command should output a JSON object of the form
+        ``{"env": {<name>: <value>, ...}, "fingerprint": <fingerprint>}``,
+        or only ``{"fingerprint": <fingerprint>}`` if the fingerprint of a
+        previously captured environment written to its stdin is still current
+        (see slurmspawner_user_env). As for `batch_submit_cmd`, `exec_prefix`
+        is prepended and template variables from `get_req_subvars()` are
+        expanded.
+
+        If set, the environment is captured before submitting a job, cached
+        for `BricsHubSlurmServices.user_env_ttl` seconds, and provided to the batch script as
+        ``export`` commands in the ``user_env_exports`` template variable, so
+        that the batch script can set it rather than having Slurm run a login
+        shell when the job starts (``--get-user-env``). If the environment
+        cannot be captured, ``user_env_exports`` is empty. The ``export``
+        commands are only added to the script as it is submitted, so they are
+        not logged with the template variables and script.
+        """,
+    )
+
+    startup_timing_launcher = Bool(
+        True,
+        config=True,
+        help="""
+        Whether batch scripts start the single-user server using the startup timing launcher
+
+        If True, the ``startup_timing_launcher`` template variable contains the
+        source of `bricshub.startup_launcher`, which the batch script runs
+        (as ``python - {cmd}``) to start the server and report the times at
+        which startup phases complete (see `startup_timing`). If False, the
+        variable is empty, and the batch script should run ``{cmd}`` directly,
+        in which case startup phases are not recorded (`startup_phases` is
+        empty).
+        """,
+    )
+
+    job_started = Dict(
+        help="""
+        Notification that the spawner's job has started running
+
+        Set by the batch script using a POST request to the batchspawner Hub
+        API handler (authenticated using the spawner's API token) containing a
+        JSON body of the form
+
+            {"job_started": {"job_id": "<job_id>", "host": "<host>"}}
+
+        where <host> is the Slurm node name of the host running the batch
+        script. Notifications for jobs other than the spawner's current job are
+        ignored.
+        """,
+    )
+
+    startup_timing = Dict(
+        help="""
+        Times of startup phases recorded in the job
+
+        Set by the launcher in the batch script (see
+        `bricshub.startup_launcher`) using a POST request to the batchspawner
+        Hub API handler containing a JSON body of the form
+
+            {"startup_timing": {"job_id": "<job_id>", "sent": <time>, "clock": {"<event>": <time>, ...}}}
+
+        where times are read from a clock on the host running the job when the
+        request was sent (<time> for "sent") and when each event occurred.
+        """,
+    )
+
+    startup_phases = Dict(
+        help="Durations (in seconds) of the startup phases of the most recent spawn",
+    )
+
+    spawn_id = Unicode(
+        help="ID of the most recent spawn, used to correlate log records (see `bricshub.log`)",
+    )
+
+    # Times of startup events recorded by the spawner for the current spawn
+    # (monotonic clock)
+    _startup_times = Dict()
+
+    # Trace of the current spawn, if tracing is enabled
+    _spawn_trace = Any(None, allow_none=True)
+
+    # True for a spawner restored from the database with a job, until its first
+    # job status query completes
+    _reconciling = Bool(False)
+
+    # Time of the last individual job status query (monotonic clock)
+    _last_individual_query = Float(0.0)
+
+    # Admission ticket of the job submission in progress, if any
+    _submit_ticket = Any(None, allow_none=True)
+
+    # ``export`` commands setting the user's login environment in the batch
+    # script of the job submission in progress (see `user_env_cmd`)
+    _user_env_exports = Unicode("")
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # Build the Hub-wide services as the Hub creates the spawners of
+        # existing users when it starts, so their background tasks start
+        # before the first spawn
+        BricsHubSlurmServices.instance(config=self.config)
+
+    @property
+    def _services(self) -> BricsHubSlurmServices:
+        """The Hub-wide services, created from the Hub's configuration by the first spawner"""
+        return BricsHubSlurmServices.instance(config=self.config)
+
+    @default("options_form")
+    def _default_options_form(self):
+        return type(self)._render_options_form if self._services.cluster_resources is not None else ""
+
+    @default("options_from_form")
+    def _default_options_from_form(self):
+        if self._services.cluster_resources is not None:
+            return self._parse_options_form
+        return self._passthrough_options_from_form
+
+    @observe("job_started")
+    def _job_started_changed(self, change) -> None:
+        job_started = change["new"]
+        if not job_started:
+            return
+        host = str(job_started.get("host", ""))
+        if job_started.get("job_id") != self.job_id or not re.fullmatch(r"[\w.-]+", host):
+            self.log.warning("Ignoring job start notification not matching job %s: %s", self.job_id, job_started)
+            self.job_started = {}
+            return
+        self.log.info("Job %s started running on %s", self.job_id, host)
+
+    @observe("port")
+    def _port_changed(self, change) -> None:
+        if change["new"]:
+            self._startup_times["port_reported"] = time.monotonic()
+
+    @observe("startup_timing")
+    def _startup_timing_changed(self, change) -> None:
+        timing = change["new"]
+        if not timing:
+            return
+        received_at = time.monotonic()
+        try:
+            if timing["job_id"] != self.job_id:
+                raise ValueError(f"job ID {timing['job_id']} does not match")
+            job_times = {str(event): float(t) for event, t in timing["clock"].items()}
+            # Assumes the request was received as soon as it was sent
+            offset = received_at - float(timing["sent"])
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            self.log.warning("Ignoring invalid startup timing for job %s (%s): %s", self.job_id, e, timing)
+            return
+
+        times = startup_timing.event_times(self._startup_times, job_times, offset)
+        self.startup_phases = startup_timing.startup_phases(times)
+        if self._spawn_trace is not None and not self._spawn_trace.ended:
+            self._spawn_trace.add_phases(times)
+            self._spawn_trace.end(end_time=times.get("listening"))
+        for phase, duration in self.startup_phases.items():
+            metrics.STARTUP_PHASE_DURATION_SECONDS.labels(phase=phase).observe(duration)
+        self.log.info(
+            "Startup phases for job %s: %s",
+            self.job_id,
+            ", ".join(f"{phase} {duration:.2f} s" for phase, duration in self.startup_phases.items()),
+        )
+
+    def get_state(self) -> dict:
+        """Get state to be saved in the database, including startup phase durations"""
+        state = super().get_state()
+        if self.startup_phases:
+            state["startup_phases"] = self.startup_phases
+        if self.spawn_id:
+            state["spawn_id"] = self.spawn_id
+        return state
+
+    async def run_auth_state_hook(self, auth_state):
+        """Run `auth_state_hook` with auth_state expanded if stored compactly (see `bricshub.auth_state`)"""
+        await super().run_auth_state_hook(expand_auth_state(auth_state, self.user.name))
+
+    def _log_context(self):
+        """Return a context manager adding the spawn ID, user and server name to log records"""
+        return log.log_context(spawn_id=self.spawn_id, user=self.user.name, server=self.name)
+
+    def _slurm_operation(self, name: str):
+        """
+        Return a context manager marking commands run within it as part of
+        Slurm operation `name` for this spawner, recorded in the trace of the
+        current spawn if `name` is one of `SPAWN_TRACE_OPERATIONS`
+        """
+        return slurm_operation(name, trace=self._spawn_trace if name in SPAWN_TRACE_OPERATIONS else None)
+
+    async def start(self):
+        """
+        Start the server, assigning a new spawn ID and beginning a trace of the
+        spawn if tracing is enabled
+
+        The trace ends when the job reports its startup timing or, if it does
+        not, `STARTUP_TIMING_TRACE_WAIT` seconds after the server started (at
+        the time the port was reported).
+        """
+        self.spawn_id = uuid.uuid4().hex
+        if self._spawn_trace is not None:
+            self._spawn_trace.end()
+        self._spawn_trace = trace = tracing.SpawnTrace.begin(
+            {"jupyterhub.user": self.user.name, "jupyterhub.server": self.name, "bricshub.spawn_id": self.spawn_id}
+        )
+        with self._log_context():
+            try:
+                result = await super().start()
+            except BaseException as e:
+                if trace is not None:
+                    trace.end(error=e)
+                raise
+        if trace is not None:
+            IOLoop.current().call_later(
+                STARTUP_TIMING_TRACE_WAIT, lambda: trace.end(end_time=self._startup_times.get("port_reported"))
+            )
+        return result
+
+    def get_env(self) -> dict:
+        """Get the environment of the job, including the trace context of the spawn if it is traced"""
+        env = super().get_env()
+        if self._spawn_trace is not None:
+            env[tracing.TRACEPARENT_ENV_VAR] = self._spawn_trace.traceparent
+        return env
+
+    async def progress(self):
+        """
+        Report progress of the spawn, including the position in the Hub-wide
+        job submission queue while waiting to submit the job, and when the job
+        is expected to start while it is pending (if start time estimates are
+        configured)
+        """
+        last_message = None
+        while not self.job_id:
+            ticket = self._submit_ticket
+            if ticket is not None and not ticket.admitted:
+                message = f"Waiting to submit job ({ticket.ahead} job submissions ahead in queue)..."
+            else:
+                message = "Submitting job..."
+            if message != last_message:
+                yield {"message": message}
+                last_message = message
+            await asyncio.sleep(1)
+        async for event in self._pending_progress():
+            yield event
+        async for event in super().progress():
+            yield event
+
+    async def _pending_progress(self):
+        """
+        Yield progress events with the start time Slurm expects for the job
+        while it is pending, from the Hub-wide start time estimates
+        """
+        estimates = self._services.start_estimates
+        if estimates is None:
+            return
+        last_message = None
+        while self.job_id and not self.state_isrunning() and (not self.job_status or self.state_ispending()):
+            try:
+                estimate = await estimates.get(self.job_id)
+            except Exception as e:
+                self.log.debug("Failed to get start time estimate for job %s: %s", self.job_id, e)
+                estimate = None
+            message = self._pending_message(estimate)
+            if message != last_message:
+                yield {"message": message}
+                last_message = message
+            await asyncio.sleep(1)
+
+    def _pending_message(self, estimate: StartEstimate | None) -> str:
+        message = f"Pending in queue (job {self.job_id}"
+        if estimate is not None and estimate.reason and estimate.reason != "None":
+            message += f", reason: {estimate.reason}"
+        if estimate is None or estimate.start_time is None:
+            return message + "), start time not yet estimated by Slurm..."
+        start = time.strftime("%H:%M %Z", time.localtime(estimate.start_time))
+        return message + f"), expected to start in {format_wait(estimate.start_time - time.time())} (at {start})..."
+
+    async def poll(self):
+        """Poll the server"""
+        with self._log_context():
+            return await super().poll()
+
+    async def stop(self, now=False):
+        """Stop the server"""
+        with self._log_context():
+            return await super().stop(now=now)
+
+    def get_req_subvars(self) -> dict:
+        """
+        Add the startup timing launcher source, the user's login environment
+        and the Hub-wide variables (see `BricsHubSlurmServices.hub_subvars()`)
+        to the template variables
+
+        ``{startup_timing_launcher}`` (if `startup_timing_launcher` is set) and
+        ``{user_env_exports}`` (if the environment was captured) are placeholders, replaced in the batch
+        script when it is submitted (see `_fill_batch_script()`), since
+        BatchSpawner logs the template variables and script.
+        """
+        subvars = super().get_req_subvars()
+        subvars["startup_timing_launcher"] = STARTUP_TIMING_LAUNCHER_VARIABLE if self.startup_timing_launcher else ""
+        subvars["user_env_exports"] = USER_ENV_EXPORTS_VARIABLE if self._user_env_exports else ""
+        subvars.update(self._services.hub_subvars())
+        return subvars
+
+    async def run_command(self, cmd, input=None, env=None):
+        """
+        Run a command using the Hub-wide services (see
+        `BricsHubSlurmServices.run_command()`), which may send the Slurm
+        operation to slurmrestd or the Slurm agent as this spawner's user
+        instead of running `cmd`
+        """
+        if _slurm_operation.get() == "submit" and input is not None:
+            input = self._fill_batch_script(input)
+        return await self._services.run_command(
+            cmd,
+            input=input,
+            env=env,
+            user=super().get_req_subvars()["username"],
+            job_id=self.job_id,
+            job_env=self._job_env(env),
+        )
+
+    def _fill_batch_script(self, script: str) -> str:
+        """
+        Replace the placeholders for the user's login environment and the
+        startup timing launcher source in batch script `script`
+        """
+        return script.replace(USER_ENV_EXPORTS_VARIABLE, self._user_env_exports).replace(
+            STARTUP_TIMING_LAUNCHER_VARIABLE, startup_timing.LAUNCHER_SOURCE
+        )
+
+    def _job_env(self, env: dict | None) -> dict:
+        """Return the variables in `env` which are passed through to the job (those in ``keepvars``)"""
+        keepvars = super().get_req_subvars()["keepvars"].split(",")
+        return {name: value for name, value in (env or {}).items() if name in keepvars}
+
+    async def query_job_status(self) -> JobStatus:
+        """
+        Check job status using the Hub-wide job state cache, return JobStatus object
+
+        Falls back to querying the job individually using the parent class
+        method if the cache cannot be refreshed, or if the job is not found in
+        the bulk query output.
+        """
+        try:
+            return await self._query_job_status()
+        finally:
+            self._reconciling = False
+
+    async def _query_job_status(self) -> JobStatus:
+        poller = self._services.job_status_poller
+        if poller is None or not self.job_id:
+            return await self._query_job_status_individually()
+
+        try:
+            job_status = await poller.get_status(self.job_id)
+        except Exception as e:
+            self.log.warning("Bulk job status query failed, querying job %s individually: %s", self.job_id, e)
+            return await self._query_job_status_individually()
+
+        if job_status is None:
+            self.log.debug("Job %s not found in bulk job status query, querying individually", self.job_id)
+            status = await self._query_job_status_individually()
+            if status in (JobStatus.PENDING, JobStatus.RUNNING):
+                poller.job_hidden(self.job_id)
+            return status
+
+        self.job_status = job_status
+        if self.state_ispending() and self.job_started:
+            # The job has notified the Hub that it is running since the cached
+            # states were last refreshed
+            self.job_status = f"RUNNING {self.job_started['host']}"
+        return self._job_status_from_state()
+
+    def _job_status_from_state(self) -> JobStatus:
+        """Return the JobStatus corresponding to `job_status`"""
+        if self.state_isrunning():
+            return JobStatus.RUNNING
+        elif self.state_ispending():
+            return JobStatus.PENDING
+        elif self.state_isunknown():
+            return JobStatus.UNKNOWN
+        else:
+            return JobStatus.NOTFOUND
+
+    async def _query_job_status_individually(self) -> JobStatus:
+        """
+        Query the job's status using `batch_query_cmd`
+
+        As for the parent class method, except that if Slurm cannot be reached
+        (see `bricshub.services.slurm_unavailable()`), e.g. the query times out
+        or the Slurm agent or slurmrestd is down, the job's status is unknown
+        and its last known state is kept, rather than the job being treated as
+        no longer existing (which would clear the spawner's state while the
+        job may still be running).
+
+        The number of individual queries running at once in the Hub is limited
+        by `BricsHubSlurmServices.individual_query_concurrency`. For a spawner
+        restored from the database, the query is first delayed by up to
+        `restart_query_jitter` seconds.
+
+        While the job is pending, the job is only queried if
+        `individual_query_min_interval` seconds have passed since its last
+        individual query.
+        """
+        if not self.job_id:
+            self.job_status = ""
+            return JobStatus.NOTFOUND
+        if (
+            self.state_ispending()
+            and not self._reconciling
+            and time.monotonic() - self._last_individual_query < self.individual_query_min_interval
+        ):
+            if self.job_started:
+                self.job_status = f"RUNNING {self.job_started['host']}"
+                return JobStatus.RUNNING
+            return JobStatus.PENDING
+        self._last_individual_query = time.monotonic()
+        if self._reconciling and self.restart_query_jitter > 0:
+            await asyncio.sleep(random.uniform(0, self.restart_query_jitter))
+        subvars = self.get_req_subvars()
+        subvars["job_id"] = self.job_id
+        cmd = " ".join(
+            (format_template(self.exec_prefix, **subvars), format_template(self.batch_query_cmd, **subvars))
+        )
+        self.log.debug("Spawner querying job: %s", cmd)
+        try:
+            async with self._services.admission_queues["query"].ticket(self._admission_key()):
+                with self._slurm_operation("query"):
+                    self.job_status = await self.run_command(cmd)
+        except Exception as e:
+            if slurm_unavailable(e):
+                self.log.warning(
+                    "Could not query job %s, keeping last known state %r: %s", self.job_id, self.job_status, e
+                )
+                return JobStatus.UNKNOWN
+            if isinstance(e, RuntimeError):
+                # The message is stderr from the command
+                self.job_status = str(e)
+            else:
+                self.log.error("Error querying job %s: %s", self.job_id, e)
+                self.job_status = ""
+        return self._job_status_from_state()
+
+    def _admission_key(self) -> str:
+        """
+        Return the key by which Slurm operations are queued fairly: the project
+        of the Unix username (<USER>.<PROJECT>)
+        """
+        return super().get_req_subvars()["username"].rpartition(".")[2]
+
+    async def _render_options_form(self) -> str:
+        """
+        Return the spawn options form rendered from the snapshot of cluster
+        resources, or an empty string (no form) if there is no recent snapshot
+
+        If the first snapshot has not yet been taken (just after the Hub
+        starts), wait up to 10 s for it. The choices of the user's previous
+        spawn, or else the spawner's ``req_*`` defaults, are selected.
+        """
+        snapshot = await self._services.cluster_resources.wait_for_snapshot(timeout=10)
+        if snapshot is None:
+            self.log.warning("No recent snapshot of cluster resources, not showing spawn options form")
+            return ""
+        previous = self.user_options if isinstance(self.user_options, dict) else {}
+        form = render_resource_fields(
+            snapshot,
+            tuple(self.options_form_partitions),
+            tuple(self.options_form_runtimes),
+            default_partition=str(previous.get("partition", self.req_partition)),
+            default_ngpus=str(previous.get("ngpus", self.req_ngpus)),
+            default_runtime=str(previous.get("runtime", self.req_runtime)),
+            queue_labels=self._queue_labels(snapshot),
+        )
+        # The Slurm account is assumed to be the project
+        reservations = snapshot.reservations_for(super().get_req_subvars()["username"], self._admission_key())
+        reservation_field = render_reservation_field(
+            reservations, str(previous.get("reservation", self.req_reservation))
+        )
+        fields = [form, reservation_field]
+        if self._services.start_estimates is not None and self.start_estimate_max_wait > 0:
+            fields.append(render_accept_wait_field())
+        return "\n".join(field for field in fields if field)
+
+    def _parse_options_form(self, formdata: dict[str, list[str]]) -> dict[str, str]:
+        """
+        Return user options (``partition``, ``ngpus``, ``runtime`` and
+        ``reservation`` batch script variables) from the submitted spawn
+        options form, validated against the snapshot of cluster resources
+        """
+        snapshot = self._services.cluster_resources.latest
+        if snapshot is None:
+            raise ValueError("Cluster resources are not yet known, please try again")
+        options = parse_options_form(
+            formdata,
+            snapshot,
+            tuple(self.options_form_partitions),
+            tuple(self.options_form_runtimes),
+            user=super().get_req_subvars()["username"],
+            account=self._admission_key(),
+        )
+        estimates = self._services.start_estimates
+        if estimates is not None and self.start_estimate_max_wait > 0 and "accept_wait" not in formdata:
+            # Check the expected wait before submitting, so the user can
+            # choose another partition
+            _, wait = estimates.partition_wait(options["partition"])
+            if wait is not None and wait > self.start_estimate_max_wait:
+                raise ValueError(
+                    f"Jobs in partition {options['partition']} are currently expected to start in "
+                    f"{format_wait(wait)}. Choose another partition, or confirm that you accept the wait."
+                )
+        return options
+
+    def _queue_labels(self, snapshot) -> tuple[tuple[str, str], ...]:
+        """
+        Return a description of the queue in each partition of `snapshot` from
+        the cached start time estimates, for the spawn options form
+        """
+        estimates = self._services.start_estimates
+        if estimates is None:
+            return ()
+        labels = []
+        for name in snapshot.partitions:
+            pending, wait = estimates.partition_wait(name)
+            if not pending:
+                labels.append((name, "no jobs pending"))
+            elif wait is None:
+                labels.append((name, f"{pending} jobs pending"))
+            else:
+                labels.append((name, f"{pending} jobs pending, typical wait {format_wait(wait)}"))
+        return tuple(labels)
+
+    def load_state(self, state: dict) -> None:
+        """
+        Load state from the database, tracking any restored job in the job state cache
+
+        When the Hub starts, the jobs of all restored spawners are tracked
+        before any spawner is polled, so the first poll of each spawner is
+        answered by a single bulk query for all restored jobs.
+        """
+        super().load_state(state)
+        self.startup_phases = state.get("startup_phases", {})
+        self.spawn_id = state.get("spawn_id", "")
+        if self.job_id:
+            self._reconciling = True
+            if self._services.job_status_poller is not None:
+                self._services.job_status_poller.track(self.job_id)
+
+    def clear_state(self) -> None:
+        """Clear state, no longer tracking the cleared job in the job state cache"""
+        if self.job_id and self._services.job_status_poller is not None:
+            self._services.job_status_poller.untrack(self.job_id)
+        self.job_started = {}
+        super().clear_state()
+
+    async def submit_batch_script(self):
+        """
+        Submit the batch script once admitted by the Hub-wide job submission
+        queue, discarding any job start notification or startup timing for a
+        previous job
+
+        If `user_env_cmd` is set, the user's login environment is obtained
+        before waiting to be admitted.
+        """
+        self.job_started = {}
+        self.startup_timing = {}
+        self.startup_phases = {}
+        self._startup_times.clear()
+        self._startup_times["submit_start"] = time.monotonic()
+        self._user_env_exports = await self._get_user_env_exports()
+        self._startup_times["admission_start"] = time.monotonic()
+        self._submit_ticket = self._services.admission_queues["submit"].ticket(self._admission_key())
+        try:
+            async with self._submit_ticket:
+                self._startup_times["admitted"] = time.monotonic()
+                with self._slurm_operation("submit"):
+                    job_id = await super().submit_batch_script()
+        finally:
+            self._submit_ticket = None
+        self._startup_times["submitted"] = time.monotonic()
+        if self._spawn_trace is not None:
+            self._spawn_trace.set_attribute("slurm.job_id", str(job_id))
+        return job_id
+
+    async def _get_user_env_exports(self) -> str:
+        """
+        Return ``export`` commands setting the user's login environment in the
+        batch script, or an empty string if `user_env_cmd` is not set or the
+        environment could not be captured
+        """
+        if not self.user_env_cmd:
+            return ""
+        subvars = self.get_req_subvars()
+        try:
+            with self._slurm_operation("user_env"):
+                environment = await self._services.user_environments.get(
+                    subvars["username"],
+                    lambda: " ".join(
+                        (format_template(self.exec_prefix, **subvars), format_template(self.user_env_cmd, **subvars))
+                    ),
+                )
+        except Exception as e:
+            self.log.warning("Failed to capture login environment, job will use --get-user-env: %s", e)
+            return ""
+        # Variables passed through to the job by the spawner take precedence
+        keepvars = set(subvars["keepvars"].split(","))
+        return export_lines({name: value for name, value in environment.env.items() if name not in keepvars})
+
+    async def cancel_batch_job(self):
+        """Cancel the batch job"""
+        with self._slurm_operation("cancel"):
+            return await super().cancel_batch_job()
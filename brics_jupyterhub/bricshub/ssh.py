@@ -0,0 +1,58 @@
+"""
+Helpers for running commands on the Slurm host over multiplexed SSH connections
+"""
+
+import os
+from pathlib import Path
+
+
+def make_control_dir(control_dir: str) -> Path:
+    """
+    Create the directory holding SSH control sockets and return its path
+
+    The directory is only accessible by the user running JupyterHub, since any
+    process able to connect to a control socket can run commands over the
+    corresponding master connection without authenticating.
+    """
+    path = Path(control_dir)
+    path.mkdir(mode=0o700, parents=True, exist_ok=True)
+    os.chmod(path, 0o700)
+    return path
+
+
+def multiplex_options(
+    control_dir: str,
+    slot: int | str,
+    control_persist: int,
+    server_alive_interval: int,
+    server_alive_count_max: int,
+    connect_timeout: int,
+) -> str:
+    """
+    Return OpenSSH client options to share a master connection for pool slot `slot`
+
+    Each slot has its own control socket in `control_dir` (``%C`` is a hash of
+    the local host, remote host, port and user), so a pool of N slots opens at
+    most N master connections per remote host/user. The first command using a
+    slot starts the master connection (``ControlMaster=auto``), which then
+    stays open in the background for `control_persist` seconds after the last
+    multiplexed session closes. Subsequent commands using the slot open a new
+    session over the existing connection, avoiding the TCP, key exchange, and
+    authentication handshakes.
+
+    `slot` may be a placeholder (e.g. ``{ssh_slot}``) replaced by the slot
+    when the command is run.
+
+    Dead master connections are detected by the server alive messages, after
+    which the master exits and the next command using the slot reconnects.
+    """
+    return " ".join(
+        [
+            "-o ControlMaster=auto",
+            f"-o ControlPath={control_dir}/%C-{slot}",
+            f"-o ControlPersist={control_persist}",
+            f"-o ServerAliveInterval={server_alive_interval}",
+            f"-o ServerAliveCountMax={server_alive_count_max}",
+            f"-o ConnectTimeout={connect_timeout}",
+        ]
+    )
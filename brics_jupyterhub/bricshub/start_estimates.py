@@ -0,0 +1,166 @@
+"""
+Hub-wide cache of the start times Slurm expects for pending jobs, from a single batched query
+"""
+
+import asyncio
+import logging
+import statistics
+import time
+from typing import Awaitable, Callable
+
+
+class StartEstimate:
+    """Start time Slurm expects for a pending job"""
+
+    def __init__(self, job_id: str, partitions: list[str], start_time: float | None, reason: str):
+        self.job_id = job_id
+        self.partitions = partitions
+        # Unix time at which the job is expected to start, or None if Slurm
+        # has not estimated it yet
+        self.start_time = start_time
+        self.reason = reason
+
+
+def format_wait(seconds: float) -> str:
+    """Return a rough, human readable duration, e.g. ``about 25 min``"""
+    minutes = round(max(0.0, seconds) / 60)
+    if minutes < 1:
+        return "less than a minute"
+    if minutes < 60:
+        return f"about {minutes} min"
+    hours, minutes = divmod(minutes, 60)
+    return f"about {hours} h {minutes} min" if minutes else f"about {hours} h"
+
+
+class StartTimeEstimates:
+    """
+    Expected start times of pending jobs, shared by all spawners in the Hub
+
+    The command returned by `make_command` lists every pending job with its
+    expected start time, and is run at most once every `max_age` seconds (when
+    an estimate is requested and the cached estimates are older), however many
+    spawners request estimates, so estimates add no per-user Slurm RPCs.
+    The command is expected to output one line per pending job of the form
+
+        <job_id> <partitions> <start_time> <reason>
+
+    (e.g. ``SLURM_TIME_FORMAT=%s squeue --noheader --start --format='%i %P %S %r'``),
+    where <partitions> is a comma-separated list and <start_time> is a Unix
+    timestamp, or ``N/A`` if the scheduler has not estimated it yet. Times in
+    other formats (e.g. squeue's default local time, whose time zone is not
+    known) are treated as not estimated.
+
+    Estimates are used for the pending jobs of spawners (see `get()`) and, for
+    all pending jobs in a partition, as the typical wait for a new job in the
+    partition (see `partition_wait()`).
+    """
+
+    def __init__(
+        self,
+        run_command: Callable[[str], Awaitable[str]],
+        make_command: Callable[[], str],
+        max_age: float,
+        log: logging.Logger,
+    ):
+        self.run_command = run_command
+        self.make_command = make_command
+        self.max_age = max_age
+        self.log = log
+
+        # Estimates from the most recent successful query and the monotonic
+        # time at which that query started
+        self._estimates: dict[str, StartEstimate] = {}
+        self._refreshed_at = float("-inf")
+
+        # Query currently running, shared between callers of refresh()
+        self._refresh_task: asyncio.Task | None = None
+
+    @property
+    def is_stale(self) -> bool:
+        return time.monotonic() - self._refreshed_at > self.max_age
+
+    async def get(self, job_id: str) -> StartEstimate | None:
+        """
+        Return the estimate for pending job `job_id`, refreshing the cache if stale
+
+        Returns None if `job_id` was not in the output of the most recent
+        query (e.g. it has just been submitted, or is no longer pending).
+        Raises the exception raised by the query command if the cache could
+        not be refreshed.
+        """
+        if self.is_stale:
+            await self.refresh()
+        return self._estimates.get(job_id)
+
+    def partition_wait(self, partition: str) -> tuple[int, float | None]:
+        """
+        Return the number of pending jobs in `partition` and the median time
+        (in seconds) until those with estimates are expected to start, or None
+        if no estimates are available, from the cached estimates
+
+        Never runs the query command, but starts a refresh in the background if
+        the cached estimates are stale.
+        """
+        if self.is_stale:
+            self.refresh_in_background()
+        now = time.time()
+        pending = [estimate for estimate in self._estimates.values() if partition in estimate.partitions]
+        waits = [estimate.start_time - now for estimate in pending if estimate.start_time is not None]
+        return len(pending), max(0.0, statistics.median(waits)) if waits else None
+
+    def refresh_in_background(self) -> None:
+        """Start refreshing the cache, if not already refreshing, without waiting for it"""
+        if self._refresh_task is None:
+            asyncio.ensure_future(self.refresh()).add_done_callback(self._log_refresh_error)
+
+    def _log_refresh_error(self, future: asyncio.Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            self.log.warning("Failed to refresh start time estimates: %s", future.exception())
+
+    async def refresh(self) -> None:
+        """
+        Refresh cached estimates using a single query for all pending jobs
+
+        If a query is already running, wait for that query to complete rather
+        than starting a new one.
+        """
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.ensure_future(self._refresh())
+            self._refresh_task.add_done_callback(self._clear_refresh_task)
+        await asyncio.shield(self._refresh_task)
+
+    def _clear_refresh_task(self, task: asyncio.Task) -> None:
+        self._refresh_task = None
+
+    async def _refresh(self) -> None:
+        started_at = time.monotonic()
+        try:
+            out = await self.run_command(self.make_command())
+        except Exception:
+            # Discard estimates rather than showing out-of-date ones, and do not
+            # retry until they would next be refreshed, so that every spawner
+            # requesting an estimate does not retry a failing query
+            self._estimates = {}
+            self._refreshed_at = started_at
+            raise
+        self._estimates = self.parse(out)
+        self._refreshed_at = started_at
+        self.log.debug(
+            "Start time estimate query returned %d pending jobs in %.3f s",
+            len(self._estimates),
+            time.monotonic() - started_at,
+        )
+
+    @staticmethod
+    def parse(out: str) -> dict[str, StartEstimate]:
+        """Parse query output into a dict mapping job ID to estimate"""
+        estimates = {}
+        for line in out.splitlines():
+            fields = line.split(maxsplit=3)
+            if len(fields) < 3:
+                continue
+            job_id, partitions, start = fields[:3]
+            start_time = float(start) if start.isdigit() else None
+            reason = fields[3].strip("() ") if len(fields) > 3 else ""
+            estimates[job_id] = StartEstimate(job_id, partitions.split(","), start_time, reason)
+        return estimates
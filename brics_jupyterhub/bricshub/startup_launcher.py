@@ -0,0 +1,118 @@
+"""
+Launcher for the single-user server recording startup phase times
+
+This file is not imported by the Hub. Its source is included in the batch
+script (template variable ``{{startup_timing_launcher}}``) and run on the
+compute node using the Jupyter user environment's Python as
+
+    python - <cmd> <args>...
+
+where ``<cmd> <args>...`` is the command which would otherwise be run to start
+the single-user server (e.g. ``batchspawner-singleuser jupyterhub-singleuser``).
+The command is run in this interpreter, after recording the times at which:
+
+* the Jupyter server package has been imported (``server_imported``)
+* the server's event loop starts, once it is listening (``listening``)
+
+When the server is listening, these times and those recorded by the batch
+script in BRICS_STARTUP_* environment variables are sent to the Hub using the
+batchspawner Hub API handler as
+
+    {"startup_timing": {"job_id": ..., "sent": ..., "clock": {<event>: <time>}}}
+
+All times are read from CLOCK_BOOTTIME (as in /proc/uptime). Failing to record
+or report times does not prevent the server starting.
+
+If the spawn is traced (see `bricshub.tracing`), the trace context passed in
+JUPYTERHUB_BRICS_TRACEPARENT is exported as TRACEPARENT, so that instrumented
+code in the server can add spans to the spawn's trace.
+"""
+
+import json
+import os
+import runpy
+import shutil
+import sys
+import threading
+import time
+import urllib.request
+
+
+def now() -> float:
+    return time.clock_gettime(time.CLOCK_BOOTTIME)
+
+
+def batch_script_times() -> dict:
+    """Return event times recorded by the batch script"""
+    times = {}
+    for event in ("script_start", "env_activated"):
+        value = os.environ.get(f"BRICS_STARTUP_{event.upper()}")
+        if value:
+            times[event] = float(value)
+
+    # Slurm (>= 23.02) sets SLURM_JOB_START_TIME (Unix time), which is
+    # converted to CLOCK_BOOTTIME using the Unix time at which the batch
+    # script started
+    job_start_time = os.environ.get("SLURM_JOB_START_TIME")
+    script_start_unix_time = os.environ.get("BRICS_STARTUP_SCRIPT_START_UNIX")
+    if "script_start" in times and job_start_time and script_start_unix_time:
+        times["job_start"] = times["script_start"] - (float(script_start_unix_time) - float(job_start_time))
+    return times
+
+
+def report(times: dict) -> None:
+    body = {"startup_timing": {"job_id": os.environ["SLURM_JOB_ID"], "sent": now(), "clock": times}}
+    request = urllib.request.Request(
+        os.environ["JUPYTERHUB_API_URL"] + "/batchspawner",
+        data=json.dumps(body).encode(),
+        headers={"Authorization": "token " + os.environ["JUPYTERHUB_API_TOKEN"], "Content-Type": "application/json"},
+        method="POST",
+    )
+    urllib.request.urlopen(request, timeout=10)
+
+
+def report_in_background(times: dict) -> None:
+    def run():
+        try:
+            report(times)
+        except Exception as e:
+            print(f"Failed to report startup timing to JupyterHub: {e}", file=sys.stderr)
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def install_hooks(times: dict) -> None:
+    """Record the import time of the Jupyter server and report times when it starts listening"""
+    from jupyter_server.serverapp import ServerApp
+
+    times["server_imported"] = now()
+    start_ioloop = ServerApp.start_ioloop
+
+    def start_ioloop_reporting(self, *args, **kwargs):
+        # The server binds its sockets before starting the event loop
+        times["listening"] = now()
+        report_in_background(times)
+        return start_ioloop(self, *args, **kwargs)
+
+    ServerApp.start_ioloop = start_ioloop_reporting
+
+
+def main() -> None:
+    times = {}
+    try:
+        times.update(batch_script_times())
+        install_hooks(times)
+    except Exception as e:
+        print(f"Failed to set up startup timing: {e}", file=sys.stderr)
+    if os.environ.get("JUPYTERHUB_BRICS_TRACEPARENT"):
+        os.environ.setdefault("TRACEPARENT", os.environ["JUPYTERHUB_BRICS_TRACEPARENT"])
+
+    cmd_path = shutil.which(sys.argv[1])
+    if cmd_path is None:
+        sys.exit(f"Command not found: {sys.argv[1]}")
+    sys.argv = [cmd_path, *sys.argv[2:]]
+    runpy.run_path(cmd_path, run_name="__main__")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Durations of single-user server startup phases
+"""
+
+from pathlib import Path
+
+# Source of the launcher run in the batch script to record startup phase times
+LAUNCHER_SOURCE = (Path(__file__).parent / "startup_launcher.py").read_text()
+
+# Startup phases, as (phase, start event, end event). Times of the events
+# "submit_start", "admission_start", "admitted", "submitted" and
+# "port_reported" are recorded by the Hub. Other events are recorded in the job
+# (see startup_launcher.py).
+PHASES = [
+    # Capturing the user's login environment (if not cached), if
+    # BricsHubSlurmSpawner.user_env_cmd is set
+    ("user_env", "submit_start", "admission_start"),
+    # Waiting to be admitted by the Hub-wide job submission queue
+    ("admission", "admission_start", "admitted"),
+    # Running the job submission command
+    ("submit", "admitted", "submitted"),
+    # Waiting for the job to start in the Slurm queue
+    ("queue", "submitted", "job_start"),
+    # Launching the batch script, including Slurm prolog and --get-user-env (if
+    # used)
+    ("job_launch", "job_start", "script_start"),
+    # Activating the Jupyter user environment in the batch script
+    ("env_activation", "script_start", "env_activated"),
+    # Starting Python and importing the Jupyter server
+    ("server_import", "env_activated", "server_imported"),
+    # Reporting the server's port to the Hub (batchspawner-singleuser)
+    ("hub_callback", "server_imported", "port_reported"),
+    # Initialising the server until it is listening
+    ("server_start", "port_reported", "listening"),
+    # All of the above
+    ("total", "submit_start", "listening"),
+]
+
+
+def event_times(hub_times: dict[str, float], job_times: dict[str, float], offset: float) -> dict[str, float]:
+    """
+    Return a dict mapping event name to time on the Hub's monotonic clock
+
+    `hub_times` are event times from the Hub's monotonic clock. `job_times` are
+    event times from the job's clock, converted to the Hub's clock by adding
+    `offset`. If Slurm does not report the job start time, the job is taken to
+    start when the batch script starts.
+    """
+    times = {**hub_times, **{event: t + offset for event, t in job_times.items()}}
+    if "job_start" not in times and "script_start" in times:
+        times["job_start"] = times["script_start"]
+    return times
+
+
+def startup_phases(times: dict[str, float]) -> dict[str, float]:
+    """
+    Return a dict mapping phase name to duration (in seconds), for event `times` from `event_times()`
+
+    If Slurm did not report the job start time, the "queue" phase ends when
+    the batch script starts and the "job_launch" phase is omitted. Phases with
+    missing events are omitted.
+    """
+    omitted = {"job_launch"} if times.get("job_start") == times.get("script_start") else set()
+
+    phases = {}
+    for phase, start, end in PHASES:
+        if phase not in omitted and start in times and end in times:
+            # Error in the clock offset can make short phases appear negative
+            phases[phase] = max(0.0, times[end] - times[start])
+    return phases
@@ -0,0 +1,176 @@
+"""
+OpenTelemetry traces of spawns, exported to an OTLP endpoint or a local file
+
+Tracing is optional: the OpenTelemetry SDK (opentelemetry-sdk, and
+opentelemetry-exporter-otlp-proto-http for OTLP) is only imported by
+`configure_tracing()`, and spawns are not traced unless it has been called
+(e.g. in the JupyterHub configuration file).
+
+Each spawn is a trace with a root "spawn" span, which has child spans for
+
+* the Slurm commands (or Slurm agent or REST API requests) run for the spawn
+  (e.g. job submission over SSH, including sudo, the wrapper script and
+  sbatch), created while the command runs
+* the startup phases of `bricshub.startup_timing.PHASES` (e.g. waiting in the
+  Slurm queue, activating the environment in the batch script, reporting the
+  port to the Hub), created from the phase times reported by the job
+
+The trace context is passed to the job in the JUPYTERHUB_BRICS_TRACEPARENT
+environment variable (a W3C ``traceparent`` value), which the startup launcher
+exports as TRACEPARENT, so that instrumented code in the job can add spans to
+the spawn's trace. Spans are exported by a background thread, so do not
+block the event loop.
+"""
+
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+from bricshub import startup_timing
+
+# Environment variable passing the trace context of the spawn to the job
+TRACEPARENT_ENV_VAR = "JUPYTERHUB_BRICS_TRACEPARENT"
+
+# Tracer used to create spans, set by configure_tracing()
+_tracer = None
+
+
+def configure_tracing(otlp_endpoint: str = "", file: str = "", service_name: str = "jupyterhub") -> None:
+    """
+    Start tracing spawns, exporting spans to OTLP (HTTP) endpoint `otlp_endpoint` and/or appending them to `file`
+
+    Spans are written to `file` as JSON lines. Raises ImportError if the
+    OpenTelemetry SDK (or OTLP exporter, if `otlp_endpoint` is set) is not
+    installed.
+    """
+    global _tracer
+    from opentelemetry import trace
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    if otlp_endpoint:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=otlp_endpoint)))
+    if file:
+        provider.add_span_processor(
+            BatchSpanProcessor(
+                ConsoleSpanExporter(
+                    out=open(file, "a", buffering=1),
+                    formatter=lambda span: span.to_json(indent=None) + "\n",
+                )
+            )
+        )
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer("bricshub")
+
+
+def enabled() -> bool:
+    """Return True if spawns are traced"""
+    return _tracer is not None
+
+
+def _wall_time_ns(monotonic_time: float) -> int:
+    """Convert a time from the monotonic clock to nanoseconds since the Unix epoch"""
+    return int((time.time() - time.monotonic() + monotonic_time) * 1e9)
+
+
+class SpawnTrace:
+    """
+    Trace of a single spawn, with a root span covering the whole spawn
+
+    Created using `SpawnTrace.begin()`, which returns None if tracing is not
+    enabled.
+    """
+
+    def __init__(self, root):
+        from opentelemetry import trace
+
+        self.root = root
+        self.context = trace.set_span_in_context(root)
+        self.ended = False
+
+    @classmethod
+    def begin(cls, attributes: dict[str, Any]) -> "SpawnTrace | None":
+        if _tracer is None:
+            return None
+        return cls(_tracer.start_span("spawn", attributes=attributes))
+
+    @property
+    def traceparent(self) -> str:
+        """W3C traceparent value identifying the root span"""
+        from opentelemetry.trace.propagation.tracecontext import TraceContextTextMapPropagator
+
+        carrier = {}
+        TraceContextTextMapPropagator().inject(carrier, context=self.context)
+        return carrier.get("traceparent", "")
+
+    @contextmanager
+    def span(self, name: str, attributes: dict[str, Any]) -> Iterator[None]:
+        """Context manager recording a child span of the spawn while it runs"""
+        with _tracer.start_as_current_span(name, context=self.context, attributes=attributes):
+            yield
+
+    def set_attribute(self, name: str, value: Any) -> None:
+        """Set an attribute of the root span"""
+        if not self.ended:
+            self.root.set_attribute(name, value)
+
+    def add_phases(self, times: dict[str, float]) -> None:
+        """
+        Add child spans for the startup phases with start and end events in
+        `times` (monotonic clock, see `bricshub.startup_timing.event_times()`)
+        """
+        for phase, start, end in startup_timing.PHASES:
+            if phase == "total" or start not in times or end not in times:
+                continue
+            span = _tracer.start_span(
+                f"phase {phase}",
+                context=self.context,
+                start_time=_wall_time_ns(times[start]),
+                attributes={"bricshub.phase": phase},
+            )
+            span.end(end_time=_wall_time_ns(max(times[start], times[end])))
+
+    def end(self, end_time: float | None = None, error: BaseException | None = None) -> None:
+        """End the root span at `end_time` (monotonic clock, default now), recording `error` if given"""
+        if self.ended:
+            return
+        self.ended = True
+        if error is not None:
+            from opentelemetry.trace import Status, StatusCode
+
+            self.root.record_exception(error)
+            self.root.set_status(Status(StatusCode.ERROR, str(error)))
+        self.root.end(end_time=_wall_time_ns(end_time) if end_time is not None else None)
+
+
+@contextmanager
+def command_span(parent: SpawnTrace | None, name: str, attributes: dict[str, Any]) -> Iterator[None]:
+    """
+    Context manager recording a span for a command run while it runs
+
+    The span is a child of the root span of `parent`, or the root of a new
+    trace if `parent` is None (e.g. for commands shared by all spawns). Does
+    nothing if tracing is not enabled.
+    """
+    if _tracer is None:
+        yield
+    elif parent is not None and not parent.ended:
+        with parent.span(name, attributes):
+            yield
+    else:
+        from opentelemetry.context import Context
+
+        with _tracer.start_as_current_span(name, context=Context(), attributes=attributes):
+            yield
+
+
+def set_attribute(name: str, value: Any) -> None:
+    """Set an attribute of the current span, if tracing is enabled"""
+    if _tracer is not None:
+        from opentelemetry import trace
+
+        trace.get_current_span().set_attribute(name, value)
@@ -0,0 +1,116 @@
+"""
+Hub-wide cache of users' login environments, passed to jobs in place of sbatch --get-user-env
+"""
+
+import asyncio
+import fnmatch
+import json
+import logging
+import re
+import shlex
+import time
+from typing import Awaitable, Callable
+
+# Names of variables which can be exported by the batch script
+_VALID_NAME_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+class UserEnvironment:
+    """Login environment of a user captured by `UserEnvironmentCache`"""
+
+    def __init__(self, env: dict[str, str], fingerprint: str):
+        self.env = env
+        # Identifies the state of the user's shell startup files when the
+        # environment was captured (see slurmspawner_user_env)
+        self.fingerprint = fingerprint
+        # Monotonic time at which the environment was last confirmed current
+        self.checked_at = time.monotonic()
+
+
+def export_lines(env: dict[str, str]) -> str:
+    """Return shell ``export`` commands setting the variables in `env`"""
+    return "\n".join(f"export {name}={shlex.quote(value)}" for name, value in sorted(env.items()))
+
+
+class UserEnvironmentCache:
+    """
+    Login environments of users, shared by all spawners in the Hub
+
+    A user's environment is captured by running the command returned by
+    `make_command` (e.g. slurmspawner_user_env, run as the user), which outputs
+    a JSON object of the form ``{"env": {...}, "fingerprint": <fingerprint>}``.
+    The environment is then reused for `ttl` seconds without running a
+    command. After that, the command is run with the fingerprint of the cached
+    environment on stdin, and outputs only ``{"fingerprint": <fingerprint>}``
+    (without running a login shell) if the user's shell startup files are
+    unchanged, in which case the cached environment is reused for another `ttl`
+    seconds.
+
+    Variables with names matching any of the `exclude` glob patterns (e.g.
+    variables describing the login session rather than the user's
+    environment), or which are not valid shell variable names, are discarded.
+    Concurrent requests for the same user share a single command.
+    """
+
+    def __init__(
+        self,
+        run_command: Callable[[str, str], Awaitable[str]],
+        ttl: float,
+        exclude: list[str],
+        log: logging.Logger,
+    ):
+        self.run_command = run_command
+        self.ttl = ttl
+        self.exclude = exclude
+        self.log = log
+
+        self._environments: dict[str, UserEnvironment] = {}
+        # Captures currently running, by user, shared between callers of get()
+        self._capture_tasks: dict[str, asyncio.Task] = {}
+
+    async def get(self, username: str, make_command: Callable[[], str]) -> UserEnvironment:
+        """
+        Return the login environment of `username`, capturing it if not cached
+        or checking it is current if older than `ttl`
+
+        Raises the exception raised by the command, or ValueError if its output
+        is invalid.
+        """
+        cached = self._environments.get(username)
+        if cached is not None and time.monotonic() - cached.checked_at <= self.ttl:
+            return cached
+        task = self._capture_tasks.get(username)
+        if task is None:
+            task = asyncio.ensure_future(self._capture(username, make_command(), cached))
+            self._capture_tasks[username] = task
+            task.add_done_callback(lambda _: self._capture_tasks.pop(username, None))
+        return await asyncio.shield(task)
+
+    async def _capture(self, username: str, cmd: str, cached: UserEnvironment | None) -> UserEnvironment:
+        started_at = time.monotonic()
+        out = await self.run_command(cmd, cached.fingerprint if cached is not None else "")
+        try:
+            result = json.loads(out)
+            fingerprint = result["fingerprint"]
+            if cached is not None and "env" not in result and fingerprint == cached.fingerprint:
+                cached.checked_at = started_at
+                self.log.debug("Login environment of %s is unchanged", username)
+                return cached
+            env = {
+                name: value
+                for name, value in result["env"].items()
+                if _VALID_NAME_RE.fullmatch(name)
+                and not any(fnmatch.fnmatchcase(name, pattern) for pattern in self.exclude)
+            }
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            raise ValueError(f"Invalid login environment output for {username}: {e}") from e
+        environment = UserEnvironment(env, fingerprint)
+        environment.checked_at = started_at
+        self._environments[username] = environment
+        self.log.debug(
+            "Captured login environment of %s (%d variables) in %.3f s",
+            username,
+            len(env),
+            time.monotonic() - started_at,
+        )
+        return environment
@@ -0,0 +1,78 @@
+"""
+Make the bricshub package importable in tests, and provide a local OIDC server
+
+In the JupyterHub container, bricshub is on the module search path (see
+Containerfile), so it is not installed as a package.
+"""
+
+import argparse
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+BENCH_DIR = Path(__file__).resolve().parents[2] / "bench"
+
+
+class FakeOIDCServer:
+    """bench/fake_oidc.py serving on `url`, with its signing keys and counts of metadata requests"""
+
+    def __init__(self, fake_oidc, server: ThreadingHTTPServer):
+        host, port = server.server_address[:2]
+        self.url = f"http://{host}:{port}"
+        self.args = argparse.Namespace(
+            host=host, port=port, audience="jupyterhub", delay=0.0, fail=False, verbose=False
+        )
+        self.keys = fake_oidc.SigningKeys()
+        self.stats = {"discovery": 0, "jwks": 0}
+        server.RequestHandlerClass = fake_oidc.make_handler(self.args, self.keys, self.stats)
+
+    def token(self, key=None, kid: str | None = None, **claims) -> str:
+        """
+        Return a token for user alice signed with the current signing key (or
+        `key`, named `kid`), with `claims` replacing the usual claims (omitted
+        if None)
+        """
+        import jwt
+
+        current_kid, current_key = self.keys.current
+        now = int(time.time())
+        claims = {
+            "iss": self.url,
+            "aud": self.args.audience,
+            "sub": "alice",
+            "short_name": "alice",
+            "iat": now,
+            "exp": now + 3600,
+            **claims,
+        }
+        return jwt.encode(
+            {name: value for name, value in claims.items() if value is not None},
+            key or current_key,
+            algorithm="RS256",
+            headers={"kid": kid or current_kid},
+        )
+
+
+@pytest.fixture
+def oidc_server(monkeypatch):
+    """Local OIDC server (bench/fake_oidc.py) issuing tokens signed with RSA keys"""
+    pytest.importorskip("jwt")
+    pytest.importorskip("cryptography")
+    if not (BENCH_DIR / "fake_oidc.py").exists():
+        pytest.skip("bench/fake_oidc.py is not available")
+    monkeypatch.syspath_prepend(str(BENCH_DIR))
+    import fake_oidc
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BaseHTTPRequestHandler)
+    fake = FakeOIDCServer(fake_oidc, server)
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True)
+    thread.start()
+    yield fake
+    server.shutdown()
+    server.server_close()
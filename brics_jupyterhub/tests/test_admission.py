@@ -0,0 +1,84 @@
+import asyncio
+
+from bricshub.admission import FairAdmissionQueue
+
+
+async def run_operations(queue: FairAdmissionQueue, keys: list[str]) -> list[str]:
+    """Run an operation for each of `keys` at once, returning the keys in the order admitted"""
+    admitted = []
+    release = asyncio.Event()
+
+    async def operation(index: int, key: str):
+        async with queue.ticket(key):
+            admitted.append(f"{key}{index}")
+            await release.wait()
+            await asyncio.sleep(0)
+
+    tasks = [asyncio.ensure_future(operation(index, key)) for index, key in enumerate(keys)]
+    await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(*tasks)
+    return admitted
+
+
+def test_round_robin_between_groups():
+    async def main():
+        queue = FairAdmissionQueue("submit", limit=1)
+        return await run_operations(queue, ["a", "a", "a", "a", "b", "c"])
+
+    assert asyncio.run(main()) == ["a0", "a1", "b4", "c5", "a2", "a3"]
+
+
+def test_unlimited():
+    async def main():
+        queue = FairAdmissionQueue("submit", limit=0)
+        tickets = [queue.ticket("a") for _ in range(3)]
+        for ticket in tickets:
+            await ticket.__aenter__()
+        return queue.depth, all(ticket.admitted for ticket in tickets)
+
+    assert asyncio.run(main()) == (0, True)
+
+
+def test_depth_and_ahead():
+    async def main():
+        queue = FairAdmissionQueue("submit", limit=1)
+        running = queue.ticket("a")
+        await running.__aenter__()
+        tickets = {name: queue.ticket(name[0]) for name in ["a1", "a2", "b1", "c1", "b2"]}
+        tasks = [asyncio.ensure_future(ticket.__aenter__()) for ticket in tickets.values()]
+        await asyncio.sleep(0)
+        ahead = {name: ticket.ahead for name, ticket in tickets.items()}
+        depth = queue.depth
+        await running.__aexit__(None, None, None)
+        await asyncio.sleep(0)
+        admitted = [name for name, ticket in tickets.items() if ticket.admitted]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return depth, ahead, admitted, queue.depth
+
+    depth, ahead, admitted, final_depth = asyncio.run(main())
+    assert depth == 5
+    assert ahead == {"a1": 0, "a2": 3, "b1": 1, "c1": 2, "b2": 4}
+    assert admitted == ["a1"]
+    assert final_depth == 0
+
+
+def test_cancelled_waiting_ticket_is_removed():
+    async def main():
+        queue = FairAdmissionQueue("submit", limit=1)
+        running = queue.ticket("a")
+        await running.__aenter__()
+        cancelled = queue.ticket("b")
+        task = asyncio.ensure_future(cancelled.__aenter__())
+        await asyncio.sleep(0)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        depth = queue.depth
+        await running.__aexit__(None, None, None)
+        waiting = queue.ticket("c")
+        await asyncio.wait_for(waiting.__aenter__(), 1)
+        return depth, cancelled.admitted, waiting.admitted
+
+    assert asyncio.run(main()) == (0, False, True)
@@ -0,0 +1,34 @@
+from bricshub.auth_state import COMPACT_KEY, compact_auth_state, compact_auth_state_hook, expand_auth_state
+
+AUTH_STATE = {
+    "proj1.portal": {"name": "Project 1", "username": "alice.proj1", "extra": "discarded"},
+    "proj2.portal": {"name": "Project 2", "username": "alice2.proj2"},
+}
+
+
+def test_compact():
+    assert compact_auth_state(AUTH_STATE, "alice") == {
+        COMPACT_KEY: [["proj1.portal", "Project 1", ""], ["proj2.portal", "Project 2", "alice2.proj2"]]
+    }
+
+
+def test_expand():
+    expanded = expand_auth_state(compact_auth_state(AUTH_STATE, "alice"), "alice")
+    assert expanded == {
+        "proj1.portal": {"name": "Project 1", "username": "alice.proj1"},
+        "proj2.portal": {"name": "Project 2", "username": "alice2.proj2"},
+    }
+
+
+def test_unchanged_if_not_brics_auth_state():
+    for auth_state in [None, {}, {"proj1.portal": "Project 1"}, {"proj1.portal": {"name": "Project 1"}}]:
+        assert compact_auth_state(auth_state, "alice") is auth_state
+        assert expand_auth_state(auth_state, "alice") is auth_state
+    compact = compact_auth_state(AUTH_STATE, "alice")
+    assert compact_auth_state(compact, "alice") is compact
+
+
+def test_hook():
+    authentication = {"name": "alice", "auth_state": AUTH_STATE}
+    assert compact_auth_state_hook(None, None, authentication)["auth_state"] == compact_auth_state(AUTH_STATE, "alice")
+    assert compact_auth_state_hook(None, None, {"name": "alice"}) == {"name": "alice"}
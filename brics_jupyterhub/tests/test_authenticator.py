@@ -0,0 +1,72 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from traitlets.config import Config
+
+# The authenticator extends BricsAuthenticator from bricsauthenticator
+pytest.importorskip("bricsauthenticator")
+
+from bricshub.authenticator import BricsHubAuthenticator  # noqa: E402
+
+
+def make_authenticator(oidc_server) -> BricsHubAuthenticator:
+    """
+    Return an authenticator verifying tokens from `oidc_server`, mapping the
+    short_name and projects claims to the user's name and auth_state
+    """
+    config = Config()
+    config.BricsAuthenticator.oidc_server = oidc_server.url
+    config.BricsAuthenticator.jwt_audience = "jupyterhub"
+    # Fetch OIDC metadata for each token rather than in the background
+    config.BricsHubAuthenticator.oidc_cache_refresh_interval = 0
+    authenticator = BricsHubAuthenticator(config=config)
+
+    async def authenticate(handler, data):
+        return {"name": data["short_name"], "auth_state": {"projects": data.get("projects", {})}}
+
+    authenticator.authenticate = authenticate
+    return authenticator
+
+
+def refresh_user(authenticator: BricsHubAuthenticator, token: str | None):
+    async def get_auth_state():
+        return {"projects": {"proj": {}}}
+
+    user = SimpleNamespace(name="alice", get_auth_state=get_auth_state)
+    headers = {"X-Auth-Id-Token": token} if token else {}
+    handler = SimpleNamespace(request=SimpleNamespace(headers=headers))
+    return asyncio.run(authenticator.refresh_user(user, handler))
+
+
+def test_refresh_user(oidc_server):
+    authenticator = make_authenticator(oidc_server)
+    assert refresh_user(authenticator, oidc_server.token(projects={"proj": {}})) is True
+    # Requests without a token are not checked
+    assert refresh_user(authenticator, None) is True
+
+
+def test_refresh_user_updates_auth_state(oidc_server):
+    authenticator = make_authenticator(oidc_server)
+    model = refresh_user(authenticator, oidc_server.token(projects={"proj": {}, "proj2": {}}))
+    assert model == {"name": "alice", "auth_state": {"projects": {"proj": {}, "proj2": {}}}}
+
+
+@pytest.mark.parametrize(
+    "claims",
+    [
+        {"short_name": "bob"},
+        {"exp": int(time.time()) - 10},
+        {"aud": "other"},
+    ],
+)
+def test_refresh_user_requires_login_for_invalid_token(oidc_server, claims):
+    authenticator = make_authenticator(oidc_server)
+    assert refresh_user(authenticator, oidc_server.token(projects={"proj": {}}, **claims)) is False
+
+
+def test_refresh_user_allowed_while_oidc_server_unavailable(oidc_server):
+    oidc_server.args.fail = True
+    authenticator = make_authenticator(oidc_server)
+    assert refresh_user(authenticator, oidc_server.token(projects={"proj": {}})) is True
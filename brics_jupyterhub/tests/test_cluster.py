@@ -0,0 +1,114 @@
+import asyncio
+import logging
+
+import pytest
+
+from bricshub.cluster import ClusterResourceCache, ClusterSnapshot, Reservation, slurm_time_minutes
+
+LOG = logging.getLogger(__name__)
+
+SCONTROL_OUTPUT = "\n".join(
+    [
+        "PartitionName=workq AllowGroups=ALL Default=YES MaxTime=1-00:00:00 State=UP TotalNodes=3",
+        "PartitionName=debug Default=NO MaxTime=UNLIMITED State=UP",
+        "PartitionName=old MaxTime=01:00:00 State=DOWN",
+        "NodeName=nid001 Arch=aarch64 CfgTRES=cpu=288,mem=800G,gres/gpu=4 AllocTRES= OS=Linux 5.14.21 #1 SMP "
+        "Partitions=workq,debug State=IDLE",
+        "NodeName=nid002 CfgTRES=cpu=288,gres/gpu=4 AllocTRES=cpu=72,gres/gpu=1 Partitions=workq State=MIXED",
+        "NodeName=nid003 CfgTRES=cpu=288,gres/gpu=4 AllocTRES= Partitions=workq State=IDLE+DRAIN",
+        "NodeName=nid004 CfgTRES=cpu=288,gres/gpu=4 AllocTRES=cpu=288,gres/gpu=4 Partitions=workq,old State=ALLOCATED",
+        "ReservationName=training StartTime=2026-10-17T09:00:00 EndTime=2026-10-17T17:00:00 Nodes=nid001 "
+        "PartitionName=workq Users=(null) Groups=(null) Accounts=proj1,proj2 State=ACTIVE",
+        "ReservationName=maint EndTime=2026-10-20T09:00:00 PartitionName=(null) Users=root Accounts=(null) "
+        "State=INACTIVE",
+    ]
+)
+
+
+@pytest.mark.parametrize(
+    "value, minutes",
+    [
+        ("30", 30),
+        ("30:01", 31),
+        ("2:00:00", 120),
+        ("1-12", 36 * 60),
+        ("1-00:30", 24 * 60 + 30),
+        ("1-00:00:00", 24 * 60),
+        ("UNLIMITED", None),
+        ("infinite", None),
+    ],
+)
+def test_slurm_time_minutes(value, minutes):
+    assert slurm_time_minutes(value) == minutes
+
+
+@pytest.mark.parametrize("value", ["", "1:2:3:4", "-5", "1h"])
+def test_slurm_time_minutes_invalid(value):
+    with pytest.raises(ValueError):
+        slurm_time_minutes(value)
+
+
+def test_parse_partitions():
+    snapshot = ClusterSnapshot.parse(SCONTROL_OUTPUT, fetched_at=1000.0)
+    assert list(snapshot.partitions) == ["workq", "debug"]
+    workq = snapshot.partitions["workq"]
+    assert workq.default
+    assert workq.max_time_minutes == 24 * 60
+    assert (workq.nodes, workq.idle_nodes, workq.idle_gpus, workq.gpus_per_node) == (4, 1, 7, 4)
+    debug = snapshot.partitions["debug"]
+    assert not debug.default
+    assert debug.max_time_minutes is None
+    assert (debug.nodes, debug.idle_nodes, debug.idle_gpus) == (1, 1, 4)
+    assert snapshot.fetched_at == 1000.0
+
+
+def test_parse_reservations():
+    snapshot = ClusterSnapshot.parse(SCONTROL_OUTPUT, fetched_at=1000.0)
+    [reservation] = snapshot.reservations
+    assert reservation.name == "training"
+    assert reservation.partition == "workq"
+    assert reservation.end_time == "2026-10-17T17:00:00"
+    assert reservation.users == []
+    assert reservation.accounts == ["proj1", "proj2"]
+    assert snapshot.reservations_for("alice", "proj1") == [reservation]
+    assert snapshot.reservations_for("alice", "proj3") == []
+
+
+@pytest.mark.parametrize(
+    "users, accounts, allowed",
+    [
+        ([], [], True),
+        (["alice"], [], True),
+        (["bob"], [], False),
+        (["bob"], ["proj1"], False),
+        ([], ["proj1"], True),
+        (["-alice"], [], False),
+        (["-bob"], [], True),
+        ([], ["-proj1"], False),
+    ],
+)
+def test_reservation_allows(users, accounts, allowed):
+    reservation = Reservation("res", partition="", end_time="", users=users, accounts=accounts)
+    assert reservation.allows("alice", "proj1") is allowed
+
+
+def test_resource_cache_staleness(monkeypatch):
+    outputs = [SCONTROL_OUTPUT]
+
+    async def run_command(cmd: str) -> str:
+        return outputs.pop()
+
+    async def main():
+        cache = ClusterResourceCache(
+            run_command, lambda: "scontrol", refresh_interval=60, retry_interval=5, max_staleness=300, log=LOG
+        )
+        cache.start()
+        snapshot = await cache.wait_for_snapshot(timeout=1)
+        cache._refresh_task.cancel()
+        return cache, snapshot
+
+    cache, snapshot = asyncio.run(main())
+    assert list(snapshot.partitions) == ["workq", "debug"]
+    monkeypatch.setattr("time.time", lambda: snapshot.fetched_at + 301)
+    assert cache.snapshot is None
+    assert cache.latest is snapshot
@@ -0,0 +1,61 @@
+import logging
+
+import pytest
+
+from bricshub.governor import PollGovernor
+
+LOG = logging.getLogger(__name__)
+
+
+def make_governor() -> PollGovernor:
+    return PollGovernor(base_age=10, min_age=2, max_age=60, latency_target=1.0, max_error_rate=0.2, log=LOG)
+
+
+def test_limits_include_base_age():
+    governor = PollGovernor(base_age=10, min_age=20, max_age=5, latency_target=1.0, max_error_rate=0.2, log=LOG)
+    assert (governor.min_age, governor.max_age) == (10, 10)
+
+
+def test_moving_averages():
+    governor = make_governor()
+    governor.observe(1.0, succeeded=True)
+    assert governor.latency == 1.0
+    assert governor.error_rate == 0.0
+    governor.observe(2.0, succeeded=False)
+    assert governor.latency == pytest.approx(1.2)
+    assert governor.error_rate == pytest.approx(0.2)
+
+
+def test_backs_off_when_latency_high():
+    governor = make_governor()
+    governor.observe(3.0, succeeded=True)
+    assert [governor.update(pending_jobs=0) for _ in range(4)] == [20, 40, 60, 60]
+
+
+def test_backs_off_when_error_rate_high():
+    governor = make_governor()
+    for _ in range(3):
+        governor.observe(0.1, succeeded=False)
+    assert governor.update(pending_jobs=1) == 20
+
+
+def test_unchanged_between_targets():
+    governor = make_governor()
+    governor.observe(0.8, succeeded=True)
+    assert governor.update(pending_jobs=3) == 10
+
+
+def test_polls_faster_while_jobs_pending():
+    governor = make_governor()
+    governor.observe(0.1, succeeded=True)
+    assert [governor.update(pending_jobs=1) for _ in range(4)] == [5, 2.5, 2, 2]
+    assert governor.update(pending_jobs=0) == 10
+
+
+def test_recovers_to_base_age():
+    governor = make_governor()
+    governor.observe(3.0, succeeded=True)
+    governor.update(pending_jobs=0)
+    governor.update(pending_jobs=0)
+    governor.latency = 0.1
+    assert [governor.update(pending_jobs=0) for _ in range(3)] == [20, 10, 10]
@@ -0,0 +1,71 @@
+import asyncio
+import logging
+
+import pytest
+
+from bricshub.hosts import SSHHostPool
+
+LOG = logging.getLogger(__name__)
+
+
+def test_choose_least_loaded():
+    pool = SSHHostPool(["login1", "login2"], LOG)
+    pool.record("login1", 0.1, succeeded=True)
+    pool.record("login2", 0.1, succeeded=True)
+    with pool.running("login1"):
+        assert pool.choose() == "login2"
+    assert pool.hosts["login1"].in_flight == 0
+
+
+def test_choose_lowest_latency():
+    pool = SSHHostPool(["login1", "login2"], LOG)
+    pool.record("login1", 2.0, succeeded=True)
+    pool.record("login2", 0.1, succeeded=True)
+    assert pool.choose() == "login2"
+
+
+def test_choose_exclude():
+    pool = SSHHostPool(["login1", "login2"], LOG)
+    assert pool.choose(exclude=["login1"]) == "login2"
+    with pytest.raises(ValueError):
+        pool.choose(exclude=["login1", "login2"])
+
+
+def test_unhealthy_after_consecutive_failures():
+    pool = SSHHostPool(["login1", "login2"], LOG, failure_threshold=2)
+    pool.record("login1", 10.0, succeeded=False)
+    assert pool.hosts["login1"].healthy
+    pool.record("login1", 10.0, succeeded=False)
+    assert not pool.hosts["login1"].healthy
+    pool.record("login2", 10.0, succeeded=True)
+    assert pool.choose() == "login2"
+    pool.record("login1", 0.1, succeeded=True)
+    assert pool.hosts["login1"].healthy
+    assert pool.hosts["login1"].consecutive_failures == 0
+
+
+def test_choose_least_recently_failed_unhealthy_host():
+    pool = SSHHostPool(["login1", "login2"], LOG, failure_threshold=1)
+    pool.record("login2", 1.0, succeeded=False)
+    pool.record("login1", 1.0, succeeded=False)
+    assert pool.choose() == "login2"
+
+
+def test_probe_recovers_unhealthy_host():
+    probed = []
+
+    async def probe(name: str):
+        probed.append(name)
+        if name == "login2":
+            raise OSError("Connection timed out")
+
+    async def main():
+        pool = SSHHostPool(["login1", "login2"], LOG, probe=probe, probe_interval=0.01, failure_threshold=1)
+        pool.start()
+        pool.record("login1", 1.0, succeeded=False)
+        await asyncio.sleep(0.05)
+        pool._probe_task.cancel()
+        return pool.hosts["login1"].healthy, pool.hosts["login2"].healthy
+
+    assert asyncio.run(main()) == (True, False)
+    assert {"login1", "login2"} <= set(probed)
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import time
+
+import pytest
+
+jwt = pytest.importorskip("jwt")
+
+from bricshub.jwt_verifier import JWTVerifier, VerifiedJWTCache  # noqa: E402
+from bricshub.oidc import OIDCMetadataCache  # noqa: E402
+
+LOG = logging.getLogger(__name__)
+
+
+def make_verifier(oidc_server, leeway: float = 0, cache_size: int = 16) -> JWTVerifier:
+    oidc_cache = OIDCMetadataCache(
+        oidc_server=oidc_server.url,
+        refresh_interval=300,
+        retry_interval=30,
+        unknown_kid_refetch_interval=30,
+        fetch_timeout=5,
+        persist_path=None,
+        log=LOG,
+    )
+    return JWTVerifier(
+        oidc_cache=oidc_cache,
+        audience="jupyterhub",
+        leeway=leeway,
+        required_claims=["exp", "iat", "iss", "aud"],
+        cache=VerifiedJWTCache(max_size=cache_size, max_ttl=300) if cache_size else None,
+    )
+
+
+def count_decodes(monkeypatch) -> list:
+    """Record calls of jwt.decode(), i.e. tokens not served from the cache"""
+    decodes = []
+    decode = jwt.decode
+
+    def counting_decode(*args, **kwargs):
+        decodes.append(args[0])
+        return decode(*args, **kwargs)
+
+    monkeypatch.setattr(jwt, "decode", counting_decode)
+    return decodes
+
+
+@pytest.mark.parametrize("cache_size", [16, 0])
+def test_valid_token(oidc_server, cache_size):
+    verifier = make_verifier(oidc_server, cache_size=cache_size)
+    claims = asyncio.run(verifier.verify(oidc_server.token(projects={"proj": {}})))
+    assert (claims["short_name"], claims["projects"]) == ("alice", {"proj": {}})
+
+
+def test_verified_claims_cached(oidc_server, monkeypatch):
+    decodes = count_decodes(monkeypatch)
+    verifier = make_verifier(oidc_server)
+    token = oidc_server.token()
+
+    async def main():
+        claims = await verifier.verify(token)
+        # Modifying returned claims does not modify the cached claims
+        claims["short_name"] = "mallory"
+        return await verifier.verify(token)
+
+    assert asyncio.run(main())["short_name"] == "alice"
+    assert decodes == [token]
+    assert oidc_server.stats == {"discovery": 1, "jwks": 1}
+
+
+def test_bad_signature(oidc_server):
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    other_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    verifier = make_verifier(oidc_server)
+    with pytest.raises(jwt.InvalidSignatureError):
+        asyncio.run(verifier.verify(oidc_server.token(key=other_key)))
+
+
+@pytest.mark.parametrize(
+    "claims,error",
+    [
+        ({"aud": "other"}, jwt.InvalidAudienceError),
+        ({"iss": "https://other.example.com"}, jwt.InvalidIssuerError),
+        ({"exp": int(time.time()) - 10}, jwt.ExpiredSignatureError),
+        ({"exp": None}, jwt.MissingRequiredClaimError),
+        ({"aud": None}, jwt.MissingRequiredClaimError),
+    ],
+)
+def test_invalid_claims(oidc_server, claims, error):
+    verifier = make_verifier(oidc_server)
+    with pytest.raises(error):
+        asyncio.run(verifier.verify(oidc_server.token(**claims)))
+    assert len(verifier.cache) == 0
+
+
+def test_unknown_kid(oidc_server):
+    verifier = make_verifier(oidc_server)
+
+    async def main():
+        await verifier.verify(oidc_server.token())
+        with pytest.raises(jwt.PyJWKClientError):
+            await verifier.verify(oidc_server.token(kid="unknown"))
+
+    asyncio.run(main())
+    # The JWKS was fetched again for the unknown key ID
+    assert oidc_server.stats == {"discovery": 1, "jwks": 2}
+
+
+def test_cached_token_not_served_after_expiry(oidc_server, monkeypatch):
+    decodes = count_decodes(monkeypatch)
+    verifier = make_verifier(oidc_server)
+    exp = int(time.time()) + 1
+    token = oidc_server.token(exp=exp)
+
+    async def main():
+        await verifier.verify(token)
+        await verifier.verify(token)
+        await asyncio.sleep(exp - time.time() + 0.05)
+        with pytest.raises(jwt.ExpiredSignatureError):
+            await verifier.verify(token)
+
+    asyncio.run(main())
+    assert decodes == [token, token]
+    assert len(verifier.cache) == 0
+
+
+def test_oidc_server_unavailable(oidc_server):
+    oidc_server.args.fail = True
+    verifier = make_verifier(oidc_server)
+    with pytest.raises(OSError):
+        asyncio.run(verifier.verify(oidc_server.token()))
+
+
+def test_verified_jwt_cache_evicts_least_recently_used(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(time, "time", lambda: now)
+    cache = VerifiedJWTCache(max_size=2, max_ttl=60)
+    cache.put(("a",), {"exp": now + 3600}, leeway=0)
+    cache.put(("b",), {"exp": now + 10}, leeway=5)
+    assert cache.get(("a",)) is not None
+    cache.put(("c",), {}, leeway=0)
+    assert (cache.get(("a",)), cache.get(("b",)), cache.get(("c",))) == ({"exp": now + 3600}, None, {})
+    # Entries expire at the token's expiry (plus leeway) or after max_ttl
+    now += 59
+    assert cache.get(("c",)) == {}
+    now += 1
+    assert (cache.get(("a",)), cache.get(("c",)), len(cache)) == (None, None, 0)
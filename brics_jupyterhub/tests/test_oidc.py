@@ -0,0 +1,103 @@
+import asyncio
+import json
+import logging
+import time
+
+import pytest
+
+jwt = pytest.importorskip("jwt")
+
+from bricshub.oidc import OIDCMetadataCache  # noqa: E402
+
+LOG = logging.getLogger(__name__)
+
+
+def make_cache(oidc_server, persist_path=None, **intervals) -> OIDCMetadataCache:
+    settings = {"refresh_interval": 300.0, "retry_interval": 30.0, "unknown_kid_refetch_interval": 30.0, **intervals}
+    return OIDCMetadataCache(
+        oidc_server=oidc_server.url, fetch_timeout=5, persist_path=persist_path, log=LOG, **settings
+    )
+
+
+def test_signing_key(oidc_server):
+    cache = make_cache(oidc_server)
+    kid = oidc_server.keys.current[0]
+
+    async def main():
+        return await cache.get_signing_key(kid), await cache.get_signing_key(kid)
+
+    keys = asyncio.run(main())
+    assert [key.key_id for key in keys] == [kid, kid]
+    assert cache.discovery["issuer"] == oidc_server.url
+    assert oidc_server.stats == {"discovery": 1, "jwks": 1}
+
+
+def test_unknown_kid_refetch_rate_limited(oidc_server, monkeypatch):
+    cache = make_cache(oidc_server)
+    offset = 0.0
+    monotonic = time.monotonic
+    monkeypatch.setattr(time, "monotonic", lambda: monotonic() + offset)
+
+    async def main():
+        nonlocal offset
+        await cache.get_signing_key(oidc_server.keys.current[0])
+        # After the key is rotated, the new key ID is unknown, so the JWKS is fetched again
+        oidc_server.keys.rotate()
+        await cache.get_signing_key(oidc_server.keys.current[0])
+        # Within the refetch interval, unknown key IDs do not cause another fetch
+        oidc_server.keys.rotate()
+        for kid in [oidc_server.keys.current[0], "unknown"]:
+            with pytest.raises(jwt.PyJWKClientError):
+                await cache.get_signing_key(kid)
+        jwks_fetches = oidc_server.stats["jwks"]
+        offset += 31
+        return jwks_fetches, await cache.get_signing_key(oidc_server.keys.current[0])
+
+    jwks_fetches, key = asyncio.run(main())
+    assert jwks_fetches == 2
+    assert key.key_id == oidc_server.keys.current[0]
+    assert oidc_server.stats == {"discovery": 1, "jwks": 3}
+
+
+def test_persisted_copy_loaded(oidc_server, tmp_path):
+    persist_path = tmp_path / "oidc_metadata_cache.json"
+    kid = oidc_server.keys.current[0]
+    asyncio.run(make_cache(oidc_server, persist_path).fetch())
+    assert json.loads(persist_path.read_text())["oidc_server"] == oidc_server.url
+
+    # A restarted Hub verifies tokens using the persisted copy while the OIDC server is unavailable
+    oidc_server.args.fail = True
+    cache = make_cache(oidc_server, persist_path)
+    cache.load_persisted()
+    assert asyncio.run(cache.get_signing_key(kid)).key_id == kid
+    assert oidc_server.stats == {"discovery": 1, "jwks": 1}
+
+
+def test_persisted_copy_for_other_server_ignored(oidc_server, tmp_path):
+    persist_path = tmp_path / "oidc_metadata_cache.json"
+    persist_path.write_text(
+        json.dumps({"oidc_server": "https://other.example.com", "fetched_at": 0, "discovery": {}, "jwks": {"keys": []}})
+    )
+    cache = make_cache(oidc_server, persist_path)
+    cache.load_persisted()
+    assert cache.jwks is None
+
+
+def test_refresh_failure_keeps_last_good_copy(oidc_server, caplog):
+    cache = make_cache(oidc_server, refresh_interval=0.01, retry_interval=0.01)
+    kid = oidc_server.keys.current[0]
+
+    async def main():
+        await cache.fetch()
+        discovery, jwks = cache.discovery, cache.jwks
+        oidc_server.args.fail = True
+        cache.start()
+        while oidc_server.stats["discovery"] < 3:
+            await asyncio.sleep(0.01)
+        cache._refresh_task.cancel()
+        assert (cache.discovery, cache.jwks) == (discovery, jwks)
+        return await cache.get_signing_key(kid)
+
+    with caplog.at_level(logging.WARNING):
+        assert asyncio.run(main()).key_id == kid
+    assert "Failed to refresh OIDC metadata" in caplog.text
@@ -0,0 +1,80 @@
+import pytest
+
+from bricshub.cluster import ClusterSnapshot
+from bricshub.options_form import offered_runtimes, parse_options_form, render_resource_fields
+
+SCONTROL_OUTPUT = """\
+PartitionName=workq Default=YES MaxTime=04:00:00 State=UP
+PartitionName=cpu MaxTime=1-00:00:00 State=UP
+NodeName=nid001 CfgTRES=cpu=288,gres/gpu=4 AllocTRES= Partitions=workq State=IDLE
+NodeName=nid002 CfgTRES=cpu=288 AllocTRES= Partitions=cpu State=IDLE
+ReservationName=training EndTime=2026-10-17T17:00:00 PartitionName=workq Users=(null) Accounts=proj1 State=ACTIVE
+ReservationName=anywhere EndTime=2026-10-17T17:00:00 PartitionName=(null) Users=(null) Accounts=(null) State=ACTIVE
+"""
+
+SNAPSHOT = ClusterSnapshot.parse(SCONTROL_OUTPUT, fetched_at=0.0)
+RUNTIMES = ("1:00:00", "4:00:00", "12:00:00")
+
+
+def parse(partitions=(), **formdata):
+    return parse_options_form(
+        {name: [value] for name, value in formdata.items()}, SNAPSHOT, partitions, RUNTIMES, "alice", "proj1"
+    )
+
+
+def test_parse():
+    assert parse(partition="workq", ngpus="2", runtime="4:00:00") == {
+        "partition": "workq",
+        "ngpus": "2",
+        "runtime": "4:00:00",
+        "reservation": "",
+    }
+
+
+def test_parse_no_gpus():
+    assert parse(partition="cpu", ngpus="0")["ngpus"] == ""
+    assert parse(partition="cpu", ngpus="")["ngpus"] == ""
+    assert "ngpus" not in parse(partition="cpu")
+
+
+def test_parse_reservation():
+    assert parse(partition="workq", reservation="training")["reservation"] == "training"
+    assert parse(partition="cpu", reservation="anywhere")["reservation"] == "anywhere"
+
+
+@pytest.mark.parametrize(
+    "formdata, message",
+    [
+        ({"partition": "gpu"}, "Unknown partition 'gpu'"),
+        ({"partition": "workq", "ngpus": "two"}, "Invalid number of GPUs"),
+        ({"partition": "workq", "ngpus": "5"}, "at most 4 GPUs"),
+        ({"partition": "cpu", "ngpus": "1"}, "at most 0 GPUs"),
+        ({"partition": "workq", "ngpus": "-1"}, "at most 4 GPUs"),
+        ({"partition": "workq", "runtime": "2:00:00"}, "Invalid runtime"),
+        ({"partition": "workq", "runtime": "12:00:00"}, "maximum runtime of 04:00:00"),
+        ({"partition": "workq", "reservation": "other"}, "Unknown reservation"),
+        ({"partition": "cpu", "reservation": "training"}, "is for partition workq"),
+    ],
+)
+def test_parse_invalid(formdata, message):
+    with pytest.raises(ValueError, match=message):
+        parse(**formdata)
+
+
+def test_parse_partition_not_offered():
+    with pytest.raises(ValueError, match="Unknown partition 'cpu'"):
+        parse(partitions=("workq",), partition="cpu")
+
+
+def test_offered_runtimes():
+    assert offered_runtimes({"workq": SNAPSHOT.partitions["workq"]}, RUNTIMES) == ["1:00:00", "4:00:00"]
+    assert offered_runtimes(SNAPSHOT.partitions, RUNTIMES) == list(RUNTIMES)
+
+
+def test_render_resource_fields_defaults():
+    html = render_resource_fields(SNAPSHOT, ("workq",), RUNTIMES, "cpu", "8", "12:00:00")
+    assert '<option value="workq" selected>workq (default): 1 of 1 nodes idle, 4 GPUs idle' in html
+    assert "cpu" not in html
+    assert 'max="4" value="1"' in html
+    assert '<option value="1:00:00" selected>' in html
+    assert "12:00:00" not in html
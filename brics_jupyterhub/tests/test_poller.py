@@ -0,0 +1,167 @@
+import asyncio
+import logging
+
+from bricshub.poller import SlurmJobStatusPoller
+
+LOG = logging.getLogger(__name__)
+
+
+class FakeSlurm:
+    """Bulk job status query returning `out`, counting the queries run"""
+
+    def __init__(self, out: str):
+        self.out = out
+        self.queries = 0
+
+    async def run_command(self, cmd: str) -> str:
+        self.queries += 1
+        await asyncio.sleep(0)
+        return self.out
+
+
+def make_poller(slurm: FakeSlurm, max_age: float = 60.0, governor=None) -> SlurmJobStatusPoller:
+    return SlurmJobStatusPoller(slurm.run_command, lambda: "squeue", max_age, LOG, governor=governor)
+
+
+def test_parse():
+    out = "1 RUNNING node1\n  2 PENDING \n\n3 COMPLETED\n"
+    assert SlurmJobStatusPoller.parse(out) == {"1": "RUNNING node1", "2": "PENDING", "3": "COMPLETED"}
+
+
+def test_concurrent_requests_share_bulk_query():
+    slurm = FakeSlurm("1 RUNNING node1\n2 PENDING\n")
+
+    async def main():
+        poller = make_poller(slurm)
+        poller.track("1")
+        poller.track("2")
+        return await asyncio.gather(poller.get_status("1"), poller.get_status("2"), poller.get_status("3"))
+
+    assert asyncio.run(main()) == ["RUNNING node1", "PENDING", None]
+    assert slurm.queries == 1
+
+
+def test_cached_states_reused_until_max_age(monkeypatch):
+    slurm = FakeSlurm("1 RUNNING node1\n")
+    now = [100.0]
+    monkeypatch.setattr("time.monotonic", lambda: now[0])
+
+    async def main():
+        poller = make_poller(slurm)
+        poller.track("1")
+        now[0] += 1
+        await poller.get_status("1")
+        now[0] += 60
+        await poller.get_status("1")
+        now[0] += 1
+        await poller.get_status("1")
+
+    asyncio.run(main())
+    assert slurm.queries == 2
+
+
+def test_newly_tracked_job_refreshes():
+    slurm = FakeSlurm("1 RUNNING node1\n")
+
+    async def main():
+        poller = make_poller(slurm)
+        await poller.get_status("1")
+        slurm.out += "2 PENDING\n"
+        return await poller.get_status("2")
+
+    assert asyncio.run(main()) == "PENDING"
+    assert slurm.queries == 2
+
+
+def test_pending_job_count():
+    slurm = FakeSlurm("1 RUNNING node1\n2 PENDING\n")
+
+    async def main():
+        poller = make_poller(slurm)
+        poller.track("1")
+        poller.track("2")
+        await poller.refresh()
+        count = poller.pending_job_count
+        poller.track("3")
+        return count, poller.pending_job_count
+
+    assert asyncio.run(main()) == (1, 2)
+
+
+def test_untrack():
+    poller = SlurmJobStatusPoller(None, None, 60.0, LOG)
+    poller.track("1")
+    poller.track("2")
+    poller.untrack("1")
+    poller.untrack("4")
+    assert poller.tracked_job_ids == ["2"]
+
+
+def test_governor_sets_max_age():
+    class Governor:
+        def update(self, pending_jobs: int) -> float:
+            self.pending_jobs = pending_jobs
+            return 5.0
+
+    governor = Governor()
+    poller = make_poller(FakeSlurm("1 PENDING\n"), governor=governor)
+    asyncio.run(poller.get_status("1"))
+    assert poller.max_age == 5.0
+    assert governor.pending_jobs == 1
+
+
+def test_failed_query_raises_and_is_retried():
+    slurm = FakeSlurm("1 RUNNING node1\n")
+    failures = [RuntimeError("ssh failed")]
+
+    async def run_command(cmd: str) -> str:
+        if failures:
+            raise failures.pop()
+        return await slurm.run_command(cmd)
+
+    async def main():
+        poller = SlurmJobStatusPoller(run_command, lambda: "squeue", 60.0, LOG)
+        try:
+            await poller.get_status("1")
+        except RuntimeError as e:
+            error = str(e)
+        return error, await poller.get_status("1")
+
+    assert asyncio.run(main()) == ("ssh failed", "RUNNING node1")
+
+
+def test_warns_when_jobs_hidden_from_bulk_query(caplog):
+    slurm = FakeSlurm("")
+    poller = make_poller(slurm)
+
+    async def main():
+        for job_id in ["1", "2", "2", "3"]:
+            assert await poller.get_status(job_id) is None
+            poller.job_hidden(job_id)
+
+    with caplog.at_level(logging.WARNING):
+        asyncio.run(main())
+    assert [record.getMessage() for record in caplog.records] == [
+        "Bulk job status query output is missing 3 running or pending jobs (most recently job 3), "
+        "so their states are queried individually. Check that the bulk query command can see all jobs "
+        "submitted by the Hub (e.g. Slurm PrivateData=jobs hides other users' jobs from non-operators)"
+    ]
+
+
+def test_hidden_jobs_reset_when_bulk_query_shows_tracked_job(caplog):
+    slurm = FakeSlurm("")
+    poller = make_poller(slurm)
+
+    async def main():
+        for job_id in ["1", "2"]:
+            await poller.get_status(job_id)
+            poller.job_hidden(job_id)
+        slurm.out = "4 RUNNING node1\n"
+        await poller.get_status("4")
+        slurm.out = ""
+        await poller.get_status("3")
+        poller.job_hidden("3")
+
+    with caplog.at_level(logging.WARNING):
+        asyncio.run(main())
+    assert caplog.records == []
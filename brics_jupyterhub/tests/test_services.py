@@ -0,0 +1,179 @@
+import asyncio
+import json
+
+import pytest
+from traitlets.config import Config
+
+from bricshub.services import SSH_SLOT_VARIABLE, BricsHubSlurmServices, CommandError, slurm_operation
+
+
+def make_services(**settings) -> BricsHubSlurmServices:
+    config = Config()
+    for name, value in settings.items():
+        setattr(config.BricsHubSlurmServices, name, value)
+    return BricsHubSlurmServices(config=config)
+
+
+class FakeAgent:
+    """SlurmAgentClient recording requests, with every job running on node1"""
+
+    def __init__(self):
+        self.requests = []
+
+    async def request(self, op: str, **params) -> dict:
+        self.requests.append((op, params))
+        if op == "submit":
+            return {"ok": True, "job_id": "42"}
+        elif op == "query":
+            return {"ok": True, "states": {job_id: "RUNNING node1" for job_id in params["job_ids"]}}
+        return {"ok": True}
+
+
+class FakeRest:
+    """SlurmRestClient recording requests, with every job pending"""
+
+    def __init__(self):
+        self.requests = []
+
+    async def submit(self, user: str, script: str, env: dict) -> str:
+        self.requests.append(("submit", user, script, env))
+        return "43"
+
+    async def job_states(self, user: str, job_ids: list[str]) -> dict[str, str]:
+        self.requests.append(("job_states", user, job_ids))
+        return {job_id: "PENDING" for job_id in job_ids}
+
+    async def cancel(self, user: str, job_id: str) -> None:
+        self.requests.append(("cancel", user, job_id))
+
+
+async def run(services: BricsHubSlurmServices, op: str | None, cmd: str, **kwargs) -> str:
+    if op is None:
+        return await services.run_command(cmd, **kwargs)
+    with slurm_operation(op):
+        return await services.run_command(cmd, **kwargs)
+
+
+def test_run_command_runs_shell_command():
+    services = make_services()
+    assert asyncio.run(run(services, "query", "echo RUNNING node1")) == "RUNNING node1"
+    with pytest.raises(CommandError) as excinfo:
+        asyncio.run(run(services, None, "echo failed >&2; exit 3"))
+    assert (excinfo.value.returncode, excinfo.value.stderr) == (3, "failed")
+
+
+def test_run_command_sends_slurm_operations_to_agent():
+    services = make_services(slurm_agent_cmd="slurmspawner_agent")
+    services.slurm_agent = agent = FakeAgent()
+
+    async def main():
+        job_id = await run(services, "submit", "sbatch", input="#!/bin/bash", user="alice.proj", job_env={"A": "1"})
+        job_status = await run(services, "query", "squeue", user="alice.proj", job_id="42")
+        await run(services, "cancel", "scancel", user="alice.proj", job_id="42")
+        # Operations not handled by the agent still run the command
+        out = await run(services, "cluster_query", "echo PartitionName=workq")
+        return job_id, job_status, out
+
+    assert asyncio.run(main()) == ("42", "RUNNING node1", "PartitionName=workq")
+    assert agent.requests == [
+        ("submit", {"user": "alice.proj", "env": {"A": "1"}, "script": "#!/bin/bash"}),
+        ("query", {"job_ids": ["42"]}),
+        ("cancel", {"user": "alice.proj", "job_id": "42"}),
+    ]
+
+
+def test_run_command_prefers_rest_api_to_agent(tmp_path):
+    key_file = tmp_path / "jwt_key"
+    key_file.write_bytes(b"k" * 32)
+    services = make_services(
+        slurm_agent_cmd="slurmspawner_agent",
+        slurm_rest_url="http://slurmrestd:6820",
+        slurm_rest_jwt_key_file=str(key_file),
+        slurm_rest_service_user="jupyterspawner",
+    )
+    services.slurm_agent = agent = FakeAgent()
+    services.slurm_rest = rest = FakeRest()
+    services.job_status_poller.track("43")
+
+    async def main():
+        job_id = await run(services, "submit", "sbatch", input="#!/bin/bash", user="alice.proj", job_env={"A": "1"})
+        job_status = await run(services, "query", "squeue", user="alice.proj", job_id=job_id)
+        bulk = await run(services, "bulk_query", "squeue --name=spawner-jupyterhub")
+        return job_id, job_status, bulk
+
+    assert asyncio.run(main()) == ("43", "PENDING", "43 PENDING\n")
+    assert rest.requests == [
+        ("submit", "alice.proj", "#!/bin/bash", {"A": "1"}),
+        ("job_states", "alice.proj", ["43"]),
+        ("job_states", "jupyterspawner", ["43"]),
+    ]
+    assert agent.requests == []
+
+
+def test_submit_payload_replaces_submit_command_input():
+    services = make_services(submit_payload=True)
+    out = asyncio.run(run(services, "submit", "cat", input="#!/bin/bash", job_env={"A": "1"}))
+    assert json.loads(out) == {"env": {"A": "1"}, "script": "#!/bin/bash"}
+
+
+def routed_services(failing: dict[str, str]) -> tuple[BricsHubSlurmServices, list[str]]:
+    """
+    Services routing commands to login1 or login2, where commands on hosts in
+    `failing` fail with an SSH error with the given message
+    """
+    services = make_services(ssh_hosts=["login1", "login2"])
+    ran = []
+
+    async def run_shell_command(cmd: str, input: str | None = None, env: dict | None = None) -> str:
+        host = cmd.split()[1]
+        ran.append(host)
+        if host in failing:
+            raise CommandError(255, failing[host])
+        return f"RUNNING {host}"
+
+    services._run_shell_command = run_shell_command
+    return services, ran
+
+
+def test_routed_query_fails_over_after_ssh_error():
+    async def main():
+        services, ran = routed_services({"login1": "Connection reset by peer"})
+        # Route the first command to login1
+        services.host_pool.record("login2", 10.0, succeeded=True)
+        return await run(services, "query", "ssh {ssh_host} squeue"), ran
+
+    assert asyncio.run(main()) == ("RUNNING login2", ["login1", "login2"])
+
+
+def test_routed_submit_only_fails_over_if_ssh_did_not_connect():
+    async def submit(message: str):
+        services, ran = routed_services({"login1": message})
+        services.host_pool.record("login2", 10.0, succeeded=True)
+        try:
+            return await run(services, "submit", "ssh {ssh_host} sbatch"), ran
+        except CommandError:
+            return None, ran
+
+    assert asyncio.run(submit("ssh: connect to host login1 port 22: Connection refused")) == (
+        "RUNNING login2",
+        ["login1", "login2"],
+    )
+    # The job may have been submitted, so the submission is not repeated
+    assert asyncio.run(submit("Connection reset by peer")) == (None, ["login1"])
+
+
+def test_routed_command_fails_after_ssh_errors_on_every_host():
+    async def main():
+        services, ran = routed_services({"login1": "Connection reset", "login2": "Connection reset"})
+        with pytest.raises(CommandError):
+            await run(services, "query", "ssh {ssh_host} squeue")
+        return sorted(ran)
+
+    assert asyncio.run(main()) == ["login1", "login2"]
+
+
+def test_ssh_slots_assigned_round_robin(tmp_path):
+    services = make_services(ssh_control_dir=str(tmp_path / "ssh"), ssh_pool_size=2)
+    cmds = [services._assign_ssh_slot(f"ssh -S {SSH_SLOT_VARIABLE}") for _ in range(3)]
+    assert cmds == ["ssh -S 0", "ssh -S 1", "ssh -S 0"]
+    assert (tmp_path / "ssh").is_dir()
@@ -0,0 +1,227 @@
+import asyncio
+import json
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+import jwt
+import pytest
+
+from bricshub.slurmrest import SlurmRestClient, SlurmRestError, SlurmRestTokens, sbatch_job_description
+
+KEY = b"k" * 32
+
+
+def read_response(data: bytes) -> tuple[int, bool, bytes]:
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await SlurmRestClient._read_response(reader)
+
+    return asyncio.run(read())
+
+
+def test_read_response_content_length():
+    assert read_response(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n{}") == (200, True, b"{}")
+
+
+def test_read_response_without_reason_phrase():
+    assert read_response(b"HTTP/1.1 404\r\nContent-Length: 0\r\n\r\n") == (404, True, b"")
+
+
+def test_read_response_chunked():
+    data = (
+        b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+        b'3;ext=1\r\n{"a\r\n4\r\n":1}\r\n0\r\nX-Trailer: 1\r\n\r\n'
+    )
+    assert read_response(data) == (200, True, b'{"a":1}')
+
+
+def test_read_response_connection_close():
+    assert read_response(b"HTTP/1.1 200 OK\r\nConnection: close\r\nContent-Length: 0\r\n\r\n")[1] is False
+    assert read_response(b"HTTP/1.0 200 OK\r\nContent-Length: 0\r\n\r\n")[1] is False
+
+
+def test_read_response_until_eof_without_length():
+    assert read_response(b"HTTP/1.1 200 OK\r\n\r\nbody") == (200, False, b"body")
+
+
+def test_read_response_skips_interim_responses():
+    data = (
+        b"HTTP/1.1 100 Continue\r\n\r\n"
+        b"HTTP/1.1 102 Processing\r\nX: 1\r\n\r\n"
+        b"HTTP/1.1 201 Created\r\nContent-Length: 1\r\n\r\nx"
+    )
+    assert read_response(data) == (201, True, b"x")
+
+
+def test_read_response_no_content():
+    assert read_response(b"HTTP/1.1 204 No Content\r\n\r\n") == (204, True, b"")
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"garbage\r\n\r\n",
+        b"HTTP/2 200 OK\r\n\r\n",
+        b"HTTP/1.1 2000 OK\r\n\r\n",
+        b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: h2c\r\n\r\n",
+        b"HTTP/1.1 200 OK\r\nno colon\r\n\r\n",
+        b"HTTP/1.1 200 OK\r\nContent-Length: x\r\n\r\n",
+        b"HTTP/1.1 200 OK\r\nContent-Length: -1\r\n\r\n",
+        b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\n",
+        b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n1\r\nabc\r\n0\r\n\r\n",
+    ],
+)
+def test_read_response_malformed(data):
+    with pytest.raises(SlurmRestError, match="Malformed response"):
+        read_response(data)
+
+
+def test_read_response_truncated():
+    with pytest.raises(asyncio.IncompleteReadError):
+        read_response(b"HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\n{}")
+
+
+def test_sbatch_job_description():
+    script = """#!/bin/bash
+# Comment before directives
+#SBATCH --job-name=spawner-jupyterhub --partition workq
+#SBATCH -A proj1 -t 1-00:00:00 --mem=4G -c 8
+#SBATCH --gres=gpu:2 --nodes=1
+#SBATCH --export=NONE --get-user-env=L  # ignored
+#SBATCH --reservation='training session'
+
+#SBATCH --qos=high
+srun jupyterhub-singleuser
+#SBATCH --account=after-first-command
+"""
+    assert sbatch_job_description(script) == {
+        "name": "spawner-jupyterhub",
+        "partition": "workq",
+        "account": "proj1",
+        "time_limit": {"set": True, "infinite": False, "number": 24 * 60},
+        "memory_per_node": {"set": True, "infinite": False, "number": 4096},
+        "cpus_per_task": 8,
+        "tres_per_node": "gres/gpu:2",
+        "minimum_nodes": 1,
+        "maximum_nodes": 1,
+        "reservation": "training session",
+        "qos": "high",
+    }
+
+
+def test_sbatch_job_description_values():
+    script = "#!/bin/bash\n#SBATCH --time=UNLIMITED --gpus 4 -N 1-2 --mem-per-cpu=512\n"
+    assert sbatch_job_description(script) == {
+        "time_limit": {"set": True, "infinite": True},
+        "tres_per_job": "gres/gpu:4",
+        "minimum_nodes": 1,
+        "maximum_nodes": 2,
+        "memory_per_cpu": {"set": True, "infinite": False, "number": 512},
+    }
+
+
+@pytest.mark.parametrize("directive", ["--wrap=hostname", "-w nid001", "workq"])
+def test_sbatch_job_description_unsupported(directive):
+    with pytest.raises(ValueError):
+        sbatch_job_description(f"#!/bin/bash\n#SBATCH {directive}\n")
+
+
+def test_tokens_reused_and_expired_tokens_evicted(monkeypatch):
+    now = 1_000_000.0
+    monkeypatch.setattr(time, "time", lambda: now)
+    tokens = SlurmRestTokens(KEY, lifetime=100)
+    token = tokens.get("alice")
+    assert jwt.decode(token, KEY, algorithms=["HS256"], options={"verify_exp": False})["sun"] == "alice"
+    assert tokens.get("alice") == token
+
+    now += 60
+    assert tokens.get("alice") != token
+    tokens.get("bob")
+    now += 150
+    tokens.get("carol")
+    assert set(tokens._tokens) == {"carol"}
+
+
+@pytest.mark.parametrize(
+    "status,error_numbers,unavailable",
+    [
+        (500, (), True),
+        (503, (1007,), True),
+        (0, (), True),
+        # slurmrestd responds to a request for an unknown job with HTTP 500
+        (500, (2017,), False),
+        (401, (1007,), False),
+        (404, (9002,), False),
+    ],
+)
+def test_error_unavailable(status, error_numbers, unavailable):
+    assert SlurmRestError(status, "failed", error_numbers).unavailable == unavailable
+
+
+class FakeSlurmRest:
+    """slurmrestd stand-in on a Unix socket, closing connections after `requests_per_connection` requests"""
+
+    def __init__(self, requests_per_connection: int):
+        self.requests_per_connection = requests_per_connection
+        self.connections = 0
+        self.requests = []
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        for _ in range(self.requests_per_connection):
+            try:
+                request_line = await reader.readuntil(b"\r\n")
+            except asyncio.IncompleteReadError:
+                break
+            headers = {}
+            while (line := await reader.readuntil(b"\r\n")) != b"\r\n":
+                name, _, value = line.decode().partition(":")
+                headers[name.strip().lower()] = value.strip()
+            await reader.readexactly(int(headers["content-length"]))
+            self.requests.append((request_line.decode().split()[:2], headers["x-slurm-user-name"]))
+            body = json.dumps({"jobs": [{"job_id": 1, "job_state": ["RUNNING"], "batch_host": "n1"}]}).encode()
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % len(body) + body)
+            await writer.drain()
+        writer.close()
+
+
+def run_client(server: FakeSlurmRest, requests: int) -> list:
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "slurmrestd.sock"
+            unix_server = await asyncio.start_unix_server(server.handle, path=str(path))
+            client = SlurmRestClient(
+                url=f"unix://{path}",
+                api_version="v0.0.40",
+                tokens=SlurmRestTokens(KEY, lifetime=100),
+                max_connections=1,
+                idle_timeout=30,
+                timeout=5,
+                log=logging.getLogger("test"),
+            )
+            results = []
+            for _ in range(requests):
+                results.append(await client.job_states("alice"))
+                # Let the server close its end of a finished connection
+                await asyncio.sleep(0.01)
+            unix_server.close()
+            return results
+
+    return asyncio.run(run())
+
+
+def test_client_reuses_connection():
+    server = FakeSlurmRest(requests_per_connection=10)
+    assert run_client(server, 3) == [{"1": "RUNNING n1"}] * 3
+    assert server.connections == 1
+    assert server.requests == [(["GET", "/slurm/v0.0.40/jobs"], "alice")] * 3
+
+
+def test_client_retries_on_closed_connection():
+    server = FakeSlurmRest(requests_per_connection=1)
+    assert run_client(server, 3) == [{"1": "RUNNING n1"}] * 3
+    assert server.connections == 3
@@ -0,0 +1,233 @@
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from batchspawner.batchspawner import JobStatus
+from traitlets.config import Config
+
+from bricshub.services import BricsHubSlurmServices
+from bricshub.startup_timing import LAUNCHER_SOURCE
+
+# The spawner extends BricsSlurmSpawner from bricsauthenticator
+pytest.importorskip("bricsauthenticator")
+
+from bricshub.spawner import BricsHubSlurmSpawner  # noqa: E402
+
+BENCH_DIR = Path(__file__).resolve().parents[2] / "bench"
+
+
+@pytest.fixture(autouse=True)
+def clear_services():
+    yield
+    BricsHubSlurmServices.clear_instance()
+
+
+def make_spawner(batch_query_cmd: str = "echo RUNNING node1", **services) -> BricsHubSlurmSpawner:
+    """Return a spawner running `batch_query_cmd` locally, with Hub-wide `services` settings"""
+    config = Config()
+    config.BricsHubSlurmSpawner.exec_prefix = ""
+    config.BricsHubSlurmSpawner.batch_query_cmd = batch_query_cmd
+    for name, value in services.items():
+        setattr(config.BricsHubSlurmServices, name, value)
+    user = SimpleNamespace(name="alice.proj", escaped_name="alice.proj", url="/user/alice.proj/")
+    return BricsHubSlurmSpawner(config=config, user=user, req_homedir="/tmp", req_keepvars="PATH")
+
+
+async def poll_running_job(spawner: BricsHubSlurmSpawner, job_status: str = "RUNNING node1") -> tuple:
+    """Poll `spawner` with a job in `job_status`, returning the query and poll results and the spawner's job"""
+    spawner.job_id = "7"
+    spawner.job_status = job_status
+    status = await spawner.query_job_status()
+    poll = await spawner.poll()
+    return status, poll, spawner.job_id, spawner.job_status
+
+
+def test_individual_query():
+    spawner = make_spawner("echo RUNNING node2")
+    assert asyncio.run(poll_running_job(spawner)) == (JobStatus.RUNNING, None, "7", "RUNNING node2")
+
+
+def test_individual_query_of_finished_job_clears_state():
+    spawner = make_spawner("echo 'slurm_load_jobs error: Invalid job id specified' >&2; exit 1")
+    assert asyncio.run(poll_running_job(spawner)) == (JobStatus.NOTFOUND, 1, "", "")
+
+
+def test_ssh_error_keeps_running_job():
+    spawner = make_spawner("echo 'ssh: connect to host login1 port 22: Connection timed out' >&2; exit 255")
+    assert asyncio.run(poll_running_job(spawner)) == (JobStatus.UNKNOWN, None, "7", "RUNNING node1")
+
+
+def test_bulk_query():
+    spawner = make_spawner("exit 1", bulk_query_cmd="echo '7 RUNNING node2'; echo '8 PENDING'")
+    assert asyncio.run(poll_running_job(spawner)) == (JobStatus.RUNNING, None, "7", "RUNNING node2")
+
+
+def test_failed_bulk_query_falls_back_to_individual_query():
+    spawner = make_spawner("echo RUNNING node2", bulk_query_cmd="exit 1")
+    assert asyncio.run(poll_running_job(spawner)) == (JobStatus.RUNNING, None, "7", "RUNNING node2")
+
+
+def test_job_started_overrides_cached_pending_state():
+    spawner = make_spawner("exit 1", bulk_query_cmd="echo '7 PENDING'")
+    spawner.job_id = "7"
+    spawner.job_started = {"job_id": "7", "host": "node3"}
+    assert asyncio.run(poll_running_job(spawner, "PENDING")) == (JobStatus.RUNNING, None, "7", "RUNNING node3")
+
+
+def test_pending_job_queried_individually_at_min_interval(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(time, "monotonic", lambda: now)
+    spawner = make_spawner("echo PENDING")
+    spawner.job_id = "7"
+    spawner.job_status = "PENDING"
+    spawner.individual_query_min_interval = 15.0
+
+    def query() -> tuple[JobStatus, str]:
+        return asyncio.run(spawner.query_job_status()), spawner.job_status
+
+    assert query() == (JobStatus.PENDING, "PENDING")
+    # Within the interval the job is not queried, but a job start notification is used
+    spawner.batch_query_cmd = "exit 1"
+    now += 10
+    assert query() == (JobStatus.PENDING, "PENDING")
+    spawner.job_started = {"job_id": "7", "host": "node3"}
+    assert query() == (JobStatus.RUNNING, "RUNNING node3")
+    spawner.job_status = "PENDING"
+    spawner.job_started = {}
+    spawner.batch_query_cmd = "echo RUNNING node4"
+    now += 10
+    assert query() == (JobStatus.RUNNING, "RUNNING node4")
+
+
+def test_job_missing_from_bulk_query_is_queried_individually():
+    spawner = make_spawner("echo RUNNING node2", bulk_query_cmd="echo '8 RUNNING node1'")
+    assert asyncio.run(poll_running_job(spawner)) == (JobStatus.RUNNING, None, "7", "RUNNING node2")
+    # The job exists, so the bulk query did not show it
+    assert spawner._services.job_status_poller._hidden_jobs == {"7"}
+
+
+# Start of the single-user server in the batch scripts of the deployment configurations
+LAUNCHER_BATCH_SCRIPT = """{% if startup_timing_launcher %}python - {{cmd}} <<'EOF_STARTUP_LAUNCHER'
+{{startup_timing_launcher}}
+EOF_STARTUP_LAUNCHER
+{% else %}{{cmd}}
+{% endif %}echo "jupyterhub-singleuser ended gracefully"
+"""
+
+
+@pytest.mark.parametrize("enabled", [True, False])
+def test_startup_timing_launcher(enabled):
+    spawner = make_spawner()
+    spawner.batch_script = LAUNCHER_BATCH_SCRIPT
+    spawner.startup_timing_launcher = enabled
+    subvars = spawner.get_req_subvars()
+    subvars["cmd"] = "batchspawner-singleuser jupyterhub-singleuser"
+    script = spawner._fill_batch_script(asyncio.run(spawner._get_batch_script(**subvars)))
+    if enabled:
+        start = f"python - {subvars['cmd']} <<'EOF_STARTUP_LAUNCHER'\n{LAUNCHER_SOURCE}\nEOF_STARTUP_LAUNCHER\n"
+    else:
+        start = f"{subvars['cmd']}\n"
+    assert script == start + 'echo "jupyterhub-singleuser ended gracefully"'
+
+
+async def stop_slurm_agent(agent) -> None:
+    """Kill the Slurm agent process and wait for the client's tasks reading from killed agents to finish"""
+    agent._kill("Stopping Slurm agent")
+    await asyncio.gather(*(task for task in asyncio.all_tasks() if task is not asyncio.current_task()))
+
+
+def test_slurm_agent_timeout_keeps_running_job():
+    async def main():
+        # The agent never responds, so each request times out and the agent is killed
+        spawner = make_spawner(slurm_agent_cmd="exec cat > /dev/null", slurm_agent_timeout=0.1)
+        try:
+            return await poll_running_job(spawner)
+        finally:
+            await stop_slurm_agent(spawner._services.slurm_agent)
+
+    assert asyncio.run(main()) == (JobStatus.UNKNOWN, None, "7", "RUNNING node1")
+
+
+def test_slurm_agent_exit_keeps_running_job():
+    async def main():
+        spawner = make_spawner(slurm_agent_cmd="exit 1", slurm_agent_timeout=5)
+        try:
+            return await poll_running_job(spawner)
+        finally:
+            await stop_slurm_agent(spawner._services.slurm_agent)
+
+    assert asyncio.run(main()) == (JobStatus.UNKNOWN, None, "7", "RUNNING node1")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_fake_slurmrestd(state_dir: Path, key_file: Path, port: int) -> subprocess.Popen:
+    """Start bench/fake_slurmrestd.py, returning once it is listening"""
+    proc = subprocess.Popen(
+        [sys.executable, str(BENCH_DIR / "fake_slurmrestd.py"), "--port", str(port), "--jwt-key-file", str(key_file)],
+        env={**os.environ, "BENCH_STATE_DIR": str(state_dir)},
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    assert proc.stdout.readline().startswith("Fake slurmrestd listening")
+    return proc
+
+
+def test_slurm_rest_outage_keeps_running_job(tmp_path):
+    pytest.importorskip("jwt")
+    if not (BENCH_DIR / "fake_slurmrestd.py").exists():
+        pytest.skip("bench/fake_slurmrestd.py is not available")
+    (tmp_path / "jobs").mkdir()
+    # A running job, and a job which has finished (its process has exited)
+    for job_id, pid in [("7", os.getpid()), ("8", 2**22 + 1)]:
+        job = {"id": job_id, "name": "spawner-jupyterhub", "state": "RUNNING", "node": "node1", "pid": pid}
+        (tmp_path / "jobs" / f"{job_id}.json").write_text(json.dumps(job))
+    key_file = tmp_path / "jwt_key"
+    key_file.write_bytes(b"k" * 32)
+    port = free_port()
+    server = start_fake_slurmrestd(tmp_path, key_file, port)
+
+    async def main():
+        spawner = make_spawner(
+            slurm_rest_url=f"http://127.0.0.1:{port}",
+            slurm_rest_jwt_key_file=str(key_file),
+            slurm_rest_service_user="jupyterspawner",
+            bulk_query_max_age=0.1,
+        )
+        running = await poll_running_job(spawner)
+        server.terminate()
+        server.wait()
+        # Let the cached job states expire
+        await asyncio.sleep(0.2)
+        # slurmrestd is down, so the job's state is unknown rather than finished
+        outage = await poll_running_job(spawner)
+        finished_spawner = make_spawner()
+        finished_spawner.job_id = "8"
+        restarted = start_fake_slurmrestd(tmp_path, key_file, port)
+        try:
+            # A job unknown to Slurm has finished
+            finished = (await finished_spawner.query_job_status(), finished_spawner.job_id)
+        finally:
+            restarted.terminate()
+            restarted.wait()
+        return running, outage, finished
+
+    try:
+        running, outage, finished = asyncio.run(main())
+    finally:
+        server.kill()
+        server.wait()
+    assert running == (JobStatus.RUNNING, None, "7", "RUNNING node1")
+    assert outage == (JobStatus.UNKNOWN, None, "7", "RUNNING node1")
+    assert finished == (JobStatus.NOTFOUND, "8")
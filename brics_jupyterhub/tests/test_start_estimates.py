@@ -0,0 +1,79 @@
+import asyncio
+import logging
+
+import pytest
+
+from bricshub.start_estimates import StartTimeEstimates, format_wait
+
+LOG = logging.getLogger(__name__)
+
+
+def test_parse():
+    out = "101 workq,debug 1760700000 (Resources)\n102 workq N/A (Priority)\n103 workq 2026-10-17T12:00:00 None\nbad\n"
+    estimates = StartTimeEstimates.parse(out)
+    assert list(estimates) == ["101", "102", "103"]
+    assert estimates["101"].partitions == ["workq", "debug"]
+    assert estimates["101"].start_time == 1760700000.0
+    assert estimates["101"].reason == "Resources"
+    assert estimates["102"].start_time is None
+    assert estimates["102"].reason == "Priority"
+    assert estimates["103"].start_time is None
+
+
+@pytest.mark.parametrize(
+    "seconds, text",
+    [
+        (-5, "less than a minute"),
+        (20, "less than a minute"),
+        (25 * 60, "about 25 min"),
+        (2 * 3600, "about 2 h"),
+        (2 * 3600 + 5 * 60, "about 2 h 5 min"),
+    ],
+)
+def test_format_wait(seconds, text):
+    assert format_wait(seconds) == text
+
+
+def test_get_and_partition_wait(monkeypatch):
+    monkeypatch.setattr("time.time", lambda: 1000.0)
+    queries = []
+
+    async def run_command(cmd: str) -> str:
+        queries.append(cmd)
+        return "1 workq 1600 Resources\n2 workq 1200 Priority\n3 workq,cpu 2000 Priority\n4 cpu N/A Priority\n"
+
+    async def main():
+        estimates = StartTimeEstimates(run_command, lambda: "squeue", max_age=60, log=LOG)
+        estimate = await estimates.get("2")
+        missing = await estimates.get("5")
+        waits = [estimates.partition_wait(partition) for partition in ("workq", "cpu", "gpu")]
+        return estimate, missing, *waits
+
+    estimate, missing, workq, cpu, gpu = asyncio.run(main())
+    assert estimate.start_time == 1200.0
+    assert missing is None
+    assert workq == (3, 600.0)
+    assert cpu == (2, 1000.0)
+    assert gpu == (0, None)
+    assert queries == ["squeue"]
+
+
+def test_failed_query_discards_estimates():
+    outputs = [RuntimeError("squeue failed"), "1 workq N/A Priority\n"]
+
+    async def run_command(cmd: str) -> str:
+        output = outputs.pop()
+        if isinstance(output, Exception):
+            raise output
+        return output
+
+    async def main():
+        estimates = StartTimeEstimates(run_command, lambda: "squeue", max_age=60, log=LOG)
+        assert await estimates.get("1") is not None
+        estimates._refreshed_at = float("-inf")
+        with pytest.raises(RuntimeError):
+            await estimates.get("1")
+        # Not retried until the estimates would next be refreshed
+        return await estimates.get("1")
+
+    assert asyncio.run(main()) is None
@@ -0,0 +1,84 @@
+import asyncio
+import json
+import logging
+
+import pytest
+
+from bricshub.user_env import UserEnvironmentCache, export_lines
+
+LOG = logging.getLogger(__name__)
+
+
+def test_export_lines():
+    assert export_lines({"PATH": "/usr/bin", "GREETING": "it's a $HOME"}) == (
+        "export GREETING='it'\"'\"'s a $HOME'\nexport PATH=/usr/bin"
+    )
+
+
+class FakeLogin:
+    """slurmspawner_user_env, returning `env` unless the fingerprint on stdin is current"""
+
+    def __init__(self, env: dict[str, str], fingerprint: str = "f1"):
+        self.env = env
+        self.fingerprint = fingerprint
+        self.calls = []
+
+    async def run_command(self, cmd: str, stdin: str) -> str:
+        self.calls.append((cmd, stdin))
+        await asyncio.sleep(0)
+        if stdin == self.fingerprint:
+            return json.dumps({"fingerprint": self.fingerprint})
+        return json.dumps({"env": self.env, "fingerprint": self.fingerprint})
+
+
+def make_cache(login: FakeLogin, ttl: float = 60) -> UserEnvironmentCache:
+    return UserEnvironmentCache(login.run_command, ttl, ["SSH_*", "*TOKEN*"], LOG)
+
+
+def test_capture_excludes_variables():
+    login = FakeLogin({"PATH": "/usr/bin", "SSH_CLIENT": "10.0.0.1", "GH_TOKEN": "x", "BASH_FUNC_f%%": "() {}"})
+    environment = asyncio.run(make_cache(login).get("alice", lambda: "user_env"))
+    assert environment.env == {"PATH": "/usr/bin"}
+    assert environment.fingerprint == "f1"
+    assert login.calls == [("user_env", "")]
+
+
+def test_concurrent_requests_share_capture():
+    login = FakeLogin({"PATH": "/usr/bin"})
+
+    async def main():
+        cache = make_cache(login)
+        return await asyncio.gather(*(cache.get("alice", lambda: "user_env") for _ in range(3)))
+
+    first, *others = asyncio.run(main())
+    assert all(environment is first for environment in others)
+    assert len(login.calls) == 1
+
+
+def test_reused_within_ttl_and_checked_after():
+    login = FakeLogin({"PATH": "/usr/bin"})
+
+    async def main():
+        cache = make_cache(login)
+        first = await cache.get("alice", lambda: "user_env")
+        assert await cache.get("alice", lambda: "user_env") is first
+        cache.ttl = -1
+        unchanged = await cache.get("alice", lambda: "user_env")
+        login.env, login.fingerprint = {"PATH": "/opt/bin"}, "f2"
+        changed = await cache.get("alice", lambda: "user_env")
+        return first, unchanged, changed
+
+    first, unchanged, changed = asyncio.run(main())
+    assert unchanged is first
+    assert changed.env == {"PATH": "/opt/bin"}
+    assert login.calls == [("user_env", ""), ("user_env", "f1"), ("user_env", "f1")]
+
+
+@pytest.mark.parametrize("out", ["not json", "[]", '{"env": {}}', '{"fingerprint": "f1", "env": []}'])
+def test_invalid_output(out):
+    async def run_command(cmd: str, stdin: str) -> str:
+        return out
+
+    cache = UserEnvironmentCache(run_command, 60, [], LOG)
+    with pytest.raises(ValueError, match="Invalid login environment output for alice"):
+        asyncio.run(cache.get("alice", lambda: "user_env"))
@@ -0,0 +1,117 @@
+# Stage a packed Conda environment on node-local storage and activate it.
+#
+# Usage (in a bash job script): source activate_packed_env.sh <ENV_NAME>
+#
+# This file should be installed in the directory containing archives created
+# by pack_conda_env.sh. The current archive for <ENV_NAME> (named in
+# <ENV_NAME>.current) is unpacked into a per-user cache directory on
+# node-local storage the first time it is used on a node, and reused by later
+# jobs on the same node. This avoids the many metadata operations on the shared
+# filesystem caused by starting Python from an environment installed there.
+#
+# The cache is keyed by the archive checksum, which is verified when the archive
+# is unpacked. Cache entries are held in use (using a shared lock inherited by
+# the job's processes) for the lifetime of the sourcing shell. After staging,
+# least recently used entries beyond the most recent
+# JUPYTERHUB_BRICS_PACKED_ENV_CACHE_KEEP (default 2) which are not in use are
+# evicted.
+#
+# The cache directory is
+# ${JUPYTERHUB_BRICS_PACKED_ENV_CACHE_DIR:-/tmp}/brics-packed-envs-<UID>
+#
+# Returns non-zero if the environment could not be staged or activated, so that
+# the caller can fall back to activating a shared environment.
+
+_brics_packed_env_unpack() {
+  local archive=$1 checksum=$2 entry=$3
+
+  echo "Staging packed Conda environment ${archive} in ${entry}" >&2
+  if [[ "$(sha256sum "${archive}" | cut -d " " -f 1)" != "${checksum}" ]]; then
+    echo "Checksum of ${archive} does not match ${checksum}" >&2
+    return 1
+  fi
+
+  # conda-unpack fixes up prefixes for the location the environment is unpacked
+  # in, so unpack in place. A partially unpacked entry has no .complete marker
+  # and is replaced on the next attempt.
+  rm -rf "${entry}"
+  mkdir "${entry}" || return 1
+  if ! tar --extract --gzip --file="${archive}" --directory="${entry}" \
+    || ! "${entry}/bin/python" "${entry}/bin/conda-unpack"; then
+    echo "Failed to unpack ${archive} in ${entry}" >&2
+    rm -rf "${entry}"
+    return 1
+  fi
+  touch "${entry}/.complete"
+}
+
+_brics_packed_env_evict() {
+  local cache_dir=$1 keep=${JUPYTERHUB_BRICS_PACKED_ENV_CACHE_KEEP:-2} entry index=0
+
+  # Entries ordered from most to least recently used
+  for entry in $(ls -1dt "${cache_dir}"/*/ 2>/dev/null); do
+    entry=${entry%/}
+    index=$((index + 1))
+    if ((index <= keep)); then
+      continue
+    fi
+    # Only remove entries which are not locked by a running job
+    (flock --nonblock --exclusive 8 && rm -rf "${entry}" && echo "Evicted ${entry} from packed Conda environment cache" >&2) \
+      8>>"${entry}.lock" || true
+  done
+}
+
+_brics_packed_env_activate() {
+  local env_name=${1:?Usage: source activate_packed_env.sh <ENV_NAME>}
+  local packed_dir archive_name checksum cache_dir entry attempt status
+
+  packed_dir=$(dirname "$(readlink -f "${BASH_SOURCE[0]}")") || return 1
+  archive_name=$(<"${packed_dir}/${env_name}.current") || return 1
+  checksum=${archive_name#"${env_name}-"}
+  checksum=${checksum%.tar.gz}
+
+  cache_dir="${JUPYTERHUB_BRICS_PACKED_ENV_CACHE_DIR:-/tmp}/brics-packed-envs-$(id -u)"
+  mkdir -p -m u=rwx,go= "${cache_dir}" || return 1
+  if [[ -L "${cache_dir}" || ! -O "${cache_dir}" ]]; then
+    echo "${cache_dir} is not a directory owned by $(id -un)" >&2
+    return 1
+  fi
+  entry="${cache_dir}/${checksum}"
+
+  # Take an exclusive lock to unpack the archive if this has not already been
+  # done (another job on the node may be unpacking it), then hold a shared lock
+  # until the shell exits to prevent the entry being evicted while in use
+  exec {_BRICS_PACKED_ENV_LOCK_FD}>>"${entry}.lock" || return 1
+  for attempt in 1 2; do
+    if [[ ! -f "${entry}/.complete" ]]; then
+      flock --exclusive "${_BRICS_PACKED_ENV_LOCK_FD}" || return 1
+      if [[ ! -f "${entry}/.complete" ]]; then
+        _brics_packed_env_unpack "${packed_dir}/${archive_name}" "${checksum}" "${entry}" || return 1
+      fi
+    fi
+    flock --shared "${_BRICS_PACKED_ENV_LOCK_FD}" || return 1
+    # The entry may have been evicted by another job before the lock was taken
+    [[ -f "${entry}/.complete" ]] && break
+  done
+  [[ -f "${entry}/.complete" ]] || return 1
+  touch "${entry}"
+
+  _brics_packed_env_evict "${cache_dir}"
+
+  # The activate script provided by conda-pack may reference unset variables
+  case $- in
+    *u*) set +u; source "${entry}/bin/activate"; status=$?; set -u ;;
+    *) source "${entry}/bin/activate"; status=$? ;;
+  esac
+  return ${status}
+}
+
+_brics_packed_env_activate "$@"
+_brics_packed_env_status=$?
+# Release the cache entry lock on failure, so that other jobs are not blocked
+if ((_brics_packed_env_status != 0)) && [[ -n "${_BRICS_PACKED_ENV_LOCK_FD:-}" ]]; then
+  exec {_BRICS_PACKED_ENV_LOCK_FD}>&-
+  unset _BRICS_PACKED_ENV_LOCK_FD
+fi
+unset -f _brics_packed_env_unpack _brics_packed_env_evict _brics_packed_env_activate
+return ${_brics_packed_env_status}
@@ -8,19 +8,101 @@
 # privileged account.
 #
 # Usernames of the form <USER>.<PROJECT> are extracted from the environment
-# variable DEPLOY_CONFIG_DEV_USERS.
+# variable DEPLOY_CONFIG_DEV_USERS. Users which already exist are skipped, so
+# the script can be re-run (e.g. when the container restarts).
+#
+# To create thousands of synthetic users (e.g. for load testing) quickly, the
+# accounts are created in bulk: entries for all new users and their user
+# groups are appended to the account databases (/etc/passwd, /etc/shadow,
+# /etc/group, /etc/gshadow) at once, rather than running useradd(8) once per
+# user, which rewrites the databases for each user. The databases are then
+# checked using pwck(8) and grpck(8). This assumes that nothing else modifies
+# the account databases while the script runs (e.g. at container startup).
 set -euo pipefail
 
+declare -A EXISTING_USERS=()
+declare -A EXISTING_GROUPS=()
+while IFS=: read -r NAME _; do
+  EXISTING_USERS[${NAME}]=1
+done < <(getent passwd)
+while IFS=: read -r NAME _; do
+  EXISTING_GROUPS[${NAME}]=1
+done < <(getent group)
+
+# Allocate UIDs and GIDs above the highest in use in the range for non-system
+# accounts (as useradd does)
+login_defs_value() {
+  awk -v name="$1" -v default="$2" '$1 == name { value = $2 } END { print (value == "" ? default : value) }' /etc/login.defs
+}
+next_id() {
+  local db=$1 min=$2 max=$3
+  getent "${db}" | awk -F : -v min="${min}" -v max="${max}" \
+    '$3 >= min && $3 <= max && $3 > highest { highest = $3 } END { print (highest ? highest + 1 : min) }'
+}
+UID_MAX=$(login_defs_value UID_MAX 60000)
+GID_MAX=$(login_defs_value GID_MAX 60000)
+NEXT_UID=$(next_id passwd "$(login_defs_value UID_MIN 1000)" "${UID_MAX}")
+NEXT_GID=$(next_id group "$(login_defs_value GID_MIN 1000)" "${GID_MAX}")
+
+TODAY=$(($(date +%s) / 86400))
+NEW_USERS=()
+NEW_UIDS=()
+PASSWD_ENTRIES=""
+SHADOW_ENTRIES=""
+GROUP_ENTRIES=""
+GSHADOW_ENTRIES=""
 for UNIX_USERNAME in ${DEPLOY_CONFIG_DEV_USERS}; do
+  if [[ -n "${EXISTING_USERS[${UNIX_USERNAME}]:-}" ]]; then
+    continue
+  fi
+  if [[ -n "${EXISTING_GROUPS[${UNIX_USERNAME}]:-}" ]]; then
+    echo "Cannot create test user ${UNIX_USERNAME}: group ${UNIX_USERNAME} already exists" >&2
+    exit 1
+  fi
+  if ((NEXT_UID > UID_MAX || NEXT_GID > GID_MAX)); then
+    echo "Cannot create test user ${UNIX_USERNAME}: no free UID or GID" >&2
+    exit 1
+  fi
+  EXISTING_USERS[${UNIX_USERNAME}]=1
   SHORT_NAME=${UNIX_USERNAME%.*}
   PROJECT=${UNIX_USERNAME##*.}
   echo "Creating test user ${UNIX_USERNAME}, with home /home/${PROJECT}/${UNIX_USERNAME}"
-  mkdir -p /home/${PROJECT}
-  useradd --create-home \
-    --comment "${SHORT_NAME} ${PROJECT}" \
-    --home-dir /home/${PROJECT}/${UNIX_USERNAME} \
-    --user-group \
-    --shell /bin/bash \
-    --groups jupyterusers \
-    ${UNIX_USERNAME}
-done
\ No newline at end of file
+  NEW_USERS+=("${UNIX_USERNAME}")
+  NEW_UIDS+=("${NEXT_UID}:${NEXT_GID}")
+  # Entries as created by useradd --user-group without a password (locked)
+  PASSWD_ENTRIES+="${UNIX_USERNAME}:x:${NEXT_UID}:${NEXT_GID}:${SHORT_NAME} ${PROJECT}:/home/${PROJECT}/${UNIX_USERNAME}:/bin/bash"$'\n'
+  SHADOW_ENTRIES+="${UNIX_USERNAME}:!:${TODAY}:0:99999:7:::"$'\n'
+  GROUP_ENTRIES+="${UNIX_USERNAME}:x:${NEXT_GID}:"$'\n'
+  GSHADOW_ENTRIES+="${UNIX_USERNAME}:!::"$'\n'
+  NEXT_UID=$((NEXT_UID + 1))
+  NEXT_GID=$((NEXT_GID + 1))
+done
+
+if ((${#NEW_USERS[@]} == 0)); then
+  echo "No test users to create"
+  exit 0
+fi
+
+printf "%s" "${GROUP_ENTRIES}" >> /etc/group
+printf "%s" "${GSHADOW_ENTRIES}" >> /etc/gshadow
+printf "%s" "${PASSWD_ENTRIES}" >> /etc/passwd
+printf "%s" "${SHADOW_ENTRIES}" >> /etc/shadow
+pwck --read-only --quiet
+grpck --read-only
+
+# Add all new users to the jupyterusers group with a single update, keeping
+# existing members
+MEMBERS=$(getent group jupyterusers | cut -d : -f 4)
+NEW_MEMBERS=$(IFS=,; echo "${NEW_USERS[*]}")
+gpasswd -M "${MEMBERS:+${MEMBERS},}${NEW_MEMBERS}" jupyterusers
+
+# Create home directories populated from /etc/skel (as useradd --create-home)
+for INDEX in "${!NEW_USERS[@]}"; do
+  UNIX_USERNAME=${NEW_USERS[${INDEX}]}
+  HOME_DIR=/home/${UNIX_USERNAME##*.}/${UNIX_USERNAME}
+  mkdir -p "${HOME_DIR%/*}"
+  cp -a /etc/skel "${HOME_DIR}"
+  chown -R "${NEW_UIDS[${INDEX}]}" "${HOME_DIR}"
+done
+
+echo "Created ${#NEW_USERS[@]} test users"
@@ -0,0 +1,36 @@
+#!/bin/bash
+# Pack a Conda environment into a versioned archive which can be staged on
+# node-local storage by jobs using activate_packed_env.sh.
+#
+# Usage: pack_conda_env.sh <ENV_NAME> <PACKED_ENV_DIR>
+#
+# The environment is packed using conda-pack (which must be installed in the
+# active Conda installation) into <PACKED_ENV_DIR>/<ENV_NAME>-<SHA256>.tar.gz,
+# where <SHA256> is the checksum of the archive. The file
+# <PACKED_ENV_DIR>/<ENV_NAME>.current is then atomically updated to contain the
+# name of the new archive, so that newly started jobs use the new archive while
+# running jobs continue to use their staged copy of the previous one.
+#
+# Old archives are not removed, as they may be in the process of being staged
+# by running jobs.
+set -euo pipefail
+
+ENV_NAME=${1:?Usage: $0 <ENV_NAME> <PACKED_ENV_DIR>}
+PACKED_ENV_DIR=${2:?Usage: $0 <ENV_NAME> <PACKED_ENV_DIR>}
+
+mkdir -p "${PACKED_ENV_DIR}"
+TMP_ARCHIVE=$(mktemp --suffix=.tar.gz "${PACKED_ENV_DIR}/.${ENV_NAME}.XXXXXX")
+trap 'rm -f "${TMP_ARCHIVE}"' EXIT
+
+conda pack --name "${ENV_NAME}" --format tar.gz --force --output "${TMP_ARCHIVE}"
+
+CHECKSUM=$(sha256sum "${TMP_ARCHIVE}" | cut -d " " -f 1)
+ARCHIVE_NAME="${ENV_NAME}-${CHECKSUM}.tar.gz"
+chmod u=rw,go=r "${TMP_ARCHIVE}"
+mv "${TMP_ARCHIVE}" "${PACKED_ENV_DIR}/${ARCHIVE_NAME}"
+
+echo "${ARCHIVE_NAME}" > "${PACKED_ENV_DIR}/.${ENV_NAME}.current"
+chmod u=rw,go=r "${PACKED_ENV_DIR}/.${ENV_NAME}.current"
+mv "${PACKED_ENV_DIR}/.${ENV_NAME}.current" "${PACKED_ENV_DIR}/${ENV_NAME}.current"
+
+echo "Packed Conda environment ${ENV_NAME} into ${PACKED_ENV_DIR}/${ARCHIVE_NAME}"
@@ -0,0 +1,44 @@
+#!/bin/bash
+# Pack a Jupyter data directory (kernelspecs, labextensions, settings) into a
+# versioned archive which can be staged on node-local storage by jobs using
+# stage_jupyter_data.sh.
+#
+# Usage: pack_jupyter_data.sh <JUPYTER_DATA_DIR> <PACKED_DATA_DIR>
+#
+# The directory is packed into <PACKED_DATA_DIR>/jupyter-data-<SHA256>.tar.gz,
+# where <SHA256> is the checksum of the archive. The archive is created with
+# fixed file order, ownership and modification times, so that its checksum
+# depends only on the content of the directory: packing an unchanged directory
+# reuses the existing archive, and jobs keep using their staged copy. The file
+# <PACKED_DATA_DIR>/jupyter-data.current is then atomically updated to contain
+# the name of the archive, so that newly started jobs use the new archive while
+# running jobs continue to use their staged copy of the previous one.
+#
+# Old archives are not removed, as they may be in the process of being staged
+# by running jobs.
+set -euo pipefail
+
+JUPYTER_DATA_DIR=${1:?Usage: $0 <JUPYTER_DATA_DIR> <PACKED_DATA_DIR>}
+PACKED_DATA_DIR=${2:?Usage: $0 <JUPYTER_DATA_DIR> <PACKED_DATA_DIR>}
+
+mkdir -p "${PACKED_DATA_DIR}"
+TMP_ARCHIVE=$(mktemp --suffix=.tar.gz "${PACKED_DATA_DIR}/.jupyter-data.XXXXXX")
+trap 'rm -f "${TMP_ARCHIVE}"' EXIT
+
+tar --create --sort=name --owner=0 --group=0 --numeric-owner --mtime=@0 \
+  --directory="${JUPYTER_DATA_DIR}" . | gzip --no-name > "${TMP_ARCHIVE}"
+
+CHECKSUM=$(sha256sum "${TMP_ARCHIVE}" | cut -d " " -f 1)
+ARCHIVE_NAME="jupyter-data-${CHECKSUM}.tar.gz"
+if [[ -f "${PACKED_DATA_DIR}/${ARCHIVE_NAME}" ]]; then
+  echo "Jupyter data directory ${JUPYTER_DATA_DIR} is unchanged since it was packed into ${ARCHIVE_NAME}"
+else
+  chmod u=rw,go=r "${TMP_ARCHIVE}"
+  mv "${TMP_ARCHIVE}" "${PACKED_DATA_DIR}/${ARCHIVE_NAME}"
+fi
+
+echo "${ARCHIVE_NAME}" > "${PACKED_DATA_DIR}/.jupyter-data.current"
+chmod u=rw,go=r "${PACKED_DATA_DIR}/.jupyter-data.current"
+mv "${PACKED_DATA_DIR}/.jupyter-data.current" "${PACKED_DATA_DIR}/jupyter-data.current"
+
+echo "Packed Jupyter data directory ${JUPYTER_DATA_DIR} into ${PACKED_DATA_DIR}/${ARCHIVE_NAME}"
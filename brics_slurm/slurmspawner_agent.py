@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Long-running agent performing Slurm job management on behalf of JupyterHub
+
+The agent is started by JupyterHub over a single SSH session as the
+jupyterspawner service user and reads requests from stdin as newline-delimited
+JSON. Each line contains either a single request object or an array of request
+objects. One JSON response object is written to stdout per request, as each
+request completes (responses to requests in the same line may be written in any
+order).
+
+Requests have an "id" (echoed in the response) and an "op" key:
+
+* {"op": "submit", "user": <user>, "env": {<name>: <value>, ...}, "script": <script>}
+    Submit a batch script as <user> using slurmspawner_sbatch, with the
+    environment variables in "env" set. Response: {"job_id": <job_id>}
+* {"op": "query", "job_ids": [<job_id>, ...]}
+    Get the status of jobs. All queries in the same line are answered by a
+    single squeue call. Response: {"states": {<job_id>: "<state> <host>", ...}},
+    omitting jobs not found by squeue.
+* {"op": "cancel", "user": <user>, "job_id": <job_id>}
+    Cancel a job as <user> using slurmspawner_scancel. Response: {}
+* {"op": "ping"}
+    Check the agent is responsive. Response: {}
+
+Responses contain "ok": true on success, or "ok": false and an "error" message.
+
+Commands for submit and cancel are run as the requesting user using the same
+`sudo` rules as commands run directly over SSH by JupyterHub. Queries are run
+as the user running the agent.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import sys
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--wrappers-bin",
+        required=True,
+        help="directory containing slurmspawner_{sbatch,scancel} scripts",
+    )
+    parser.add_argument(
+        "--squeue",
+        default="squeue",
+        help="squeue command used to query job states (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--job-name",
+        default="",
+        help="if set, query all jobs with this name rather than requested job IDs",
+    )
+    parser.add_argument(
+        "--sudo",
+        default="sudo",
+        help=(
+            "sudo command used to run commands as requesting user, empty to run as current user "
+            "(default: %(default)s)"
+        ),
+    )
+    return parser.parse_args()
+
+
+class SlurmAgent:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.write_lock = asyncio.Lock()
+
+    def as_user(self, user: str, env: dict[str, str], command: str) -> list[str]:
+        """Return argv to run `command` as `user` with environment variables `env`"""
+        assignments = [f"{name}={value}" for name, value in env.items()]
+        if self.args.sudo:
+            return [self.args.sudo, "-u", user, *assignments, command]
+        return ["env", *assignments, command]
+
+    async def run(self, argv: list[str], input: str | None = None) -> str:
+        """Run `argv`, returning stdout or raising RuntimeError containing stderr"""
+        proc = await asyncio.create_subprocess_exec(
+            *argv,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        out, err = await proc.communicate(input.encode() if input is not None else None)
+        if proc.returncode != 0:
+            raise RuntimeError(f"{argv[-1]} exited with status {proc.returncode}: {err.decode().strip()}")
+        return out.decode()
+
+    async def submit(self, request: dict) -> dict:
+        out = await self.run(
+            self.as_user(request["user"], request.get("env", {}), f"{self.args.wrappers_bin}/slurmspawner_sbatch"),
+            input=request["script"],
+        )
+        return {"job_id": out.strip()}
+
+    async def cancel(self, request: dict) -> dict:
+        await self.run(
+            self.as_user(
+                request["user"],
+                {"SLURMSPAWNER_JOB_ID": str(request["job_id"])},
+                f"{self.args.wrappers_bin}/slurmspawner_scancel",
+            )
+        )
+        return {}
+
+    async def query(self, job_ids: list[str]) -> dict[str, str]:
+        """Return states of `job_ids` (or all jobs named --job-name) using a single squeue call"""
+        argv = [self.args.squeue, "--noheader", "--format=%i %T %B"]
+        if self.args.job_name:
+            argv.append(f"--name={self.args.job_name}")
+        elif job_ids:
+            argv.append(f"--jobs={','.join(job_ids)}")
+        else:
+            return {}
+        states = {}
+        for line in (await self.run(argv)).splitlines():
+            job_id, _, job_status = line.strip().partition(" ")
+            if job_id:
+                states[job_id] = job_status.strip()
+        return states
+
+    async def respond(self, request_id, coro) -> None:
+        try:
+            response = {"id": request_id, "ok": True, **(await coro)}
+        except Exception as e:
+            response = {"id": request_id, "ok": False, "error": str(e) or type(e).__name__}
+        async with self.write_lock:
+            sys.stdout.write(json.dumps(response) + "\n")
+            sys.stdout.flush()
+
+    async def handle_line(self, line: str) -> None:
+        try:
+            requests = json.loads(line)
+        except json.JSONDecodeError as e:
+            await self.respond(None, self.fail(f"Invalid request: {e}"))
+            return
+        if isinstance(requests, dict):
+            requests = [requests]
+
+        # Answer all queries in this line using a single squeue call
+        queries = [r for r in requests if r.get("op") == "query"]
+        if queries:
+            job_ids = sorted({str(job_id) for r in queries for job_id in r.get("job_ids", [])})
+            states = asyncio.ensure_future(self.query(job_ids))
+
+        tasks = []
+        for request in requests:
+            op = request.get("op")
+            if op == "submit":
+                coro = self.submit(request)
+            elif op == "cancel":
+                coro = self.cancel(request)
+            elif op == "query":
+                coro = self.filter_states(states, request.get("job_ids", []))
+            elif op == "ping":
+                coro = self.ping()
+            else:
+                coro = self.fail(f"Unknown op: {op}")
+            tasks.append(self.respond(request.get("id"), coro))
+        await asyncio.gather(*tasks)
+
+    @staticmethod
+    async def filter_states(states: asyncio.Future, job_ids: list[str]) -> dict:
+        all_states = await asyncio.shield(states)
+        return {"states": {str(job_id): all_states[str(job_id)] for job_id in job_ids if str(job_id) in all_states}}
+
+    @staticmethod
+    async def ping() -> dict:
+        return {}
+
+    @staticmethod
+    async def fail(message: str) -> dict:
+        raise ValueError(message)
+
+    async def serve(self) -> None:
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=2**24)
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+        tasks = set()
+        while line := await reader.readline():
+            if not line.strip():
+                continue
+            task = asyncio.ensure_future(self.handle_line(line.decode()))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+
+
+def main() -> None:
+    asyncio.run(SlurmAgent(parse_args()).serve())
+
+
+if __name__ == "__main__":
+    main()
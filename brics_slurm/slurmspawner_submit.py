@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Submit a batch job described by a JSON payload read from stdin
+
+Reads a single JSON object from stdin of the form
+
+    {"env": {<name>: <value>, ...}, "script": <script>}
+
+and runs slurmspawner_sbatch with the environment variables in "env" set and
+the batch script on its stdin, passing through its output (the job ID) and exit
+status. JupyterHub runs this script as the user via `sudo` (like
+slurmspawner_sbatch) when BricsHubSlurmServices.submit_payload is set, so that
+the environment of the single-user server does not need to be expanded into
+`VAR=value` arguments on the command line run over SSH.
+
+Only variables which `sudo` passes through to the wrapper scripts (see
+jupyterspawner_sudoers) can be set, so the payload cannot set variables which
+could not be set on the command line. The script exits with status 2 if the
+payload is invalid.
+"""
+
+from __future__ import annotations
+
+import argparse
+import fnmatch
+import json
+import os
+import subprocess
+import sys
+
+# Patterns of variable names which may be set, matching env_keep in
+# jupyterspawner_sudoers
+ALLOWED_ENV_VARS = ("SLURMSPAWNER_JOB_ID", "JUPYTERHUB_*", "JPY_API_TOKEN", "USER", "HOME", "SHELL")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--sbatch",
+        default=os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), "slurmspawner_sbatch"),
+        help="command used to submit the batch script (default: slurmspawner_sbatch in this script's directory)",
+    )
+    return parser.parse_args()
+
+
+def read_payload() -> tuple[dict[str, str], str]:
+    """Return the environment variables and batch script from the payload on stdin, or raise ValueError"""
+    try:
+        payload = json.load(sys.stdin)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"payload is not valid JSON: {e}") from e
+    if not isinstance(payload, dict) or not isinstance(payload.get("script"), str):
+        raise ValueError('payload must be an object with a "script" string')
+    env = payload.get("env", {})
+    if not isinstance(env, dict) or not all(isinstance(value, str) for value in env.values()):
+        raise ValueError('"env" must be an object with string values')
+    rejected = sorted(
+        name for name in env if not any(fnmatch.fnmatchcase(name, pattern) for pattern in ALLOWED_ENV_VARS)
+    )
+    if rejected:
+        raise ValueError(f"variables not allowed: {', '.join(rejected)}")
+    return env, payload["script"]
+
+
+def main() -> int:
+    args = parse_args()
+    try:
+        env, script = read_payload()
+    except ValueError as e:
+        print(f"slurmspawner_submit: invalid payload: {e}", file=sys.stderr)
+        return 2
+    return subprocess.run([args.sbatch], input=script, text=True, env={**os.environ, **env}).returncode
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Capture the login environment of the user running this script as JSON
+
+Runs the user's login shell (as `su - <user> -c env` does for
+`sbatch --get-user-env`) in a minimal environment and writes a single JSON
+object to stdout of the form
+
+    {"env": {<name>: <value>, ...}, "fingerprint": <fingerprint>}
+
+where <fingerprint> identifies the state of the shell startup files read by
+login shells (their paths, sizes and modification times). JupyterHub runs this
+script as the user via `sudo` (like slurmspawner_sbatch) when
+BricsHubSlurmSpawner.user_env_cmd is set, caches the environment, and passes it
+to jobs in the batch script, so that jobs do not need to run a login shell at
+start.
+
+If the fingerprint of a previously captured environment is given on stdin and
+the startup files are unchanged, the login shell is not run and the output is
+{"fingerprint": <fingerprint>} (without "env"), so that checking whether a
+cached environment is still current is cheap.
+
+The script exits with non-zero status if the login shell fails or does not
+complete within --timeout seconds.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import pwd
+import subprocess
+import sys
+
+# Shell startup files read by login shells (and interactive shells started by
+# them) of common shells, relative to the home directory if not absolute
+STARTUP_FILES = (
+    "/etc/environment",
+    "/etc/profile",
+    "/etc/profile.d",
+    "/etc/bash.bashrc",
+    "/etc/bashrc",
+    "/etc/zprofile",
+    "/etc/zshenv",
+    "/etc/csh.login",
+    "/etc/csh.cshrc",
+    ".bash_profile",
+    ".bash_login",
+    ".profile",
+    ".bashrc",
+    ".zshenv",
+    ".zprofile",
+    ".zshrc",
+    ".login",
+    ".cshrc",
+    ".tcshrc",
+)
+
+# Written by the login shell before the environment, separating it from any
+# output of the startup files
+MARKER = "__SLURMSPAWNER_USER_ENV__"
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--timeout", type=float, default=30.0, help="seconds to wait for the login shell (default: %(default)s)"
+    )
+    return parser.parse_args()
+
+
+def fingerprint(user: pwd.struct_passwd) -> str:
+    """Return a fingerprint of the login shell and the state of its startup files"""
+    paths = [user.pw_shell]
+    for name in STARTUP_FILES:
+        path = os.path.join(user.pw_dir, name)
+        paths.append(path)
+        if os.path.isdir(path):
+            paths.extend(os.path.join(path, entry) for entry in sorted(os.listdir(path)))
+    state = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            state.append((path, None))
+        else:
+            state.append((path, st.st_size, st.st_mtime_ns))
+    return hashlib.sha256(json.dumps(state).encode()).hexdigest()
+
+
+def login_env(user: pwd.struct_passwd, timeout: float) -> dict[str, str]:
+    """Return the environment of a login shell of `user`, started in a minimal environment"""
+    base_env = {
+        "HOME": user.pw_dir,
+        "SHELL": user.pw_shell,
+        "USER": user.pw_name,
+        "LOGNAME": user.pw_name,
+        "PATH": "/usr/local/bin:/usr/bin:/bin",
+    }
+    proc = subprocess.run(
+        [user.pw_shell, "-l", "-c", f"printf '%s\\0' {MARKER}; env -0"],
+        env=base_env,
+        cwd=user.pw_dir,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        timeout=timeout,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"login shell exited with status {proc.returncode}: {proc.stderr.decode().strip()}")
+    out = proc.stdout.decode(errors="replace")
+    _, found, env_out = out.partition(MARKER + "\0")
+    if not found:
+        raise RuntimeError("login shell did not output its environment")
+    return dict(item.split("=", 1) for item in env_out.split("\0") if "=" in item)
+
+
+def main() -> int:
+    args = parse_args()
+    user = pwd.getpwuid(os.getuid())
+    previous = sys.stdin.read().strip() if not sys.stdin.isatty() else ""
+    current = fingerprint(user)
+    if previous == current:
+        json.dump({"fingerprint": current}, sys.stdout)
+        return 0
+    try:
+        env = login_env(user, args.timeout)
+    except (OSError, subprocess.SubprocessError, RuntimeError) as e:
+        print(f"slurmspawner_user_env: failed to capture login environment: {e}", file=sys.stderr)
+        return 1
+    json.dump({"env": env, "fingerprint": current}, sys.stdout)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
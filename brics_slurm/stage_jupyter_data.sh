@@ -0,0 +1,116 @@
+# Stage a packed Jupyter data directory on node-local storage and add it to
+# JUPYTER_PATH.
+#
+# Usage (in a bash job script): source stage_jupyter_data.sh
+#
+# This file should be installed in the directory containing archives created
+# by pack_jupyter_data.sh. The current archive (named in jupyter-data.current)
+# is unpacked into a per-user cache directory on node-local storage the first
+# time it is used on a node, and reused by later jobs on the same node. The
+# unpacked directory is prepended to JUPYTER_PATH, so that Jupyter server
+# startup, JupyterLab page loads and kernelspec listings read kernelspecs,
+# labextensions and settings from node-local storage rather than walking the
+# Jupyter data directory on the shared filesystem.
+#
+# The cache is keyed by the archive checksum, which is verified when the archive
+# is unpacked. Cache entries are held in use (using a shared lock inherited by
+# the job's processes) for the lifetime of the sourcing shell. After staging,
+# least recently used entries beyond the most recent
+# JUPYTERHUB_BRICS_JUPYTER_DATA_CACHE_KEEP (default 2) which are not in use are
+# evicted.
+#
+# The cache directory is
+# ${JUPYTERHUB_BRICS_JUPYTER_DATA_CACHE_DIR:-/tmp}/brics-jupyter-data-<UID>
+#
+# The cache is per-user, rather than shared by all users on the node, because
+# a user able to write to a shared entry could add kernelspecs run by other
+# users' servers.
+#
+# Returns non-zero if the directory could not be staged, so that the caller can
+# fall back to using the Jupyter data directory on the shared filesystem.
+
+_brics_jupyter_data_unpack() {
+  local archive=$1 checksum=$2 entry=$3
+
+  echo "Staging packed Jupyter data directory ${archive} in ${entry}" >&2
+  if [[ "$(sha256sum "${archive}" | cut -d " " -f 1)" != "${checksum}" ]]; then
+    echo "Checksum of ${archive} does not match ${checksum}" >&2
+    return 1
+  fi
+
+  # A partially unpacked entry has no .complete marker and is replaced on the
+  # next attempt
+  rm -rf "${entry}"
+  mkdir "${entry}" || return 1
+  if ! tar --extract --gzip --no-same-owner --file="${archive}" --directory="${entry}"; then
+    echo "Failed to unpack ${archive} in ${entry}" >&2
+    rm -rf "${entry}"
+    return 1
+  fi
+  touch "${entry}/.complete"
+}
+
+_brics_jupyter_data_evict() {
+  local cache_dir=$1 keep=${JUPYTERHUB_BRICS_JUPYTER_DATA_CACHE_KEEP:-2} entry index=0
+
+  # Entries ordered from most to least recently used
+  for entry in $(ls -1dt "${cache_dir}"/*/ 2>/dev/null); do
+    entry=${entry%/}
+    index=$((index + 1))
+    if ((index <= keep)); then
+      continue
+    fi
+    # Only remove entries which are not locked by a running job
+    (flock --nonblock --exclusive 8 && rm -rf "${entry}" && echo "Evicted ${entry} from Jupyter data cache" >&2) \
+      8>>"${entry}.lock" || true
+  done
+}
+
+_brics_jupyter_data_stage() {
+  local packed_dir archive_name checksum cache_dir entry attempt
+
+  packed_dir=$(dirname "$(readlink -f "${BASH_SOURCE[0]}")") || return 1
+  archive_name=$(<"${packed_dir}/jupyter-data.current") || return 1
+  checksum=${archive_name#jupyter-data-}
+  checksum=${checksum%.tar.gz}
+
+  cache_dir="${JUPYTERHUB_BRICS_JUPYTER_DATA_CACHE_DIR:-/tmp}/brics-jupyter-data-$(id -u)"
+  mkdir -p -m u=rwx,go= "${cache_dir}" || return 1
+  if [[ -L "${cache_dir}" || ! -O "${cache_dir}" ]]; then
+    echo "${cache_dir} is not a directory owned by $(id -un)" >&2
+    return 1
+  fi
+  entry="${cache_dir}/${checksum}"
+
+  # Take an exclusive lock to unpack the archive if this has not already been
+  # done (another job on the node may be unpacking it), then hold a shared lock
+  # until the shell exits to prevent the entry being evicted while in use
+  exec {_BRICS_JUPYTER_DATA_LOCK_FD}>>"${entry}.lock" || return 1
+  for attempt in 1 2; do
+    if [[ ! -f "${entry}/.complete" ]]; then
+      flock --exclusive "${_BRICS_JUPYTER_DATA_LOCK_FD}" || return 1
+      if [[ ! -f "${entry}/.complete" ]]; then
+        _brics_jupyter_data_unpack "${packed_dir}/${archive_name}" "${checksum}" "${entry}" || return 1
+      fi
+    fi
+    flock --shared "${_BRICS_JUPYTER_DATA_LOCK_FD}" || return 1
+    # The entry may have been evicted by another job before the lock was taken
+    [[ -f "${entry}/.complete" ]] && break
+  done
+  [[ -f "${entry}/.complete" ]] || return 1
+  touch "${entry}"
+
+  _brics_jupyter_data_evict "${cache_dir}"
+
+  export JUPYTER_PATH=${entry}${JUPYTER_PATH:+:}${JUPYTER_PATH:-}
+}
+
+_brics_jupyter_data_stage
+_brics_jupyter_data_status=$?
+# Release the cache entry lock on failure, so that other jobs are not blocked
+if ((_brics_jupyter_data_status != 0)) && [[ -n "${_BRICS_JUPYTER_DATA_LOCK_FD:-}" ]]; then
+  exec {_BRICS_JUPYTER_DATA_LOCK_FD}>&-
+  unset _BRICS_JUPYTER_DATA_LOCK_FD
+fi
+unset -f _brics_jupyter_data_unpack _brics_jupyter_data_evict _brics_jupyter_data_stage
+return ${_brics_jupyter_data_status}
@@ -16,9 +16,67 @@ def get_env_var_value(var_name: str) -> str:
     except KeyError as e:
         raise RuntimeError(f"Environment variable {var_name} must be set") from e
 
+def get_optional_env_var_value(var_name: str, default: str) -> str:
+    from os import environ
+    return environ.get(var_name, default)
+
 # Set default log level
 c.Application.log_level = get_env_var_value("DEPLOY_CONFIG_LOG_LEVEL")
 
+# Optionally write structured (JSON lines) logs to a file in JUPYTERHUB_LOG_DIR,
+# rotated daily or at 100 MiB and compressed, keeping 14 rotated files. Log
+# records are written by a background thread, so logging does not block the
+# event loop (see bricshub.log). Records are also written to stderr as JSON.
+if get_optional_env_var_value("DEPLOY_CONFIG_LOG_FORMAT", "text").lower() == "json":
+    c.JupyterHub.logging_config = {
+        "handlers": {
+            "json": {
+                "()": "bricshub.log.make_queued_handler",
+                "level": get_env_var_value("DEPLOY_CONFIG_LOG_LEVEL"),
+                "filename": str(Path(get_env_var_value("JUPYTERHUB_LOG_DIR")) / "jupyterhub.log"),
+                "max_bytes": 100 * 1024 * 1024,
+                "rotate_interval": 24 * 60 * 60,
+                "backup_count": 14,
+                "compress": True,
+            },
+        },
+        "loggers": {"JupyterHub": {"handlers": ["json"]}},
+    }
+
+# Optionally record each spawn as an OpenTelemetry trace (see bricshub.tracing),
+# exported to an OTLP (HTTP) endpoint (e.g. http://collector:4318/v1/traces)
+# and/or written as JSON lines to traces.jsonl in JUPYTERHUB_LOG_DIR. Spans are
+# exported by a background thread, so tracing does not block the event loop.
+TRACING_OTLP_ENDPOINT = get_optional_env_var_value("DEPLOY_CONFIG_TRACING_OTLP_ENDPOINT", "")
+TRACING_FILE = get_optional_env_var_value("DEPLOY_CONFIG_TRACING_FILE", "false").lower() == "true"
+if TRACING_OTLP_ENDPOINT or TRACING_FILE:
+    from bricshub.tracing import configure_tracing
+
+    configure_tracing(
+        otlp_endpoint=TRACING_OTLP_ENDPOINT,
+        file=str(Path(get_env_var_value("JUPYTERHUB_LOG_DIR")) / "traces.jsonl") if TRACING_FILE else "",
+    )
+
+# The JupyterHub database is SQLite in JUPYTERHUB_SRV_DIR by default, tuned for
+# low commit latency: write-ahead log (WAL) journal mode with synchronous=NORMAL
+# (commits do not wait for fsync, but the most recent commits may be lost if
+# the host crashes; set dbSqliteSynchronous to "FULL" to sync every commit).
+# Alternatively, set DEPLOY_CONFIG_DB_URL to use a PostgreSQL server (e.g.
+# postgresql://jupyterhub@db.example:5432/jupyterhub), with the password in a
+# libpq password file JUPYTERHUB_SRV_DIR/pgpass (see start-jupyterhub), and a
+# pool of DEPLOY_CONFIG_DB_POOL_SIZE connections (see bricshub.db).
+from bricshub.db import enable_sqlite_pragmas, pool_kwargs, sqlite_pragmas
+c.JupyterHub.db_url = get_optional_env_var_value("DEPLOY_CONFIG_DB_URL", "") or "sqlite:///jupyterhub.sqlite"
+if c.JupyterHub.db_url.startswith("sqlite"):
+    enable_sqlite_pragmas(
+        sqlite_pragmas(
+            journal_mode=get_optional_env_var_value("DEPLOY_CONFIG_DB_SQLITE_JOURNAL_MODE", "WAL"),
+            synchronous=get_optional_env_var_value("DEPLOY_CONFIG_DB_SQLITE_SYNCHRONOUS", "NORMAL"),
+        )
+    )
+else:
+    c.JupyterHub.db_kwargs = pool_kwargs(pool_size=int(get_optional_env_var_value("DEPLOY_CONFIG_DB_POOL_SIZE", "5")))
+
 # The JupyterHub public proxy should listen on localhost, with a base URL
 # from environment variable DEPLOY_CONFIG_BASE_URL. The Zenith client will
 # proxy user traffic to localhost.
@@ -38,16 +96,19 @@ c.JupyterHub.hub_bind_url = "http://:8081"
 # * https://jupyterhub.readthedocs.io/en/latest/reference/authenticators.html#authentication-state
 # * https://github.com/isambard-sc/bricsauthenticator/blob/main/src/bricsauthenticator/bricsauthenticator.py
 
-# Use BriCS-customised Authenticator class (registered as entry point by
-# bricsauthenticator package)
-c.JupyterHub.authenticator_class = "brics"
+# Use BriCS-customised Authenticator class (BricsAuthenticator registered as
+# entry point by bricsauthenticator package), extended with deployment-specific
+# behaviour by the bricshub package installed in the JupyterHub container image
+c.JupyterHub.authenticator_class = "bricshub.authenticator.BricsHubAuthenticator"
 
 # Don't shut down single-user servers when Hub is shut down. This allows the hub
 # to restart and reconnect to running user servers
 c.JupyterHub.cleanup_servers = False
 
-# Use BriCS-customised SlurmSpawner class
-c.JupyterHub.spawner_class = "brics"
+# Use BriCS-customised SlurmSpawner class (BricsSlurmSpawner registered as
+# entry point by bricsauthenticator package), extended with deployment-specific
+# behaviour by the bricshub package installed in the JupyterHub container image
+c.JupyterHub.spawner_class = "bricshub.spawner.BricsHubSlurmSpawner"
 
 # Since the Hub API is listening on all interfaces, spawners will by default use
 # the hostname of the JupyterHub container to connect to Hub API, which will not
@@ -75,19 +136,72 @@ c.Spawner.environment = {
     "JUPYTERHUB_BRICS_JUPYTER_DATA_DIR": get_env_var_value("DEPLOY_CONFIG_JUPYTER_DATA_DIR")
 }
 
+# Optionally activate a packed copy of the Jupyter user environment staged on
+# node-local storage in spawned jobs, rather than the environment installed
+# under DEPLOY_CONFIG_CONDA_PREFIX_DIR on the shared filesystem (see
+# `batch_script` below). The packed environment directory contains archives
+# created by pack_conda_env.sh and activate_packed_env.sh, which unpacks the
+# current archive into a per-user cache under the node-local cache directory.
+PACKED_CONDA_ENV_DIR = get_optional_env_var_value("DEPLOY_CONFIG_PACKED_CONDA_ENV_DIR", "")
+if PACKED_CONDA_ENV_DIR:
+    c.Spawner.environment.update(
+        {
+            "JUPYTERHUB_BRICS_PACKED_ENV_DIR": PACKED_CONDA_ENV_DIR,
+            "JUPYTERHUB_BRICS_PACKED_ENV_CACHE_DIR": get_optional_env_var_value(
+                "DEPLOY_CONFIG_PACKED_CONDA_ENV_CACHE_DIR", "/tmp"
+            ),
+        }
+    )
+
+# Optionally stage a packed copy of the Jupyter data directory (kernelspecs,
+# labextensions, settings) on node-local storage in spawned jobs, and add it to
+# JUPYTER_PATH in place of DEPLOY_CONFIG_JUPYTER_DATA_DIR on the shared
+# filesystem (see `batch_script` below), so that Jupyter server startup,
+# JupyterLab page loads and kernelspec listings do not walk the shared
+# filesystem. The packed data directory contains archives created by
+# pack_jupyter_data.sh and stage_jupyter_data.sh, which unpacks the current
+# archive into a per-user cache under DEPLOY_CONFIG_PACKED_JUPYTER_DATA_CACHE_DIR
+# (defaulting to the packed Conda environment cache directory).
+#
+# The cache is per UID, so that users cannot add kernelspecs run by other
+# users' servers: each user's first job on a node after the data directory is
+# packed again unpacks the archive (one extra tar extraction in that job's
+# startup), and each node holds up to JUPYTERHUB_BRICS_JUPYTER_DATA_CACHE_KEEP
+# copies per user who has run jobs on it. Choose a cache directory with space
+# for a copy per active user on each node.
+PACKED_JUPYTER_DATA_DIR = get_optional_env_var_value("DEPLOY_CONFIG_PACKED_JUPYTER_DATA_DIR", "")
+if PACKED_JUPYTER_DATA_DIR:
+    c.Spawner.environment.update(
+        {
+            "JUPYTERHUB_BRICS_PACKED_JUPYTER_DATA_DIR": PACKED_JUPYTER_DATA_DIR,
+            "JUPYTERHUB_BRICS_JUPYTER_DATA_CACHE_DIR": get_optional_env_var_value(
+                "DEPLOY_CONFIG_PACKED_JUPYTER_DATA_CACHE_DIR",
+                get_optional_env_var_value("DEPLOY_CONFIG_PACKED_CONDA_ENV_CACHE_DIR", "/tmp"),
+            ),
+        }
+    )
+
 # Default notebook directory is the user's home directory (`~` is expanded)
 c.Spawner.notebook_dir = '~/'
 
 # Allow up to 7 mins (420s) for user session to queue and start
 c.Spawner.start_timeout = 420
 
-# Set poll interval (for running Jupyter servers) to 60s to reduce Slurm RPCs
-# (the default is 30s)
-c.BricsSlurmSpawner.poll_interval = 60
-
-# Set poll interval (during Jupyter server startup) to 15s to reduce Slurm RPCs
-# (the default is 0.5s)
-c.BricsSlurmSpawner.startup_poll_interval = 15
+# Set poll interval (for running Jupyter servers) to 30s (the default). Polls
+# are answered from job states cached by a single bulk Slurm query shared by all
+# spawners (see `bulk_query_cmd` below), so the number of Slurm RPCs depends on
+# `bulk_query_max_age` rather than the poll interval and number of users
+c.BricsSlurmSpawner.poll_interval = 30
+
+# Set poll interval (during Jupyter server startup) to 1s (the default is 0.5s).
+# During startup, job states are read from the cache shared by all spawners
+# (see `bulk_query_cmd` below) and the batch script notifies the spawner when
+# the job starts running (see `batch_script` below), so frequent startup polls
+# do not generate additional Slurm RPCs. Polls which cannot be answered this way
+# (e.g. if `bulk_query_cmd` is unset or a job is missing from its output) fall
+# back to querying the job individually at most every 15s
+# (`individual_query_min_interval`), rather than every startup poll
+c.BricsSlurmSpawner.startup_poll_interval = 1
 
 def get_ssh_key_file() -> Path:
     """
@@ -125,11 +239,53 @@ c.BricsSlurmSpawner.req_srun = "srun --export=ALL"
 # When running JupyterHub in a context where we want to execute workload scheduler
 # commands on a different machine (e.g. from within a container), we can run scheduler
 # commands on the remote host over SSH by adding `ssh <hostname>` to the exec_prefix.
+#
+# The {ssh_options} template variable is provided by BricsHubSlurmSpawner (from
+# the Hub-wide BricsHubSlurmServices settings below) and adds OpenSSH
+# connection multiplexing options, so that commands are run as new sessions
+# over a pool of persistent master connections to the SSH host rather than each
+# command performing a full TCP connection, key exchange and authentication
+# handshake.
+#
+# DEPLOY_CONFIG_SSH_HOSTNAME may list several equivalent SSH hosts (e.g. login
+# nodes) separated by spaces. The {ssh_host} template variable is replaced by
+# the host each command is routed to when it is run (see `ssh_hosts` below).
 SSH_CMD=["ssh",
+    "{ssh_options}",
     "-i", str(get_ssh_key_file()),
-    f"jupyterspawner@{get_env_var_value('DEPLOY_CONFIG_SSH_HOSTNAME')}", "sudo -u {username}",
+    "jupyterspawner@{ssh_host}",
 ]
-c.BricsSlurmSpawner.exec_prefix = " ".join(SSH_CMD)
+c.BricsSlurmSpawner.exec_prefix = " ".join(SSH_CMD + ["sudo -u {username}"])
+
+# Settings shared by all spawners (SSH connections, the job state cache,
+# admission control, the Slurm agent and REST API backends, and the cluster
+# resource snapshot) are set on BricsHubSlurmServices, which is built once
+# from this configuration when the Hub starts (see bricshub.services).
+#
+# Route each command to the healthy SSH host with the fewest running commands
+# and lowest recent latency. Hosts are probed by running `true` over SSH every
+# 30s, and are not used after 3 consecutive SSH failures until a probe or
+# command succeeds. Commands failing with an SSH error are retried on another
+# host where safe (job status queries and cancellations, or submissions which
+# failed to connect). Since Slurm job IDs are cluster-wide, any host can query
+# or cancel any job.
+c.BricsHubSlurmServices.ssh_hosts = get_env_var_value("DEPLOY_CONFIG_SSH_HOSTNAME").split()
+c.BricsHubSlurmServices.ssh_probe_cmd = " ".join(SSH_CMD + ["true"])
+c.BricsHubSlurmServices.ssh_probe_interval = 30
+
+# Share up to 4 SSH master connections between all spawners. Each connection can
+# carry up to sshd's MaxSessions (default 10) concurrent commands.
+c.BricsHubSlurmServices.ssh_pool_size = 4
+
+# Close SSH master connections after 5 mins (300s) without any commands. Polling
+# running servers (see poll_interval) keeps connections open while servers are
+# running.
+c.BricsHubSlurmServices.ssh_control_persist = 300
+
+# Detect dead SSH master connections after 3 unanswered keepalive messages sent
+# every 15s. The next command using a closed connection's pool slot reconnects.
+c.BricsHubSlurmServices.ssh_server_alive_interval = 15
+c.BricsHubSlurmServices.ssh_server_alive_count_max = 3
 
 # Batch submission command which explicitly sets environment for sbatch, passing 
 # as options to `sudo` from `exec_prefix`
@@ -174,13 +330,185 @@ c.BricsSlurmSpawner.batch_submit_cmd = " ".join(
 ]
 )
 
+# Optionally send the environment variables in `keepvars` and the batch script
+# to the slurmspawner_submit wrapper script as a single JSON payload on stdin,
+# rather than expanding every variable into a `VAR="value"` argument as above.
+# The submit command is then short and the same for every spawn, and the
+# values of the variables are not parsed (and so need no quoting) by the local
+# and remote shells. slurmspawner_submit sets the variables (only those `sudo`
+# would pass through) and runs slurmspawner_sbatch with the batch script. The
+# script slurmspawner_submit.py must be installed as slurmspawner_submit in
+# DEPLOY_CONFIG_SLURMSPAWNER_WRAPPERS_BIN and allowed by the sudoers policy
+# (this is done in the Slurm container image).
+if get_optional_env_var_value("DEPLOY_CONFIG_SLURM_SUBMIT_PAYLOAD", "false").lower() == "true":
+    c.BricsHubSlurmServices.submit_payload = True
+    c.BricsSlurmSpawner.batch_submit_cmd = f"{SLURMSPAWNER_WRAPPERS_BIN}/slurmspawner_submit"
+
+# Optionally capture each user's login environment using the
+# slurmspawner_user_env wrapper script (run as the user, like
+# slurmspawner_sbatch), cache it in the Hub and set it in the batch script (see
+# `batch_script` below), rather than having Slurm run a login shell for the
+# user when each job starts (`--get-user-env=L`), which is slow on busy nodes.
+# The cached environment is checked after 1h, and a login shell is only run
+# again if the user's shell startup files have changed. If the environment
+# cannot be captured, the job uses `--get-user-env=L`. The script
+# slurmspawner_user_env.py must be installed as slurmspawner_user_env in
+# DEPLOY_CONFIG_SLURMSPAWNER_WRAPPERS_BIN and allowed by the sudoers policy
+# (this is done in the Slurm container image).
+if get_optional_env_var_value("DEPLOY_CONFIG_USER_ENV_CACHE", "false").lower() == "true":
+    c.BricsHubSlurmSpawner.user_env_cmd = f"{SLURMSPAWNER_WRAPPERS_BIN}/slurmspawner_user_env"
+    c.BricsHubSlurmServices.user_env_ttl = 3600
+
 # For `batch_query_cmd` and `batch_cancel_cmd`, passing through environment
 # variables in `keepvars` is not necessary. However, we must still set the
 # environment to pass the required SLURMSPAWNER_JOB_ID environment variable to
 # the `slurmspawner_{scancel,squeue}` wrapper scripts, since these receive
 # parameters via environment variables (not command line arguments).
-c.BricsSlurmSpawner.batch_query_cmd = "SLURMSPAWNER_JOB_ID={{job_id}} " + f"{SLURMSPAWNER_WRAPPERS_BIN}/slurmspawner_squeue"
-c.BricsSlurmSpawner.batch_cancel_cmd = "SLURMSPAWNER_JOB_ID={{job_id}} " + f"{SLURMSPAWNER_WRAPPERS_BIN}/slurmspawner_scancel"
+c.BricsSlurmSpawner.batch_query_cmd = (
+    "SLURMSPAWNER_JOB_ID={{job_id}} " + f"{SLURMSPAWNER_WRAPPERS_BIN}/slurmspawner_squeue"
+)
+c.BricsSlurmSpawner.batch_cancel_cmd = (
+    "SLURMSPAWNER_JOB_ID={{job_id}} " + f"{SLURMSPAWNER_WRAPPERS_BIN}/slurmspawner_scancel"
+)
+
+# Query the status of all jobs submitted by JupyterHub (identified by the
+# job name set in `batch_script`) using a single `squeue` command, run as the
+# jupyterspawner service user (i.e. not prefixed with `sudo`). The job states
+# are cached and shared by all spawners, so the number of Slurm RPCs used to
+# poll jobs does not grow with the number of users. Jobs missing from the
+# output (e.g. jobs which have finished) are queried individually using
+# `batch_query_cmd` to confirm their state.
+#
+# Required Slurm permissions: jobs run as their users, so jupyterspawner can
+# only see them if Slurm's PrivateData setting does not include `jobs`, or if
+# jupyterspawner is a Slurm operator or administrator (e.g.
+# `sacctmgr modify user jupyterspawner set adminlevel=operator`). Otherwise the
+# Hub's jobs are missing from the output, every poll falls back to an
+# individual query, and the Hub logs a warning that the bulk query output is
+# missing running or pending jobs. The same applies to `start_estimate_cmd`.
+#
+# The output format matches that of `slurmspawner_squeue`, with the job ID
+# prepended. As with `batch_submit_cmd`, the command run by `ssh` is
+# double-quoted so that the single quotes around the `squeue` format string
+# are passed through to the remote shell.
+c.BricsHubSlurmServices.bulk_query_cmd = " ".join(
+    SSH_CMD + ["\"squeue --noheader --name=spawner-jupyterhub --format='%i %T %B'\""]
+)
+
+# Refresh cached job states at most once every 30s
+c.BricsHubSlurmServices.bulk_query_max_age = 30
+
+# Adjust the interval between bulk queries (starting at bulk_query_max_age) to
+# the load on the SSH host and slurmctld: double it (up to 120s) while the
+# average latency of Slurm commands is above 2s or more than 10% of commands
+# fail, and halve it (down to 5s) while jobs are pending and Slurm is idle, so
+# that job starts are detected sooner. Changes are logged with their reason
+# and exported as Prometheus metrics (bricshub_poll_governor_*).
+c.BricsHubSlurmServices.adaptive_polling = True
+c.BricsHubSlurmServices.adaptive_polling_min_age = 5
+c.BricsHubSlurmServices.adaptive_polling_max_age = 120
+c.BricsHubSlurmServices.adaptive_polling_latency_target = 2
+c.BricsHubSlurmServices.adaptive_polling_max_error_rate = 0.1
+
+# Limit the number of jobs queried individually at once across all spawners
+# (e.g. to confirm the state of jobs missing from the bulk query output), and
+# when the Hub restarts and reconnects to running servers (see
+# `cleanup_servers` above), delay individual queries for restored jobs by a
+# random time of up to 5s. This prevents a restart opening hundreds of SSH
+# sessions at once, which could exceed the SSH server's MaxStartups limit.
+c.BricsHubSlurmServices.individual_query_concurrency = 8
+c.BricsHubSlurmSpawner.restart_query_jitter = 5
+
+# Limit the number of job submissions running at once across all spawners.
+# When many users start servers at once (e.g. at the start of a training
+# session), further submissions wait in a Hub-wide queue, rather than all
+# running `batch_submit_cmd` (an SSH session and `sbatch`) at once and
+# overloading the SSH host and slurmctld. Waiting submissions (and individual
+# job status queries, limited above) are admitted in round-robin order across
+# projects, and users see their position in the queue on the spawn progress
+# page.
+c.BricsHubSlurmServices.submit_concurrency = 4
+
+# Optionally run Slurm commands via a single long-running slurmspawner_agent
+# process on the SSH host, started over SSH when first needed. Job submission,
+# status queries and cancellation are sent to the agent's stdin as JSON
+# requests, rather than starting a new `ssh` session (and Python interpreter
+# for the wrapper scripts) per command. The agent runs the
+# `slurmspawner_{sbatch,scancel}` wrapper scripts as the user via `sudo` (as
+# above) and answers all status queries received together with a single
+# `squeue` command run as the jupyterspawner service user.
+if get_optional_env_var_value("DEPLOY_CONFIG_SLURM_AGENT", "false").lower() == "true":
+    c.BricsHubSlurmServices.slurm_agent_cmd = " ".join(
+        SSH_CMD
+        + [
+            f"{SLURMSPAWNER_WRAPPERS_BIN}/slurmspawner_agent",
+            f"--wrappers-bin={SLURMSPAWNER_WRAPPERS_BIN}",
+            "--job-name=spawner-jupyterhub",
+        ]
+    )
+
+# Optionally submit, query and cancel jobs using the Slurm REST API
+# (slurmrestd) at DEPLOY_CONFIG_SLURM_REST_URL rather than running Slurm
+# commands over SSH (or via the Slurm agent), so that these operations do not
+# start a process or open an SSH session. Requests are sent over a pool of up to
+# 8 persistent HTTP connections and authenticated as each user with a JWT
+# signed by JupyterHub using the cluster's Slurm JWT key (the file set as
+# `AuthAltParameters=jwt_key` in slurm.conf, at
+# DEPLOY_CONFIG_SLURM_REST_JWT_KEY_FILE). Bulk job status queries are made as
+# the jupyterspawner service user, which must be able to see all users' jobs.
+# The job is described by the #SBATCH directives of `batch_script` (below).
+# slurmrestd does not run a login shell for the user when the job starts, so
+# `--get-user-env` is ignored: set DEPLOY_CONFIG_USER_ENV_CACHE (above) to set
+# the user's login environment in the batch script.
+SLURM_REST_URL = get_optional_env_var_value("DEPLOY_CONFIG_SLURM_REST_URL", "")
+if SLURM_REST_URL:
+    c.BricsHubSlurmServices.slurm_rest_url = SLURM_REST_URL
+    c.BricsHubSlurmServices.slurm_rest_jwt_key_file = get_optional_env_var_value(
+        "DEPLOY_CONFIG_SLURM_REST_JWT_KEY_FILE", str(Path(get_env_var_value("JUPYTERHUB_SRV_DIR")) / "slurm_jwt_key")
+    )
+    c.BricsHubSlurmServices.slurm_rest_service_user = "jupyterspawner"
+    c.BricsHubSlurmServices.slurm_rest_max_connections = 8
+
+# Optionally show a spawn options form for choosing the job's partition,
+# number of GPUs, runtime and reservation (the `partition`, `ngpus`, `runtime`
+# and `reservation` variables in `batch_script`). The form is rendered from a
+# snapshot of the cluster's partitions, idle nodes and GPUs, and active
+# reservations, taken in the background every 60s using `scontrol` run as the
+# jupyterspawner service user, so showing the form never runs a Slurm command.
+# If no snapshot is younger than 10 minutes (e.g. while Slurm is unreachable),
+# the form is not shown and jobs are submitted with the defaults below.
+# Partitions offered in the form can be restricted (space-separated list),
+# otherwise all partitions which are up are offered.
+if get_optional_env_var_value("DEPLOY_CONFIG_SPAWN_OPTIONS_FORM", "false").lower() == "true":
+    c.BricsHubSlurmServices.cluster_query_cmd = " ".join(
+        SSH_CMD
+        + [
+            "\"scontrol --oneliner show partition; scontrol --oneliner show node;"
+            " scontrol --oneliner show reservation\""
+        ]
+    )
+    c.BricsHubSlurmServices.cluster_refresh_interval = 60
+    c.BricsHubSlurmServices.cluster_max_staleness = 600
+    c.BricsHubSlurmSpawner.options_form_partitions = get_optional_env_var_value(
+        "DEPLOY_CONFIG_SPAWN_OPTIONS_FORM_PARTITIONS", ""
+    ).split()
+    # Optionally ask users to confirm before submitting to a partition in which
+    # pending jobs are typically expected to wait longer than this (in minutes)
+    c.BricsHubSlurmSpawner.start_estimate_max_wait = 60 * float(
+        get_optional_env_var_value("DEPLOY_CONFIG_SPAWN_OPTIONS_FORM_MAX_QUEUE_WAIT", "0")
+    )
+
+# Show the time Slurm expects pending jobs to start on the spawn progress page
+# (and the typical wait in each partition in the spawn options form). Expected
+# start times of all pending jobs are fetched with a single `squeue --start`
+# query, run at most once every 60s while any user is waiting, rather than one
+# query per user. As with `bulk_query_cmd`, `exec_prefix` is not prepended.
+# SLURM_TIME_FORMAT=%s makes squeue print start times as Unix timestamps, which
+# do not depend on the time zone of the login node or of this container.
+c.BricsHubSlurmServices.start_estimate_cmd = " ".join(
+    SSH_CMD + ["\"SLURM_TIME_FORMAT=%s squeue --noheader --start --format='%i %P %S %r'\""]
+)
+c.BricsHubSlurmServices.start_estimate_max_age = 60
 
 # On Isambard-AI, no need to specify memory per node when --gpus is used to
 # request a number of GH200s because memory is allocated based on the number of
@@ -189,6 +517,14 @@ c.BricsSlurmSpawner.batch_cancel_cmd = "SLURMSPAWNER_JOB_ID={{job_id}} " + f"{SL
 #c.BricsSlurmSpawner.req_memory = "0"
 # Request a single node for Jupyter session, preventing multi-GPU jobs from being spread over nodes
 c.BricsSlurmSpawner.req_options = "--nodes=1"
+# Start the single-user server in the batch script using the startup timing
+# launcher, which reports the times at which startup phases complete (see
+# `batch_script` below). If disabled, the server is started directly and
+# startup phases are not recorded.
+c.BricsHubSlurmSpawner.startup_timing_launcher = (
+    get_optional_env_var_value("DEPLOY_CONFIG_STARTUP_TIMING_LAUNCHER", "true").lower() == "true"
+)
+
 # Based on default for SlurmSpawner
 # https://github.com/jupyterhub/batchspawner/blob/fe5a893eaf9eb5e121cbe36bad2e69af798e6140/batchspawner/batchspawner.py#L675
 c.BricsSlurmSpawner.batch_script = """#!/bin/bash
@@ -196,8 +532,8 @@ c.BricsSlurmSpawner.batch_script = """#!/bin/bash
 #SBATCH --job-name=spawner-jupyterhub
 #SBATCH --chdir={{homedir}}
 #SBATCH --export={{keepvars}}
-#SBATCH --get-user-env=L
-{% if partition  %}#SBATCH --partition={{partition}}
+{% if not user_env_exports %}#SBATCH --get-user-env=L
+{% endif %}{% if partition  %}#SBATCH --partition={{partition}}
 {% endif %}{% if runtime    %}#SBATCH --time={{runtime}}
 {% endif %}{% if memory     %}#SBATCH --mem={{memory}}
 {% endif %}{% if gres       %}#SBATCH --gres={{gres}}
@@ -206,16 +542,66 @@ c.BricsSlurmSpawner.batch_script = """#!/bin/bash
 {% endif %}{% if reservation%}#SBATCH --reservation={{reservation}}
 {% endif %}{% if options    %}#SBATCH {{options}}{% endif %}
 
+{% if user_env_exports %}# Login environment of the user, captured and cached by JupyterHub
+{{user_env_exports}}
+{% endif %}
 set -euo pipefail
 
-source ${JUPYTERHUB_BRICS_CONDA_PREFIX_DIR}/bin/activate jupyter-user-env
-
-export JUPYTER_PATH=${JUPYTERHUB_BRICS_JUPYTER_DATA_DIR}${JUPYTER_PATH:+:}${JUPYTER_PATH:-}
+# Record times at which startup phases complete (from CLOCK_BOOTTIME, as in
+# /proc/uptime), which are reported to JupyterHub by the launcher used to start
+# the single-user server (see below)
+read -r BRICS_STARTUP_SCRIPT_START _ </proc/uptime
+BRICS_STARTUP_SCRIPT_START_UNIX=$(date +%s.%N)
+export BRICS_STARTUP_SCRIPT_START BRICS_STARTUP_SCRIPT_START_UNIX
+
+if [[ -n "${JUPYTERHUB_BRICS_PACKED_ENV_DIR:-}" ]]; then
+  source "${JUPYTERHUB_BRICS_PACKED_ENV_DIR}/activate_packed_env.sh" jupyter-user-env || {
+    echo "Failed to activate packed Conda environment, activating shared environment"
+    source ${JUPYTERHUB_BRICS_CONDA_PREFIX_DIR}/bin/activate jupyter-user-env
+  }
+else
+  source ${JUPYTERHUB_BRICS_CONDA_PREFIX_DIR}/bin/activate jupyter-user-env
+fi
+
+if [[ -n "${JUPYTERHUB_BRICS_PACKED_JUPYTER_DATA_DIR:-}" ]]; then
+  source "${JUPYTERHUB_BRICS_PACKED_JUPYTER_DATA_DIR}/stage_jupyter_data.sh" || {
+    echo "Failed to stage packed Jupyter data directory, using shared directory"
+    export JUPYTER_PATH=${JUPYTERHUB_BRICS_JUPYTER_DATA_DIR}${JUPYTER_PATH:+:}${JUPYTER_PATH:-}
+  }
+else
+  export JUPYTER_PATH=${JUPYTERHUB_BRICS_JUPYTER_DATA_DIR}${JUPYTER_PATH:+:}${JUPYTER_PATH:-}
+fi
+
+read -r BRICS_STARTUP_ENV_ACTIVATED _ </proc/uptime
+export BRICS_STARTUP_ENV_ACTIVATED
+
+# Notify the spawner that the job is running on this host using the batchspawner
+# Hub API handler, so that JupyterHub does not need to wait for the next job
+# status poll. If the notification fails, the spawner falls back to polling.
+python - <<'EOF_NOTIFY' || echo "Failed to notify JupyterHub of job start"
+import json, os, socket, urllib.request
+host = os.environ.get("SLURMD_NODENAME", socket.gethostname())
+body = dict(job_started=dict(job_id=os.environ["SLURM_JOB_ID"], host=host))
+request = urllib.request.Request(
+    os.environ["JUPYTERHUB_API_URL"] + "/batchspawner",
+    data=json.dumps(body).encode(),
+    headers={"Authorization": "token " + os.environ["JUPYTERHUB_API_TOKEN"], "Content-Type": "application/json"},
+    method="POST",
+)
+urllib.request.urlopen(request, timeout=10)
+EOF_NOTIFY
 
 trap 'echo SIGTERM received' TERM
 {{prologue}}
-{% if srun %}{{srun}} {% endif %}{{cmd}}
-echo "jupyterhub-singleuser ended gracefully"
+# Start the single-user server using a launcher which records the times at
+# which the Jupyter server is imported and starts listening, and reports the
+# startup phase times to JupyterHub (see bricshub.startup_launcher), or
+# directly if the launcher is disabled (BricsHubSlurmSpawner.startup_timing_launcher)
+{% if startup_timing_launcher %}{% if srun %}{{srun}} {% endif %}python - {{cmd}} <<'EOF_STARTUP_LAUNCHER'
+{{startup_timing_launcher}}
+EOF_STARTUP_LAUNCHER
+{% else %}{% if srun %}{{srun}} {% endif %}{{cmd}}
+{% endif %}echo "jupyterhub-singleuser ended gracefully"
 {{epilogue}}
 """
 
@@ -227,6 +613,18 @@ echo "jupyterhub-singleuser ended gracefully"
 # claim from the JWT received by Authenticator to the Spawner.
 c.Authenticator.enable_auth_state = True
 
+# Optionally store auth_state compactly (only the name and Unix username of
+# each project, omitting usernames of the usual form <USER>.<PROJECT>).
+# auth_state is compacted by an Authenticator.post_auth_hook before it is
+# stored, and BricsHubSlurmSpawner expands it before running
+# Spawner.auth_state_hook (see bricshub.auth_state). Disabled by default: the
+# REST API then returns the compact form, and the memory saved has not been
+# measured (see bench/spawn_storm.py --compact-auth-state).
+if get_optional_env_var_value("DEPLOY_CONFIG_AUTH_STATE_COMPACT", "false").lower() == "true":
+    from bricshub.auth_state import compact_auth_state_hook
+
+    c.Authenticator.post_auth_hook = compact_auth_state_hook
+
 # Use dev Keycloak as OpenID provider (used to get OIDC config, JWT signing key etc.)
 c.BricsAuthenticator.oidc_server = get_env_var_value('DEPLOY_CONFIG_OIDC_SERVER')
 
@@ -242,6 +640,26 @@ c.BricsAuthenticator.jwt_audience = get_env_var_value('DEPLOY_CONFIG_JWT_AUDIENC
 # Set leeway (in seconds) for validating time-based claims in the JWT.
 c.BricsAuthenticator.jwt_leeway = 5
 
+# Cache the claims of up to 1024 verified JWTs until each token expires (or for
+# at most 5 mins), so that repeated requests carrying the same (potentially
+# large) JWT skip signature verification and parsing. Cache hits and misses
+# are exported as Prometheus metrics at /hub/metrics.
+c.BricsHubAuthenticator.jwt_cache_size = 1024
+c.BricsHubAuthenticator.jwt_cache_max_ttl = 300
+
+# Keep the OIDC server's discovery document and signing keys (JWKS) in a cache
+# refreshed in the background every 5 mins, so that verifying tokens does not
+# wait for (or fail because of) a slow or unavailable OIDC server. Tokens signed
+# with an unknown key ID cause the JWKS to be fetched immediately (without
+# blocking the event loop), at most once every 30s. The last good copy is
+# stored under JUPYTERHUB_SRV_DIR (persistent volume), so that a restarted Hub
+# can verify tokens before contacting the OIDC server.
+c.BricsHubAuthenticator.oidc_cache_refresh_interval = 300
+c.BricsHubAuthenticator.oidc_cache_unknown_kid_refetch_interval = 30
+c.BricsHubAuthenticator.oidc_cache_persist_path = str(
+    Path(get_env_var_value("JUPYTERHUB_SRV_DIR")) / "oidc_metadata_cache.json"
+)
+
 # Set (relative) logout redirect URL to the Zenith-server-managed OAuth2 Proxy sign_out
 # endpoint with subsequent redirection to the service's base URL. This URL is redirected to after
 # JupyterHub has handled its logout (clearing JupyterHub cookies) and causes OAuth2 Proxy's session